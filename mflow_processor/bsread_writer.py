@@ -1,25 +1,31 @@
 from logging import getLogger
 from threading import Event, Thread
-from collections import deque
-from time import sleep
-
-import h5py
+from time import perf_counter
 
 from mflow import mflow
 from mflow_nodes.processors.base import BaseProcessor
-from mflow_processor.utils.h5_utils import create_folder_if_does_not_exist
+from mflow_processor.utils.bsread_columns import DEFAULT_WRITE_BATCH_SIZE, get_message_size
+from mflow_processor.utils.bsread_write_job import BsreadWriteJob, validate_write_job
+from mflow_processor.utils.frame_dump import DEFAULT_FRAME_DUMP_SIZE
+from mflow_processor.utils.message_queue import QUEUE_OVERFLOW_POLICIES
+from mflow_processor.utils.pulse_ring_buffer import PulseIdRingBuffer, DEFAULT_RING_MEMORY_SIZE
+from mflow_processor.utils.statistics import ProcessorStatistics
 from bsread import dispatcher, SUB
 from bsread.handlers import compact
 
 BSREAD_START_TIMEOUT = 2
 BUFFER_SIZE = 100
+# Buffer counters of the write jobs, summed in the writer statistics.
+WRITE_JOB_COUNTERS = ("buffered_messages", "dropped_messages", "spilled_messages", "blocked_messages")
 
 
 class BsreadWriter(BaseProcessor):
     """
     H5 bsread writer
 
-    Writes the received stream to a HDF5 file.
+    Writes the received stream to a HDF5 file: a dataset (and an is_valid mask) for each channel, the pulse_id and
+    the global timestamp of each pulse. Several write jobs, each with its own file, channels and pulse_id window,
+    can write the stream at the same time.
 
     Writer commands:
         start                          Starts the writer, overwriting the output file if exists.
@@ -29,8 +35,23 @@ class BsreadWriter(BaseProcessor):
         channels                       Channels to request from the dispatching layer.
         output_file                    File to write the stream to.
         receive_timeout                Timeout to use when receiving data from the dispatching layer.
-        start_pulse_id                 Initial pulse_id to be saved in hdf5 file
+        start_pulse_id                 Initial pulse_id to be saved in hdf5 file. Can be up to buffer_memory_size
+                                       bytes of messages in the past.
         end_pulse_id                   Last pulse_id to be saved in hdf5 file
+        write_batch_size               Number of pulses to write to the file at once. 100 is default.
+        buffer_memory_size             Memory for the received messages kept for retroactive writing, in bytes.
+                                       256 MB is default.
+        buffer_size                    Number of messages to buffer between receiving and writing. 100 is default.
+        buffer_overflow_policy         What to do when the buffer is full while writing: "block" the receiving,
+                                       "drop_oldest" message or "spill" to a memory mapped file. "drop_oldest"
+                                       is default.
+        spill_file                     File to spill the messages to. None is default - output_file with '.spill'
+                                       suffix. The write_jobs always use their output_file with '.spill' suffix.
+        spill_file_size                Size of the spill file in bytes. 1 GB is default.
+        write_jobs                     Additional write jobs to start, list of dictionaries with output_file,
+                                       start_pulse_id, and optionally channels (subset of the channels) and
+                                       end_pulse_id. A job with only output_file and end_pulse_id sets the
+                                       end_pulse_id of the running job writing to output_file.
     """
     _logger = getLogger(__name__)
 
@@ -49,12 +70,30 @@ class BsreadWriter(BaseProcessor):
 
         # Parameters with default value.
         self.receive_timeout = 1000
-
-        self._buffer = deque(maxlen=BUFFER_SIZE)
+        self.write_batch_size = DEFAULT_WRITE_BATCH_SIZE
+        self.buffer_memory_size = DEFAULT_RING_MEMORY_SIZE
+        self.buffer_size = BUFFER_SIZE
+        self.buffer_overflow_policy = "drop_oldest"
+        self.spill_file = None
+        self.spill_file_size = DEFAULT_FRAME_DUMP_SIZE
+        self.write_jobs = None
+
+        # Latest messages, for writing from a start_pulse_id in the past.
+        self._ring_buffer = PulseIdRingBuffer(DEFAULT_RING_MEMORY_SIZE)
+        # Running write jobs, each with its own buffer of the messages received while writing.
+        self._jobs = []
+        # Job of the output_file, start_pulse_id and end_pulse_id parameters.
+        self._default_job = None
+        # Output file -> statistics of the finished write jobs.
+        self._finished_jobs_statistics = {}
+
+        # Channels metadata from the last data header: channel name -> {"name", "type", "shape"...}.
+        self._data_header = None
+        self._channels_metadata = {}
 
         self._receiving_thread = None
-        self._writing_thread = None
         self._running_event = Event()
+        self._statistics = ProcessorStatistics()
 
     def _validate_parameters(self):
         """
@@ -63,12 +102,33 @@ class BsreadWriter(BaseProcessor):
         """
         error_message = ""
 
-        if not self.output_file:
+        if not self.output_file and (not self.write_jobs or self.start_pulse_id is not None):
             error_message += "Parameter 'output_file' not set.\n"
 
         if not self.channels:
             error_message += "No channels specified.\n"
 
+        if not self.write_batch_size or self.write_batch_size < 1:
+            error_message += "Parameter 'write_batch_size' must be a positive number.\n"
+
+        if not self.buffer_memory_size or self.buffer_memory_size < 1:
+            error_message += "Parameter 'buffer_memory_size' must be a positive number.\n"
+
+        if not self.buffer_size or self.buffer_size < 1:
+            error_message += "Parameter 'buffer_size' must be a positive number.\n"
+
+        if self.buffer_overflow_policy not in QUEUE_OVERFLOW_POLICIES:
+            error_message += "Parameter 'buffer_overflow_policy' must be one of %s.\n" % (QUEUE_OVERFLOW_POLICIES,)
+
+        if self.buffer_overflow_policy == "spill" and (not self.spill_file_size or self.spill_file_size < 1):
+            error_message += "Parameter 'spill_file_size' must be a positive number.\n"
+
+        for job_parameters in self.write_jobs or []:
+            try:
+                validate_write_job(job_parameters)
+            except ValueError as e:
+                error_message += str(e)
+
         if error_message:
             self._logger.error(error_message)
             raise ValueError(error_message)
@@ -89,15 +149,29 @@ class BsreadWriter(BaseProcessor):
                 if message_data is None:
                     continue
 
-                self._buffer.append(message_data)
-                self._logger.debug('Buffer %d (%d)', message_data.data.pulse_id, len(self._buffer))
+                fan_out_start = perf_counter()
+
+                # The data header changes only when the channels change.
+                data_header = getattr(handler, "data_header", None)
+                if data_header is not None and data_header is not self._data_header:
+                    self._data_header = data_header
+                    self._channels_metadata = {channel["name"]: channel for channel in data_header.get("channels", [])}
+
+                    for job in self._jobs:
+                        job.channels_metadata = self._channels_metadata
+
+                self._ring_buffer.put(message_data.data.pulse_id, message_data, get_message_size(message_data.data))
 
-                # launch an hdf5 writing thread upon start_pulse setup
-                if self.start_pulse_id:
-                    self._logger.info('Start writing thread.')
-                    self._writing_thread = Thread(target=self.write_messages, args=(self.start_pulse_id,))
-                    self._writing_thread.start()
-                    self.start_pulse_id = None
+                # The decoded message is shared by all the write jobs.
+                for job in self._jobs:
+                    job.put(message_data)
+
+                self._logger.debug('Buffer %d (%d)', message_data.data.pulse_id, len(self._ring_buffer))
+
+                self._update_write_jobs()
+
+                self._statistics.record_stage("fan_out", fan_out_start)
+                self._statistics.record_frame(fan_out_start, 0)
 
         except:
             self._logger.exception("Error while receiving bsread stream.")
@@ -105,50 +179,122 @@ class BsreadWriter(BaseProcessor):
         finally:
             self._running_event.clear()
 
-    def write_messages(self, start_pulse_id):
-        self._logger.info("Writing channels to output_file '%s'.", self.output_file)
-
-        try:
-            first_iteration = True
+    def _update_write_jobs(self):
+        """
+        Close the finished write jobs and start the requested ones. Runs in the receiving thread, so no message is
+        missed between the buffered messages and the ones received while writing.
+        """
+        for job in [job for job in self._jobs if not job.is_running]:
+            self._close_write_job(job)
+
+        # launch the hdf5 writing job upon start_pulse setup, once the previous one is done
+        if self.start_pulse_id and self._default_job not in self._jobs:
+            if not self.output_file:
+                self._logger.error("Parameter 'output_file' not set, cannot write from pulse_id %d.",
+                                   self.start_pulse_id)
+            elif any(job.output_file == self.output_file for job in self._jobs):
+                self._logger.error("A write job for '%s' is already running.", self.output_file)
+            else:
+                self._default_job = self._start_write_job(self.output_file, self.start_pulse_id, self.end_pulse_id,
+                                                          spill_file=self.spill_file)
+            self.start_pulse_id = None
+            self.end_pulse_id = None
+
+        elif self.end_pulse_id and self._default_job in self._jobs:
+            self._default_job.end_pulse_id = self.end_pulse_id
+            self.end_pulse_id = None
+
+        if self.write_jobs:
+            write_jobs, self.write_jobs = self.write_jobs, None
+
+            for job_parameters in write_jobs:
+                try:
+                    validate_write_job(job_parameters)
+                except ValueError as e:
+                    self._logger.error("Invalid write job: %s", e)
+                    continue
 
-            if start_pulse_id < self._buffer[0].data.pulse_id:
-                self._logger.warning("start_pulse_id < oldest buffered message pulse_id")
+                running_job = next((job for job in self._jobs if job.output_file == job_parameters["output_file"]),
+                                   None)
 
-            with h5py.File(self.output_file, 'w') as h5_file:
-                while self._running_event.is_set():
-                    if len(self._buffer) == 0:
-                        sleep(0.1)  # wait for more messages being buffered
-                        continue
+                if job_parameters.get("start_pulse_id") is None:
+                    if running_job is None:
+                        self._logger.warning("No running write job for '%s'.", job_parameters["output_file"])
+                    else:
+                        running_job.end_pulse_id = job_parameters["end_pulse_id"]
+                    continue
 
-                    # process the oldest buffered message
-                    next_msg = self._buffer.popleft()
-                    msg_pulse_id = next_msg.data.pulse_id
+                if running_job is not None:
+                    self._logger.error("A write job for '%s' is already running.", job_parameters["output_file"])
+                    continue
 
-                    if self.end_pulse_id and self.end_pulse_id < msg_pulse_id:
-                        # no more messages to write
-                        end_pulse_id = self.end_pulse_id
-                        self.end_pulse_id = None
+                self._start_write_job(job_parameters["output_file"], job_parameters["start_pulse_id"],
+                                      job_parameters.get("end_pulse_id"), job_parameters.get("channels"))
 
-                        # finilize hdf5 file
-                        if end_pulse_id < msg_pulse_id:
-                            self.prune_messages_in_hdf5(h5_file, end_pulse_id)
+    def _start_write_job(self, output_file, start_pulse_id, end_pulse_id=None, channels=None, spill_file=None):
+        """
+        Start a write job. A job that cannot be started is logged and skipped, so the other jobs keep receiving.
+        :return: The started job, or None if it could not be started.
+        """
+        if self._ring_buffer.first_pulse_id is not None and start_pulse_id < self._ring_buffer.first_pulse_id:
+            self._logger.warning("start_pulse_id < oldest buffered message pulse_id")
 
-                        break
+        unknown_channels = set(channels or []) - set(self.channels or [])
+        if unknown_channels:
+            self._logger.warning("Channels %s of '%s' are not requested.", sorted(unknown_channels), output_file)
 
-                    if msg_pulse_id < start_pulse_id:
-                        self._logger.debug('Discard %d', msg_pulse_id)
-                        continue  # discard the message
+        job = None
+        try:
+            job = BsreadWriteJob(output_file, start_pulse_id, end_pulse_id, channels, self.write_batch_size,
+                                 self.buffer_size, self.buffer_overflow_policy, spill_file, self.spill_file_size,
+                                 self.receive_timeout)
+            job.channels_metadata = self._channels_metadata
 
-                    self._logger.debug('Write to hdf5 %d', msg_pulse_id)
-                    self.write_message_to_hdf5(h5_file, next_msg, first_iteration)
-                    first_iteration = False
+            self._logger.info("Start write job '%s'.", output_file)
+            # Messages from start_pulse_id on, found without scanning the older ones.
+            job.start(self._ring_buffer.get_messages_from(start_pulse_id))
 
         except:
-            self._logger.exception("Error while writing bsread stream.")
+            self._logger.exception("Could not start write job '%s'.", output_file)
+
+            # Release the spill file of the job.
+            if job is not None:
+                job.stop()
+
+            return None
+
+        self._jobs.append(job)
+
+        return job
+
+    def _close_write_job(self, job):
+        job.stop()
+        self._jobs.remove(job)
+        self._finished_jobs_statistics[job.output_file] = job.get_statistics()
 
     def is_running(self):
         return self._running_event.is_set()
 
+    def get_statistics(self):
+        """
+        Get the receive statistics (per stage timings, message rate and latency), with the statistics of each write
+        job under "write_jobs".
+        :return: Dictionary with the statistics.
+        """
+        statistics = self._statistics.get_statistics()
+        statistics["retroactive_messages"] = len(self._ring_buffer)
+        statistics["retroactive_bytes"] = self._ring_buffer.n_bytes
+
+        jobs_statistics = dict(self._finished_jobs_statistics)
+        for job in list(self._jobs):
+            jobs_statistics[job.output_file] = job.get_statistics()
+
+        statistics["write_jobs"] = jobs_statistics
+        for counter in WRITE_JOB_COUNTERS:
+            statistics[counter] = sum(job_statistics[counter] for job_statistics in jobs_statistics.values())
+
+        return statistics
+
     def start(self):
         # Check if all the needed input parameters are available.
         self._validate_parameters()
@@ -156,9 +302,13 @@ class BsreadWriter(BaseProcessor):
         self._logger.info("Requesting channels from dispatching layer: %s", self.channels)
         address = dispatcher.request_stream(self.channels)
 
-        create_folder_if_does_not_exist(self.output_file)
+        self._ring_buffer = PulseIdRingBuffer(self.buffer_memory_size)
+        self._jobs = []
+        self._default_job = None
+        self._finished_jobs_statistics = {}
 
         self._running_event.clear()
+        self._statistics.reset()
 
         self._receiving_thread = Thread(target=self.receive_messages, args=(address, ))
         self._receiving_thread.start()
@@ -174,34 +324,8 @@ class BsreadWriter(BaseProcessor):
             self._receiving_thread.join()
             self._logger.debug("Join bsread receiving thread.")
 
-        if self._writing_thread:
-            self._writing_thread.join()
-            self._logger.debug("Join bsread writing thread.")
+        for job in list(self._jobs):
+            self._close_write_job(job)
+        self._logger.debug("Stopped bsread write jobs.")
 
         self._logger.debug("bsread_writer stopped.")
-
-    @staticmethod
-    def write_message_to_hdf5(h5_file, message, first_iteration):
-        """ Placeholder for a function to write message's content into hdf5 file.
-
-        Intended for debugging. Saves only pulse_ids of messages!
-        """
-        if first_iteration:
-            dset_pulse_id = h5_file.create_dataset('pulse_id', dtype='i8', shape=(1, 1), maxshape=(None, 1))
-        else:
-            dset_pulse_id = h5_file['pulse_id']
-            dset_pulse_id.resize(dset_pulse_id.shape[0] + 1, axis=0)
-
-        dset_pulse_id[-1] = message.data.pulse_id
-
-    @staticmethod
-    def prune_messages_in_hdf5(h5_file, end_pulse_id):
-        """ Placeholder for a function to prune hdf5 file content down to end_pulse_id.
-
-        Intended for debugging.
-        """
-        dset_pulse_id = h5_file['pulse_id']
-        while dset_pulse_id[-1] > end_pulse_id:
-            # this will also discard the data
-            # see the Note at http://docs.h5py.org/en/latest/high/dataset.html#resizable-datasets
-            dset_pulse_id.resize(dset_pulse_id.shape[0] - 1, axis=0)
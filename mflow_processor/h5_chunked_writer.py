@@ -1,10 +1,35 @@
+import os
 import h5py
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
+from queue import Queue, Full, Empty
+from threading import Thread
+from time import perf_counter
 
 from mflow_nodes.processors.base import BaseProcessor
 
 from mflow_processor.utils.h5_utils import populate_h5_file, create_dataset, compact_dataset, expand_dataset, \
-    set_dataset_attributes, create_folder_if_does_not_exist
+    set_dataset_attributes, create_folder_if_does_not_exist, get_file_access_options, DatasetGrowthPolicy, FILE_DRIVERS, \
+    DEFAULT_FILE_BLOCK_SIZE
+from mflow_processor.utils.frame_dump import FrameDump, DEFAULT_FRAME_DUMP_SIZE
+from mflow_processor.utils.frame_metadata import FrameMetadataStore
+from mflow_processor.utils.frame_tracker import ReceivedFramesTracker
+from mflow_processor.utils.frame_buffers import FrameChunkStager, FrameBatchBuffer
+from mflow_processor.utils.codec_selector import UNCOMPRESSED_ENCODING_STRING, BITSHUFFLE_COMPRESSION_ENCODINGS, \
+    get_dataset_encodings
+from mflow_processor.utils.statistics import ProcessorStatistics
+
+# Chunk filter mask that skips the (first) compression filter.
+SKIP_COMPRESSION_FILTER_MASK = 1
+
+# Datasets (in the data dataset group) with the received frames of each file.
+RECEIVED_MASK_DATASET_NAME = "received_mask"
+MISSING_FRAMES_DATASET_NAME = "missing_frames"
+
+# Policies for handling frames when the async write queue is full.
+ASYNC_OVERFLOW_POLICIES = ("block", "drop", "spill")
+# Suffix of the default spill file name.
+SPILL_FILENAME_SUFFIX = ".spill"
 
 
 class HDF5ChunkedWriterProcessor(BaseProcessor):
@@ -25,11 +50,41 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
         output_file                    Location to write the H5 file to.
 
         compression                    Filter number to be used. None for no compression. None is default.
-        compression_opts               Options to pass to the compression filter. None is default.
+        compression_opts               Options to pass to the compression filter. None is default. Compressed frames
+                                       with another encoding than the filter are dropped.
+        frames_per_chunk               Number of frames to store in each H5 chunk. With more than 1 the compression
+                                       filter is applied by HDF5, so the stream has to be uncompressed. 1 is default.
+        file_pool_size                 Number of files to create ahead in a background thread when frames_per_file
+                                       is set. Closed files are also finalized in the background. 0 is default.
+        expected_frame_count           Expected number of frames, to create the dataset with the right size.
+                                       Reset on stop. None is default.
+
+        batch_frames                   Number of frames to write in a batch. None to disable batching. None is default.
+        batch_bytes                    Max number of bytes in a batch. None is default.
+        batch_max_delay                Max time in seconds a frame waits in the batch. None is default.
+
+        h5_driver                      HDF5 driver: "sec2", "stdio", "core" or "direct". None is default.
+        h5_alignment                   Align the chunks in the file to this many bytes. None is default.
+        h5_alignment_threshold         Align only objects of at least this many bytes. None is default (h5_alignment).
+        h5_meta_block_size             Allocate the file metadata in blocks of this many bytes. None is default.
+        h5_page_buffer_size            Page buffer size in bytes (paged file space). None is default.
+
+        metadata_flush_frames          Write the plugin metadata to the file every this many frames, instead of
+                                       only when closing the file. None is default.
+
+        write_received_mask            Write the received_mask (1 per received frame) and missing_frames ([start, stop)
+                                       frame index ranges) datasets beside the data dataset. False is default.
 
         h5_group_attributes            Attributes to add to the H5 file groups.
         h5_dataset_attributes          Attributes to add the the H5 datasets.
         h5_datasets                    Datasets to add to the H5 file.
+
+        async_write                    Write the frames from a separate thread. False is default.
+        async_queue_size               Max number of frames waiting to be written in async mode. 100 is default.
+        async_overflow_policy          What to do when the async queue is full: "block", "drop" or "spill" (to a memory
+                                       mapped file). "block" is default.
+        spill_file                     File to spill the frames to. None is default - output_file with '.spill' suffix.
+        spill_file_size                Size of the spill file in bytes. 1 GB is default.
     """
     _logger = getLogger(__name__)
 
@@ -44,8 +99,40 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
         self._dataset = None
         self._max_frame_index = 0
         self._current_frame_chunk = None
+        self._frame_buffer = None
+        self._growth_policy = None
         self._plugins = plugins or []
 
+        # Per frame metadata collected by the plugins.
+        self.frame_metadata = FrameMetadataStore()
+
+        # Received frames of the current file.
+        self._received_frames = ReceivedFramesTracker()
+        self._missing_frames = 0
+        self._duplicate_frames = 0
+
+        # Files opened in this acquisition: frame_chunk -> received frames. Late frames reopen them, not truncate.
+        self._written_chunks = {}
+        self._reopened_file = False
+
+        # Frame encodings the dataset filter can store, and frames dropped because of another encoding.
+        self._dataset_encodings = None
+        self._rejected_frames = 0
+
+        # Background file creation and closing.
+        self._file_pool = None
+        self._prepared_files = {}
+        self._closing_files = {}
+
+        # Async write mode.
+        self._frame_queue = None
+        self._writing_thread = None
+        self._dropped_frames = 0
+        self._frame_spill = None
+        self._spilled_frames = 0
+
+        self._statistics = ProcessorStatistics()
+
         # Parameters that need to be set.
         self.dataset_name = None
         self.output_file = None
@@ -54,6 +141,24 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
         self.frames_per_file = None
         self.compression = None
         self.compression_opts = None
+        self.frames_per_chunk = 1
+        self.expected_frame_count = None
+        self.file_pool_size = 0
+        self.h5_driver = None
+        self.h5_alignment = None
+        self.h5_alignment_threshold = None
+        self.h5_meta_block_size = None
+        self.h5_page_buffer_size = None
+        self.batch_frames = None
+        self.batch_bytes = None
+        self.batch_max_delay = None
+        self.async_write = False
+        self.async_queue_size = 100
+        self.async_overflow_policy = "block"
+        self.spill_file = None
+        self.spill_file_size = DEFAULT_FRAME_DUMP_SIZE
+        self.metadata_flush_frames = None
+        self.write_received_mask = False
 
         # Additional H5 datasets and attributes.
         self.h5_group_attributes = {}
@@ -73,6 +178,47 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
         if not self.output_file:
             error_message += "Parameter 'output_file' not set.\n"
 
+        if not self.frames_per_chunk or self.frames_per_chunk < 1:
+            error_message += "Parameter 'frames_per_chunk' must be a positive number.\n"
+
+        if self.batch_frames:
+            if self.compression is not None:
+                error_message += "Parameter 'batch_frames' can be used only for uncompressed streams.\n"
+
+            if self.frames_per_chunk > 1:
+                error_message += "Parameters 'batch_frames' and 'frames_per_chunk' cannot be used together.\n"
+
+        if self.expected_frame_count is not None and self.expected_frame_count < 1:
+            error_message += "Parameter 'expected_frame_count' must be a positive number.\n"
+
+        if self.file_pool_size is None or self.file_pool_size < 0:
+            error_message += "Parameter 'file_pool_size' must be 0 or a positive number.\n"
+
+        if self.h5_driver is not None:
+            if self.h5_driver not in FILE_DRIVERS:
+                error_message += "Parameter 'h5_driver' must be one of %s.\n" % (FILE_DRIVERS,)
+            elif self.h5_driver not in h5py.registered_drivers():
+                error_message += "The HDF5 library was built without the '%s' driver.\n" % self.h5_driver
+
+        # The file space pages have the alignment size.
+        if self.h5_page_buffer_size and self.h5_page_buffer_size < (self.h5_alignment or DEFAULT_FILE_BLOCK_SIZE):
+            error_message += "Parameter 'h5_page_buffer_size' must be at least one page (h5_alignment or %d).\n" % \
+                             DEFAULT_FILE_BLOCK_SIZE
+
+        if self.metadata_flush_frames is not None and self.metadata_flush_frames < 1:
+            error_message += "Parameter 'metadata_flush_frames' must be a positive number.\n"
+
+        if self.async_write:
+            if not self.async_queue_size or self.async_queue_size < 1:
+                error_message += "Parameter 'async_queue_size' must be a positive number.\n"
+
+            if self.async_overflow_policy not in ASYNC_OVERFLOW_POLICIES:
+                error_message += "Parameter 'async_overflow_policy' must be one of %s.\n" % \
+                                 (ASYNC_OVERFLOW_POLICIES,)
+
+            if self.async_overflow_policy == "spill" and (not self.spill_file_size or self.spill_file_size < 1):
+                error_message += "Parameter 'spill_file_size' must be a positive number.\n"
+
         if error_message:
             self._logger.error(error_message)
             raise ValueError(error_message)
@@ -83,6 +229,82 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
         self._validate_parameters()
         self._logger.debug("Starting mflow_processor.")
 
+        self._statistics.reset()
+        self.frame_metadata.reset()
+        self._received_frames.reset()
+        self._missing_frames = 0
+        self._duplicate_frames = 0
+        self._written_chunks = {}
+        # Multi frame chunks are assembled from uncompressed frames.
+        if self.frames_per_chunk > 1:
+            self._dataset_encodings = {UNCOMPRESSED_ENCODING_STRING}
+        else:
+            self._dataset_encodings = get_dataset_encodings(self.compression, self.compression_opts)
+        self._rejected_frames = 0
+
+        if self.file_pool_size:
+            # A single thread, so the files are closed and created in order.
+            self._file_pool = ThreadPoolExecutor(max_workers=1)
+
+        if self.async_write:
+            self._dropped_frames = 0
+            self._spilled_frames = 0
+            self._frame_queue = Queue(maxsize=self.async_queue_size)
+
+            if self.async_overflow_policy == "spill":
+                spill_filename = self.spill_file or \
+                    os.path.splitext(self.output_file.format(chunk_number=0))[0] + SPILL_FILENAME_SUFFIX
+                create_folder_if_does_not_exist(spill_filename)
+                self._frame_spill = FrameDump(spill_filename, self.spill_file_size)
+            self._writing_thread = Thread(target=self._write_frames_from_queue, daemon=True)
+            self._writing_thread.start()
+
+    def _open_file(self, frame_size, dtype, frame_chunk, reopen=False):
+        """
+        Open the H5 file for the provided frame_chunk and create the dataset in it.
+        Runs in the file pool thread when files are created ahead.
+        :param reopen: Open the file already written in this acquisition, to add late frames to its dataset.
+        :return: (file, dataset, growth_policy)
+        """
+        filename = self.output_file.format(chunk_number=frame_chunk)
+
+        file_options = get_file_access_options(self.h5_driver,
+                                               self.h5_alignment,
+                                               self.h5_alignment_threshold,
+                                               self.h5_meta_block_size,
+                                               self.h5_page_buffer_size)
+
+        growth_policy = self._create_growth_policy(frame_chunk)
+
+        if reopen:
+            self._logger.debug("Reopening file '%s' for late frames." % filename)
+
+            # The file space strategy can be set only when creating the file.
+            file_options.pop("fs_strategy", None)
+            file_options.pop("fs_page_size", None)
+
+            file = h5py.File(filename, "r+", **file_options)
+            return file, file[self.dataset_name], growth_policy
+
+        create_folder_if_does_not_exist(filename)
+
+        self._logger.debug("Writing to file '%s' chunks of size %s." % (filename, frame_size))
+
+        # Truncate file if it already exists.
+        file = h5py.File(filename, "w", **file_options)
+
+        # Construct the dataset.
+        dataset = create_dataset(file,
+                                 self.dataset_name,
+                                 frame_size,
+                                 dtype,
+                                 self.compression,
+                                 self.compression_opts,
+                                 initial_frame_count=growth_policy.get_initial_size(),
+                                 frames_per_chunk=self.frames_per_chunk)
+
+        return file, dataset, growth_policy
+
     def _create_file(self, frame_size, dtype, frame_chunk=0):
         """
         Create a new H5 file for the provided frame_chunk.
@@ -91,56 +313,202 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
         if self._file:
             self._close_file()
 
-        filename = self.output_file.format(chunk_number=frame_chunk)
+        file_creation_start = perf_counter()
 
-        create_folder_if_does_not_exist(filename)
+        # A late frame of a file that is being closed in the background has to wait for it.
+        closing_file = self._closing_files.pop(frame_chunk, None)
+        if closing_file is not None:
+            closing_file.exception()
 
-        self._logger.debug("Writing to file '%s' chunks of size %s." % (filename, frame_size))
+        self._reopened_file = frame_chunk in self._written_chunks
 
-        # Truncate file if it already exists.
-        self._file = h5py.File(filename, "w")
+        prepared_file = self._prepared_files.pop(frame_chunk, None)
+        if prepared_file is not None and prepared_file.exception() is None:
+            self._file, self._dataset, self._growth_policy = prepared_file.result()
+        else:
+            self._file, self._dataset, self._growth_policy = self._open_file(frame_size, dtype, frame_chunk,
+                                                                             reopen=self._reopened_file)
+
+        if self._reopened_file:
+            # Late frames are added to the frames already in the file.
+            self._received_frames = self._written_chunks[frame_chunk]
+            self._missing_frames -= self._received_frames.n_missing
+            self._max_frame_index = self._dataset.shape[0] - 1
+        self._written_chunks[frame_chunk] = self._received_frames
 
-        # Construct the dataset.
-        self._dataset = create_dataset(self._file,
-                                       self.dataset_name,
-                                       frame_size,
-                                       dtype,
-                                       self.compression,
-                                       self.compression_opts)
         # Record the dataset size for later comparison.
         self._current_dataset_size = self._dataset.shape[0]
 
+        self._frame_buffer = self._create_frame_buffer(frame_size, dtype,
+                                                       self._dataset.shape[0] if self._reopened_file else 0)
+
         self._current_frame_chunk = frame_chunk
 
-    def _set_data_chunk_attributes(self):
+        # Each file holds only the metadata of its own frames.
+        self.frame_metadata.reset(first_frame_index=self._get_first_frame_index(frame_chunk))
+
+        if self._file_pool is not None and self.frames_per_file:
+            for next_frame_chunk in range(frame_chunk + 1, frame_chunk + 1 + self.file_pool_size):
+                # Files already written (or still closing) must not be truncated by creating them again.
+                if next_frame_chunk not in self._prepared_files and next_frame_chunk not in self._written_chunks \
+                        and next_frame_chunk not in self._closing_files:
+                    self._prepared_files[next_frame_chunk] = self._submit_to_file_pool(self._open_file, frame_size,
+                                                                                       dtype, next_frame_chunk)
+
+        self._statistics.record_stage("file_creation", file_creation_start)
+
+    def _submit_to_file_pool(self, function, *args):
         """
-        Insert the lowest and highest frame index attribute to the frame dataset.
+        Run the function in the file pool thread. Errors are logged.
+        :return: Future of the function result.
+        """
+        def log_error(job):
+            if job.exception() is not None:
+                self._logger.error("File pool job failed.", exc_info=job.exception())
+
+        job = self._file_pool.submit(function, *args)
+        job.add_done_callback(log_error)
+
+        return job
+
+    def _create_frame_buffer(self, frame_size, dtype, written_frames=0):
+        """
+        Create the buffer to collect the frames in before writing them to the dataset.
+        :param written_frames: Number of frames already in the dataset of a reopened file.
+        :return: Frame buffer, or None if the frames are written directly.
+        """
+        # Multi frame chunks are assembled from uncompressed frames - filters are applied by HDF5.
+        if self.frames_per_chunk > 1:
+            return FrameChunkStager(self._dataset, self.frames_per_chunk, frame_size, dtype,
+                                    direct_write=self.compression is None, written_frames=written_frames)
+
+        if self.batch_frames:
+            return FrameBatchBuffer(self._dataset, self.batch_frames, frame_size, dtype,
+                                    max_bytes=self.batch_bytes, max_delay=self.batch_max_delay)
+
+        return None
+
+    def _create_growth_policy(self, frame_chunk):
+        """
+        Create the growth policy for the dataset of the provided frame_chunk.
+        :param frame_chunk: The number of the data file.
+        :return: DatasetGrowthPolicy instance.
+        """
+        expected_frame_count = self.expected_frame_count
+        # Only the frames of this file are expected in the dataset.
+        if expected_frame_count:
+            expected_frame_count = max(1, expected_frame_count - self._get_first_frame_index(frame_chunk))
+
+        return DatasetGrowthPolicy(expected_frame_count=expected_frame_count,
+                                   max_frame_count=self.frames_per_file or None)
+
+    def _get_first_frame_index(self, frame_chunk):
+        """
+        Get the index of the first frame in the file.
+        :param frame_chunk: The number of the data file.
         """
         if self.frames_per_file:
-            min_frame_in_dataset = (self._current_frame_chunk - 1) * self.frames_per_file
-        else:
-            min_frame_in_dataset = 0
-        max_frame_in_dataset = self._max_frame_index + min_frame_in_dataset
+            return (frame_chunk - 1) * self.frames_per_file
+
+        return 0
+
+    def _set_data_chunk_attributes(self, file, frame_chunk, max_frame_index):
+        """
+        Insert the lowest and highest frame index attribute to the frame dataset.
+        """
+        min_frame_in_dataset = self._get_first_frame_index(frame_chunk)
+        max_frame_in_dataset = max_frame_index + min_frame_in_dataset
 
         # Do not display the index number, but the the frame number (starts with 1)
-        set_dataset_attributes(self._file, {"%s:%s" % (self.dataset_name, "image_nr_low"): min_frame_in_dataset + 1,
-                                            "%s:%s" % (self.dataset_name, "image_nr_high"): max_frame_in_dataset + 1})
+        set_dataset_attributes(file, {"%s:%s" % (self.dataset_name, "image_nr_low"): min_frame_in_dataset + 1,
+                                      "%s:%s" % (self.dataset_name, "image_nr_high"): max_frame_in_dataset + 1})
 
     def _close_file(self):
         """
-        Close the current file. Compact the dataset and write the needed metadata to the H5 file.s
+        Close the current file. With the file pool, the file is finalized in the background.
         """
-        compact_dataset(self._dataset, self._max_frame_index)
-        # Set the minimum and the maximum frame in the current dataset.
-        self._set_data_chunk_attributes()
-        # Additional datasets and group and dataset attributes.
-        populate_h5_file(self._file, self.h5_group_attributes, self.h5_datasets, self.h5_dataset_attributes)
+        file_close_start = perf_counter()
+
+        self._missing_frames += self._received_frames.n_missing
+
+        file_state = (self._file, self._dataset, self._frame_buffer, self._current_frame_chunk,
+                      self._max_frame_index, self._received_frames, self.frame_metadata, self._reopened_file)
+
+        # The next file gets its own received frames, this file keeps the current ones (for late frames).
+        self._received_frames = ReceivedFramesTracker()
+
+        if self._file_pool is not None:
+            # The next file gets its own metadata as well.
+            self.frame_metadata = FrameMetadataStore()
+
+            self._closing_files = {frame_chunk: job for frame_chunk, job in self._closing_files.items()
+                                   if not job.done()}
+            self._closing_files[self._current_frame_chunk] = self._submit_to_file_pool(self._finalize_file,
+                                                                                       *file_state)
+        else:
+            self._finalize_file(*file_state)
 
-        self._file.close()
         self._file = None
+        self._dataset = None
+        self._frame_buffer = None
         self._current_frame_chunk = None
         self._max_frame_index = 0
 
+        self._statistics.record_stage("file_close", file_close_start)
+
+    def _finalize_file(self, file, dataset, frame_buffer, frame_chunk, max_frame_index, received_frames,
+                       frame_metadata, reopened=False):
+        """
+        Compact the dataset, write the needed metadata to the H5 file and close it.
+        :param reopened: The file was reopened for late frames, its metadata and datasets are already written.
+        """
+        # Write the buffered frames before compacting the dataset.
+        if frame_buffer:
+            frame_buffer.flush()
+
+        compact_dataset(dataset, max_frame_index)
+        # Set the minimum and the maximum frame in the current dataset.
+        self._set_data_chunk_attributes(file, frame_chunk, max_frame_index)
+
+        if self.write_received_mask:
+            self._write_received_frames(file, frame_chunk, received_frames)
+
+        if reopened:
+            if frame_metadata.n_frames:
+                self._logger.warning("Discarding the plugin metadata of late frames of file %d.", frame_chunk)
+            populate_h5_file(file, self.h5_group_attributes, None, self.h5_dataset_attributes)
+            file.close()
+            return
+
+        # Metadata datasets first, so the dataset attributes can be set on them.
+        if self.metadata_flush_frames:
+            frame_metadata.flush(file)
+        else:
+            frame_metadata.write_datasets(file)
+        # Additional datasets and group and dataset attributes.
+        populate_h5_file(file, self.h5_group_attributes, self.h5_datasets, self.h5_dataset_attributes)
+
+        file.close()
+
+    def _write_received_frames(self, file, frame_chunk, received_frames):
+        """
+        Write the received frames mask and the missing frame ranges next to the data dataset.
+        """
+        dataset_group = "/".join(self.dataset_name.rstrip("/").split("/")[:-1])
+        first_frame_index = self._get_first_frame_index(frame_chunk)
+
+        received_mask_name = "/".join([dataset_group, RECEIVED_MASK_DATASET_NAME])
+        missing_frames_name = "/".join([dataset_group, MISSING_FRAMES_DATASET_NAME])
+
+        # Reopened files get the datasets updated with the late frames.
+        for dataset_name in (received_mask_name, missing_frames_name):
+            if dataset_name in file:
+                del file[dataset_name]
+
+        file.create_dataset(received_mask_name, data=received_frames.get_received_mask())
+        # Ranges of absolute frame indexes, so they are valid across files.
+        file.create_dataset(missing_frames_name, data=received_frames.get_missing_ranges() + first_frame_index)
+
     def _prepare_storage_for_frame(self, frame_index, frame_size, dtype):
         """
         Takes care of preparing the correct storage destination for the provided frame index.
@@ -163,7 +531,9 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
 
         # If the current frame does not fit in the dataset, expand it.
         if not frame_index < self._current_dataset_size:
-            self._current_dataset_size = expand_dataset(self._dataset, frame_index)
+            expansion_start = perf_counter()
+            self._current_dataset_size = expand_dataset(self._dataset, frame_index, growth_policy=self._growth_policy)
+            self._statistics.record_stage("dataset_expansion", expansion_start)
 
         # Keep track of the max frame index to shrink the dataset before closing it.
         if frame_index > self._max_frame_index:
@@ -171,25 +541,198 @@ class HDF5ChunkedWriterProcessor(BaseProcessor):
 
         return frame_index
 
-    def process_message(self, message):
+    def _write_frames_from_queue(self):
+        """
+        Async writing thread. Writes the queued frames until the stop sentinel (None) is received.
+        Once a frame is spilled, all the later frames are spilled until the spill file is drained, so the queued
+        frames are always older than the spilled ones - the spilled frames are written once the queue is empty.
+        All the frames are written in the received order, and all of them before the thread stops.
+        """
+        self._logger.debug("Async writing thread started.")
+
+        while True:
+            spill_pending = self._frame_spill is not None and self._frame_spill.n_pending
+
+            try:
+                if spill_pending:
+                    queued_frame = self._frame_queue.get_nowait()
+                else:
+                    queued_frame = self._frame_queue.get(timeout=self.batch_max_delay)
+            except Empty:
+                if spill_pending:
+                    self._write_queued_frame(*self._frame_spill.pop())
+                # Do not keep batched frames in memory while the stream is idle.
+                elif isinstance(self._frame_buffer, FrameBatchBuffer):
+                    self._frame_buffer.flush_if_expired()
+                continue
+
+            if queued_frame is None:
+                break
+
+            self._write_queued_frame(*queued_frame)
+
+        while self._frame_spill is not None and self._frame_spill.n_pending:
+            self._write_queued_frame(*self._frame_spill.pop())
+
+        self._logger.debug("Async writing thread stopped.")
+
+    def _write_queued_frame(self, message, receive_time):
+        try:
+            self._write_message(message, receive_time)
+        except:
+            self._logger.exception("Could not write frame '%d'.", message.get_frame_index())
+
+    def _write_message(self, message, receive_time):
+        """
+        Write the message to the H5 file and run the plugins on it.
+        :param message: Message to write.
+        :param receive_time: perf_counter value when the message was received.
+        """
+        stage_start = perf_counter()
+
         frame_index = message.get_frame_index()
+
+        # Compressed frames that do not match the dataset filter (or cannot be staged) would corrupt the chunks.
+        encoding = message.get_header().get("encoding")
+        if encoding in BITSHUFFLE_COMPRESSION_ENCODINGS.values() and encoding not in self._dataset_encodings:
+            self._rejected_frames += 1
+            self._logger.warning("Frame '%d' has encoding '%s', but the dataset accepts only %s. Dropping frame "
+                                 "(total rejected %d).", frame_index, encoding, sorted(self._dataset_encodings),
+                                 self._rejected_frames)
+            return
+
         relative_frame_index = self._prepare_storage_for_frame(frame_index,
                                                                message.get_frame_size(),
                                                                message.get_frame_dtype())
 
+        stage_start = self._statistics.record_stage("storage_preparation", stage_start)
+
         self._logger.debug("Received frame '%d', writing as relative frame '%d'.", frame_index, relative_frame_index)
 
+        if self._received_frames.add_frame(relative_frame_index):
+            self._duplicate_frames += 1
+            self._logger.debug("Frame '%d' was already received.", frame_index)
+
         frame_data = message.get_data()
-        # Because the conversion to and from bytes is slow, mflow should be used in raw mode.
-        bytes_to_write = frame_data if isinstance(frame_data, bytes) else frame_data.tobytes()
-        self._dataset.id.write_direct_chunk((relative_frame_index, 0, 0), bytes_to_write)
+
+        if self._frame_buffer:
+            self._frame_buffer.add_frame(relative_frame_index, frame_data)
+        else:
+            # Because the conversion to and from bytes is slow, mflow should be used in raw mode.
+            bytes_to_write = frame_data if isinstance(frame_data, bytes) else frame_data.tobytes()
+
+            # The compressor can forward frames that did not compress well as they are.
+            filter_mask = 0
+            if self.compression is not None and \
+                    message.get_header().get("encoding") == UNCOMPRESSED_ENCODING_STRING:
+                filter_mask = SKIP_COMPRESSION_FILTER_MASK
+
+            self._dataset.id.write_direct_chunk((relative_frame_index, 0, 0), bytes_to_write, filter_mask)
+
+        stage_start = self._statistics.record_stage("chunk_write", stage_start)
 
         # Process additional plugins on the message.
-        for plugin_function in self._plugins:
-            plugin_function(self, message)
+        if self._plugins:
+            for plugin_function in self._plugins:
+                plugin_function(self, message)
+
+            stage_start = self._statistics.record_stage("plugins", stage_start)
+
+            if self.metadata_flush_frames and self.frame_metadata.n_frames >= self.metadata_flush_frames and \
+                    not self._reopened_file:
+                self.frame_metadata.flush(self._file)
+                # Make the flushed metadata readable in case of a crash.
+                self._file.flush()
+                self._statistics.record_stage("metadata_flush", stage_start)
+
+        self._statistics.record_frame(receive_time, len(frame_data) if isinstance(frame_data, bytes)
+                                      else frame_data.nbytes)
+
+    def process_message(self, message):
+        receive_time = perf_counter()
+
+        if self._frame_queue is None:
+            self._write_message(message, receive_time)
+
+        elif self.async_overflow_policy in ("drop", "spill"):
+            # Frames are spilled until the spill file is drained, to keep them in order.
+            if self._frame_spill is None or not self._frame_spill.n_pending:
+                try:
+                    self._frame_queue.put_nowait((message, receive_time))
+                    return
+                except Full:
+                    pass
+
+            if self._frame_spill is not None and self._frame_spill.append(message.get_header(),
+                                                                          message.get_data(),
+                                                                          message.get_frame_index(),
+                                                                          receive_time):
+                self._spilled_frames += 1
+                return
+
+            self._dropped_frames += 1
+            self._logger.warning("Write queue is full, dropping frame '%d' (total dropped %d).",
+                                 message.get_frame_index(), self._dropped_frames)
+
+        else:
+            self._frame_queue.put((message, receive_time))
+
+    def get_statistics(self):
+        """
+        Get the write statistics: per stage timings, throughput and frame latency.
+        :return: Dictionary with the statistics.
+        """
+        statistics = self._statistics.get_statistics()
+        statistics["dropped_frames"] = self._dropped_frames
+        statistics["spilled_frames"] = self._spilled_frames
+        statistics["missing_frames"] = self._missing_frames + self._received_frames.n_missing
+        statistics["duplicate_frames"] = self._duplicate_frames
+        statistics["rejected_frames"] = self._rejected_frames
+
+        frame_queue = self._frame_queue
+        if frame_queue is not None:
+            statistics["queued_frames"] = frame_queue.qsize()
+
+        return statistics
 
     def stop(self):
         self._logger.debug("Writer stopped.")
 
+        # Drain the queue before closing the file.
+        if self._writing_thread:
+            self._frame_queue.put(None)
+            self._writing_thread.join()
+            self._logger.debug("Async writing thread joined.")
+
+            if self._dropped_frames:
+                self._logger.warning("Dropped %d frames because the write queue was full.", self._dropped_frames)
+
+            if self._frame_spill is not None:
+                self._logger.info("Spilled %d frames to '%s'.", self._spilled_frames, self._frame_spill.filename)
+                self._frame_spill.close()
+                self._frame_spill = None
+
+            self._writing_thread = None
+            self._frame_queue = None
+
         if self._file:
             self._close_file()
+
+        if self._file_pool is not None:
+            # Wait for the files to be closed.
+            self._file_pool.shutdown(wait=True)
+            self._file_pool = None
+            self._closing_files = {}
+
+            # Files created ahead that did not receive any frame.
+            for frame_chunk, prepared_file in self._prepared_files.items():
+                if frame_chunk not in self._written_chunks and prepared_file.exception() is None:
+                    file = prepared_file.result()[0]
+                    filename = file.filename
+                    file.close()
+                    os.remove(filename)
+
+            self._prepared_files = {}
+
+        # The expected frame count is set for each acquisition (the NXMX node sets it from the header).
+        self.expected_frame_count = None
@@ -1,6 +1,7 @@
 import glob
 import os
 from logging import getLogger
+from time import perf_counter
 import h5py
 
 from mflow_nodes.rest_api.rest_client import NodeClient
@@ -8,8 +9,13 @@ from mflow_nodes.processors.base import BaseProcessor
 from mflow_nodes.stream_tools.mflow_forwarder import MFlowForwarder
 
 from mflow_processor.utils.h5_utils import populate_h5_file
+from mflow_processor.utils.statistics import ProcessorStatistics
 from mflow_processor.utils.nxmx_utils import create_external_data_files_links, convert_header_to_dataset_values, \
-    NUMBER_OF_FRAMES_FROM_HEADER, MASTER_FILENAME_SUFFIX, DATA_FILENAME_TEMPLATE, dataset_types
+    create_virtual_data_files_dataset, NUMBER_OF_FRAMES_FROM_HEADER, MASTER_FILENAME_SUFFIX, DATA_FILENAME_TEMPLATE, \
+    DATA_DATASET_NAME, dataset_types, get_expected_frame_count
+
+# How the data files are referenced from the master file.
+MASTER_FILE_MODES = ("external_links", "vds")
 
 
 class HDF5nxmxWriter(BaseProcessor):
@@ -23,7 +29,10 @@ class HDF5nxmxWriter(BaseProcessor):
         stop                           Stop the writer, generate master H5 file.
 
     Writer parameters:
-        To be defined.
+        filename                       Master file name. Must end with '_master.h5'.
+        frames_per_file                Number of frames in each data file. 100 is default.
+        master_file_mode               "external_links" (one link per data file) or "vds" (one virtual dataset
+                                       spanning all data files). "external_links" is default.
     """
     _logger = getLogger(__name__)
 
@@ -44,6 +53,7 @@ class HDF5nxmxWriter(BaseProcessor):
         self._image_count = 0
         self._header_data = None
         self._h5_writer_client = NodeClient(h5_writer_control_address, h5_writer_instance_name)
+        self._statistics = ProcessorStatistics()
 
         # Parameters that need to be set.
         self.filename = None
@@ -51,6 +61,7 @@ class HDF5nxmxWriter(BaseProcessor):
 
         # Parameters with default values.
         self.frames_per_file = 100
+        self.master_file_mode = "external_links"
         self.h5_group_attributes = {}
         self.h5_datasets = {}
         self.h5_dataset_attributes = {}
@@ -61,6 +72,9 @@ class HDF5nxmxWriter(BaseProcessor):
         if not self.filename:
             error_message += "Parameter 'master_file_format' not set.\n"
 
+        if self.master_file_mode not in MASTER_FILE_MODES:
+            error_message += "Parameter 'master_file_mode' must be one of %s.\n" % (MASTER_FILE_MODES,)
+
         if error_message:
             self._logger.error(error_message)
             raise ValueError(error_message)
@@ -81,7 +95,7 @@ class HDF5nxmxWriter(BaseProcessor):
 
         # Construct the parameters for the H5 writer.
         h5_writer_parameters = {"output_file": self._data_filename_format,
-                                "dataset_name": "entry/data/data",
+                                "dataset_name": DATA_DATASET_NAME,
                                 "frames_per_file": self.frames_per_file,
                                 "h5_group_attributes": {"/entry:NX_class": "NXentry",
                                                         "/entry/data:NX_class": "NXdata"}}
@@ -92,12 +106,15 @@ class HDF5nxmxWriter(BaseProcessor):
         # Create a master file.
         self._file = h5py.File(master_filename, "w")
         self._image_count = 0
+        self._statistics.reset()
         self._is_running = True
 
     def stop(self):
         # Stop the writer.
         self._h5_writer_client.stop()
 
+        master_file_start = perf_counter()
+
         # Process the received data only if some images were received.
         if self._image_count > 0:
             if not self._header_data:
@@ -105,7 +122,11 @@ class HDF5nxmxWriter(BaseProcessor):
 
             # Link the generated output files.
             files_to_link = glob.glob("%s*.h5" % self._data_filename_format[0:self._data_filename_format.rindex("{")])
-            create_external_data_files_links(self._file, files_to_link)
+
+            if self.master_file_mode == "vds":
+                create_virtual_data_files_dataset(self._file, files_to_link)
+            else:
+                create_external_data_files_links(self._file, files_to_link)
 
             self._logger.debug("Processing header message attributes.")
             self.h5_datasets.update(convert_header_to_dataset_values(self._header_data,
@@ -124,18 +145,41 @@ class HDF5nxmxWriter(BaseProcessor):
 
         self._zmq_forwarder.stop()
         self._file.close()
+        self._statistics.record_stage("master_file", master_file_start)
         self._is_running = False
         self._header_data = None
 
     def process_message(self, message):
+        receive_time = perf_counter()
+
         if message.htype.startswith("dimage-"):
             self._image_count += 1
             self._zmq_forwarder.forward(message.raw_message)
+
+            # Images are forwarded without being decoded - count the bytes of all the forwarded parts.
+            self._statistics.record_stage("forwarding", receive_time)
+            self._statistics.record_frame(receive_time, sum(memoryview(part).nbytes
+                                                            for part in message.raw_message["data"]))
         elif message.htype.startswith("dseries_end-"):
             self._logger.debug("End series message received.")
         elif message.htype.startswith("dheader-"):
             self._logger.debug("Header message received.")
             # Store the header data for later processing.
             self._header_data = message.get_data()
+
+            # The writer can create the datasets with the right size.
+            expected_frame_count = get_expected_frame_count(self._header_data)
+            if expected_frame_count:
+                self._h5_writer_client.set_parameters({"expected_frame_count": expected_frame_count})
         else:
             self._logger.debug("Skipping message of type '%s'." % message.htype)
+
+    def get_statistics(self):
+        """
+        Get the node statistics: per stage timings, forwarded images rate and latency.
+        :return: Dictionary with the statistics.
+        """
+        statistics = self._statistics.get_statistics()
+        statistics["image_count"] = self._image_count
+
+        return statistics
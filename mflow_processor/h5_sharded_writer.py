@@ -0,0 +1,304 @@
+import os
+from logging import getLogger
+from multiprocessing import Process, Queue, current_process
+from queue import Full
+
+import h5py
+import numpy as np
+
+from mflow_nodes.processors.base import BaseProcessor
+
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.utils.frame_message import FrameMessage
+from mflow_processor.utils.h5_utils import create_virtual_dataset, create_folder_if_does_not_exist
+
+SHARD_MODES = ("modulo", "block")
+SHARD_FILENAME_SUFFIX = "_shard_{shard_number:02d}.h5"
+# Seconds to wait for space in a full shard queue before checking if the shard writer is still alive.
+SHARD_QUEUE_TIMEOUT = 1
+
+
+def write_shard(frame_queue, writer_parameters):
+    """
+    Shard writer process. Writes the frames from the queue until the stop sentinel (None) is received.
+    :param frame_queue: Queue with (shard_frame_index, header, data) tuples.
+    :param writer_parameters: Parameters for the shard chunked writer.
+    """
+    writer = HDF5ChunkedWriterProcessor(name="H5 shard writer")
+
+    for name, value in writer_parameters.items():
+        setattr(writer, name, value)
+
+    writer.start()
+
+    try:
+        while True:
+            frame = frame_queue.get()
+
+            if frame is None:
+                break
+
+            shard_frame_index, header, data = frame
+            writer.process_message(FrameMessage(header, data, frame_index=shard_frame_index))
+
+    finally:
+        writer.stop()
+
+
+class HDF5ShardedWriterProcessor(BaseProcessor):
+    """
+    H5 sharded writer
+
+    Writes the received stream with multiple writer processes, each to its own H5 file. The shard files
+    are joined in a master file with a virtual dataset.
+
+    All the frames are received, pickled and queued by the node process, so the shards scale the writing (and
+    the compression filters), but not the receiving. The shard writers are daemonic processes, so the node itself
+    cannot run in a daemonic process.
+
+    Writer commands:
+        start                          Starts the shard writers, overwriting the output files if they exist.
+        stop                           Stop the shard writers and write the master file.
+
+    Writer parameters:
+
+        dataset_name                   Name of the dataset to write the data inside the H5 files.
+        output_file                    Location to write the H5 master file to.
+
+        n_shards                       Number of writer processes. 2 is default.
+        shard_mode                     "modulo" (frame_index % n_shards) or "block". "modulo" is default.
+        frames_per_block               Number of consecutive frames for each shard in "block" mode. 100 is default.
+        shard_output_file              Template ({shard_number}) of the shard file names. None is default - the
+                                       output_file name with the '_shard_NN' suffix.
+        shard_queue_size               Max number of frames waiting for each shard writer. 100 is default.
+
+        compression                    Filter number to be used. None for no compression. None is default.
+        compression_opts               Options to pass to the compression filter. None is default.
+    """
+    _logger = getLogger(__name__)
+
+    def __init__(self, name="H5 sharded writer"):
+        """
+        Initialize the sharded writer.
+            :param name: Name of the writer.
+        """
+        self.__name__ = name
+
+        self._shard_queues = []
+        self._shard_processes = []
+        self._shard_filenames = []
+        self._failed_shards = set()
+        self._dropped_frames = 0
+
+        # Parameters that need to be set.
+        self.dataset_name = None
+        self.output_file = None
+
+        # Parameters with default values.
+        self.n_shards = 2
+        self.shard_mode = "modulo"
+        self.frames_per_block = 100
+        self.shard_output_file = None
+        self.shard_queue_size = 100
+        self.compression = None
+        self.compression_opts = None
+
+    def _validate_parameters(self):
+        """
+        Check if all the needed parameters are set.
+        :return: ValueError if any parameter is missing.
+        """
+        error_message = ""
+
+        if not self.dataset_name:
+            error_message += "Parameter 'dataset_name' not set.\n"
+
+        if not self.output_file:
+            error_message += "Parameter 'output_file' not set.\n"
+
+        if not self.n_shards or self.n_shards < 1:
+            error_message += "Parameter 'n_shards' must be a positive number.\n"
+
+        if self.shard_mode not in SHARD_MODES:
+            error_message += "Parameter 'shard_mode' must be one of %s.\n" % (SHARD_MODES,)
+
+        if self.shard_mode == "block" and (not self.frames_per_block or self.frames_per_block < 1):
+            error_message += "Parameter 'frames_per_block' must be a positive number.\n"
+
+        # Daemonic processes are not allowed to have children.
+        if current_process().daemon:
+            error_message += "The shard writers cannot be started from a daemonic process.\n"
+
+        if error_message:
+            self._logger.error(error_message)
+            raise ValueError(error_message)
+
+    def _get_shard_filename_template(self):
+        if self.shard_output_file:
+            return self.shard_output_file
+
+        return os.path.splitext(self.output_file)[0] + SHARD_FILENAME_SUFFIX
+
+    def start(self):
+        self._logger.debug("Writer started.")
+        self._validate_parameters()
+
+        filename_template = self._get_shard_filename_template()
+        self._shard_filenames = [filename_template.format(shard_number=shard_number)
+                                 for shard_number in range(self.n_shards)]
+        self._failed_shards = set()
+        self._dropped_frames = 0
+
+        for shard_filename in self._shard_filenames:
+            # Shard files from previous runs would end up in the master file.
+            if os.path.exists(shard_filename):
+                os.remove(shard_filename)
+
+            writer_parameters = {"dataset_name": self.dataset_name,
+                                 "output_file": shard_filename,
+                                 "compression": self.compression,
+                                 "compression_opts": self.compression_opts}
+
+            shard_queue = Queue(maxsize=self.shard_queue_size)
+            shard_process = Process(target=write_shard, args=(shard_queue, writer_parameters), daemon=True)
+            shard_process.start()
+
+            self._shard_queues.append(shard_queue)
+            self._shard_processes.append(shard_process)
+
+        self._logger.debug("Started %d shard writers.", self.n_shards)
+
+    def _get_shard_position(self, frame_index):
+        """
+        Get the shard writing the frame and the index of the frame in the shard dataset.
+        :param frame_index: Index of the received frame.
+        :return: (shard_number, shard_frame_index)
+        """
+        if self.shard_mode == "modulo":
+            return frame_index % self.n_shards, frame_index // self.n_shards
+
+        block_index, block_position = divmod(frame_index, self.frames_per_block)
+        shard_block_index, shard_number = divmod(block_index, self.n_shards)
+
+        return shard_number, shard_block_index * self.frames_per_block + block_position
+
+    def _get_shard_frame_mappings(self, shard_number, shard_frame_count):
+        """
+        Get the mappings from the shard dataset to the master dataset.
+        :param shard_number: Number of the shard.
+        :param shard_frame_count: Number of frames in the shard dataset.
+        :return: List of (master_frames, shard_frames) slices.
+        """
+        if self.shard_mode == "modulo":
+            last_master_frame = shard_number + (shard_frame_count - 1) * self.n_shards
+            return [(np.s_[shard_number:last_master_frame + 1:self.n_shards], np.s_[0:shard_frame_count])]
+
+        mappings = []
+        for shard_block_start in range(0, shard_frame_count, self.frames_per_block):
+            block_frame_count = min(self.frames_per_block, shard_frame_count - shard_block_start)
+            shard_block_index = shard_block_start // self.frames_per_block
+            master_block_start = (shard_block_index * self.n_shards + shard_number) * self.frames_per_block
+
+            mappings.append((np.s_[master_block_start:master_block_start + block_frame_count],
+                             np.s_[shard_block_start:shard_block_start + block_frame_count]))
+
+        return mappings
+
+    def _write_master_file(self):
+        """
+        Join the shard datasets into the master file virtual dataset.
+        """
+        sources = []
+        master_frame_count = 0
+        frame_size = None
+        dtype = None
+
+        for shard_number, shard_filename in enumerate(self._shard_filenames):
+            # Shards that did not receive any frame do not have a file.
+            if not os.path.exists(shard_filename):
+                continue
+
+            with h5py.File(shard_filename, "r") as shard_file:
+                shard_dataset = shard_file[self.dataset_name]
+                shard_frame_count = shard_dataset.shape[0]
+                frame_size = list(shard_dataset.shape[1:])
+                dtype = shard_dataset.dtype
+
+            for master_frames, shard_frames in self._get_shard_frame_mappings(shard_number, shard_frame_count):
+                sources.append((master_frames, shard_filename, self.dataset_name, shard_frame_count, shard_frames))
+                master_frame_count = max(master_frame_count, master_frames.stop)
+
+        if not sources:
+            self._logger.warning("No shard files were written. Skipping master file.")
+            return
+
+        self._logger.debug("Writing master file '%s' with %d frames.", self.output_file, master_frame_count)
+
+        create_folder_if_does_not_exist(self.output_file)
+        with h5py.File(self.output_file, "w") as master_file:
+            create_virtual_dataset(master_file, self.dataset_name, master_frame_count, frame_size, dtype, sources)
+
+    def _put_to_shard(self, shard_number, item):
+        """
+        Queue the item for the shard writer, without blocking forever if the shard writer died.
+        :param shard_number: Number of the shard.
+        :param item: Frame tuple or the stop sentinel (None).
+        :return: False if the shard writer is not running.
+        """
+        if shard_number in self._failed_shards:
+            return False
+
+        shard_queue = self._shard_queues[shard_number]
+        shard_process = self._shard_processes[shard_number]
+
+        while True:
+            try:
+                shard_queue.put(item, timeout=SHARD_QUEUE_TIMEOUT)
+                return True
+            except Full:
+                if not shard_process.is_alive():
+                    self._failed_shards.add(shard_number)
+                    self._logger.error("Shard writer %d exited with code %s.", shard_number, shard_process.exitcode)
+                    return False
+
+    def process_message(self, message):
+        shard_number, shard_frame_index = self._get_shard_position(message.get_frame_index())
+
+        frame_data = message.get_data()
+        # Only plain bytes and arrays can be passed to the shard processes.
+        if not isinstance(frame_data, (bytes, np.ndarray)):
+            frame_data = bytes(frame_data)
+
+        if not self._put_to_shard(shard_number, (shard_frame_index, message.get_header(), frame_data)):
+            self._dropped_frames += 1
+
+    def stop(self):
+        self._logger.debug("Writer stopped.")
+
+        for shard_number in range(len(self._shard_queues)):
+            self._put_to_shard(shard_number, None)
+
+        for shard_process in self._shard_processes:
+            shard_process.join()
+
+        shard_errors = []
+        for shard_number, shard_process in enumerate(self._shard_processes):
+            if shard_process.exitcode != 0:
+                shard_errors.append("Shard writer %d exited with code %s.\n" % (shard_number, shard_process.exitcode))
+                # Nobody reads the frames left in the queue - do not wait for them on exit.
+                self._shard_queues[shard_number].cancel_join_thread()
+
+        self._shard_queues = []
+        self._shard_processes = []
+
+        # The master file joins the shards that were written.
+        if self._shard_filenames:
+            self._write_master_file()
+
+        if shard_errors:
+            if self._dropped_frames:
+                shard_errors.append("Dropped %d frames for the failed shards.\n" % self._dropped_frames)
+
+            error_message = "".join(shard_errors)
+            self._logger.error(error_message)
+            raise ValueError(error_message)
@@ -1,11 +1,48 @@
 import json
 import struct
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
+from queue import Queue
+from threading import BoundedSemaphore, Thread
+from time import perf_counter
 
 import bitshuffle.h5
+import numpy as np
 from mflow_nodes.processors.proxy import ProxyProcessor
 
-BITSHUFFLE_ENCODING_STRING = "bs16-lz4<"
+from mflow_processor.utils.statistics import ProcessorStatistics
+from mflow_processor.utils.codec_selector import AdaptiveCodecSelector, parse_codec_candidate, UNCOMPRESSED_CODEC, \
+    UNCOMPRESSED_ENCODING_STRING, BITSHUFFLE_ENCODING_STRING, BITSHUFFLE_ZSTD_ENCODING_STRING
+
+CODEC_ENCODING_STRINGS = {"lz4": BITSHUFFLE_ENCODING_STRING,
+                          "zstd": BITSHUFFLE_ZSTD_ENCODING_STRING,
+                          UNCOMPRESSED_CODEC: UNCOMPRESSED_ENCODING_STRING}
+
+# Max number of frames being compressed (or waiting to be forwarded) for each worker.
+PENDING_FRAMES_PER_WORKER = 2
+# Bitshuffle chunk header: number of uncompressed bytes, block size in bytes.
+BITSHUFFLE_CHUNK_HEADER = struct.Struct(">qi")
+
+
+def compress_bitshuffle_chunk(array, block_size, codec="lz4"):
+    """
+    Compress the array into a bitshuffle chunk, ready for H5 write_direct_chunk.
+    The compressed data is copied only once, into a buffer that already contains the chunk header.
+    :param array: Array to compress.
+    :param block_size: Bitshuffle block size (number of elements).
+    :param codec: "lz4" or "zstd". Default is "lz4".
+    :return: Numpy uint8 array with the chunk header and the compressed data.
+    """
+    if codec == "zstd":
+        compressed_bytes = bitshuffle.compress_zstd(array, block_size)
+    else:
+        compressed_bytes = bitshuffle.compress_lz4(array, block_size)
+
+    chunk = np.empty(BITSHUFFLE_CHUNK_HEADER.size + compressed_bytes.nbytes, dtype=np.uint8)
+    BITSHUFFLE_CHUNK_HEADER.pack_into(chunk, 0, array.nbytes, block_size * array.dtype.itemsize)
+    chunk[BITSHUFFLE_CHUNK_HEADER.size:] = compressed_bytes
+
+    return chunk
 
 
 class LZ4CompressionProcessor(ProxyProcessor):
@@ -21,6 +58,15 @@ class LZ4CompressionProcessor(ProxyProcessor):
     Compressor parameters:
         block_size                     Size to use for the LZ4 compression.
         forwarding_address             Address to forward the stream to.
+        n_workers                      Number of threads compressing frames in parallel. 1 is default.
+        ordered_output                 Forward the frames in the received order. Otherwise they are forwarded
+                                       as soon as they are compressed. True is default.
+
+        adaptive                       Select the codec and block size by sampling the stream. False is default.
+        adaptive_candidates            Candidates to sample: "lz4:<block_size>", "zstd:<block_size>" or "none".
+        adaptive_sample_frames         Number of frames to sample for each candidate. 10 is default.
+        adaptive_reevaluate_interval   Number of frames after which the candidates are sampled again. 10000 is default.
+        adaptive_output_bandwidth      Output bandwidth (bytes/s) to weigh ratio against speed. 1e9 is default.
     """
     _logger = getLogger(__name__)
 
@@ -28,6 +74,21 @@ class LZ4CompressionProcessor(ProxyProcessor):
         super().__init__(self, name=name)
 
         self.block_size = 2048
+        self.n_workers = 1
+        self.ordered_output = True
+        self.adaptive = False
+        self.adaptive_candidates = ["lz4:2048", "lz4:8192", UNCOMPRESSED_CODEC]
+        self.adaptive_sample_frames = 10
+        self.adaptive_reevaluate_interval = 10000
+        self.adaptive_output_bandwidth = 1e9
+
+        self._codec_selector = None
+        self._statistics = ProcessorStatistics()
+
+        self._executor = None
+        self._pending_frames = None
+        self._send_queue = None
+        self._sending_thread = None
 
     def _validate_parameters(self):
         error_message = ""
@@ -38,31 +99,165 @@ class LZ4CompressionProcessor(ProxyProcessor):
         if not self.binding_address:
             error_message += "Parameter 'binding_address' not set.\n"
 
+        if not self.n_workers or self.n_workers < 1:
+            error_message += "Parameter 'n_workers' must be a positive number.\n"
+
+        if self.adaptive:
+            for candidate in self.adaptive_candidates or []:
+                try:
+                    codec, _ = parse_codec_candidate(candidate)
+                except ValueError:
+                    codec = None
+
+                if codec not in CODEC_ENCODING_STRINGS:
+                    error_message += "Invalid codec candidate '%s'.\n" % candidate
+                elif codec == "zstd" and not hasattr(bitshuffle, "compress_zstd"):
+                    error_message += "The installed bitshuffle does not support zstd.\n"
+
+            if not self.adaptive_candidates:
+                error_message += "Parameter 'adaptive_candidates' not set.\n"
+
+            if not self.adaptive_sample_frames or self.adaptive_sample_frames < 1:
+                error_message += "Parameter 'adaptive_sample_frames' must be a positive number.\n"
+
         if error_message:
             self._logger.error(error_message)
             raise ValueError(error_message)
 
     def _compress_lz4(self, header, data):
-        def compress_as_chunk(array, block_size):
-            compressed_bytes = bitshuffle.compress_lz4(array, block_size)
-            bytes_number_of_elements = struct.pack('>q', (array.shape[0] * array.shape[1] * array.dtype.itemsize))
-            bytes_block_size = struct.pack('>i', block_size * array.dtype.itemsize)
-            all_bytes = bytes_number_of_elements + bytes_block_size + compressed_bytes.tobytes()
-            return all_bytes
-
-        compressed_data = compress_as_chunk(data, self.block_size)
+        compressed_data = compress_bitshuffle_chunk(data, self.block_size)
 
         new_header = header.copy()
         new_header["encoding"] = BITSHUFFLE_ENCODING_STRING
 
         return new_header, compressed_data
 
+    def _compress_adaptive(self, header, data, candidate):
+        codec, block_size = candidate
+
+        compression_start = perf_counter()
+        if codec == UNCOMPRESSED_CODEC:
+            compressed_data = data
+        else:
+            compressed_data = compress_bitshuffle_chunk(data, block_size, codec)
+        self._codec_selector.record(candidate, perf_counter() - compression_start, compressed_data.nbytes)
+
+        new_header = header.copy()
+        new_header["encoding"] = CODEC_ENCODING_STRINGS[codec]
+
+        return new_header, compressed_data
+
+    def start(self):
+        self._validate_parameters()
+        super().start()
+
+        self._statistics.reset()
+
+        if self.adaptive:
+            self._codec_selector = AdaptiveCodecSelector(self.adaptive_candidates,
+                                                         self.adaptive_sample_frames,
+                                                         self.adaptive_reevaluate_interval,
+                                                         self.adaptive_output_bandwidth)
+        else:
+            self._codec_selector = None
+
+        # bitshuffle releases the GIL while compressing, so threads can compress frames in parallel.
+        if self.n_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.n_workers)
+            self._pending_frames = BoundedSemaphore(self.n_workers * PENDING_FRAMES_PER_WORKER)
+            self._send_queue = Queue()
+            self._sending_thread = Thread(target=self._send_compressed_frames, daemon=True)
+            self._sending_thread.start()
+
+    @staticmethod
+    def _compress_frame(compression_function, compression_arguments):
+        """
+        Compress the frame and measure the compression time.
+        :return: (new_header, compressed_data, compression_time)
+        """
+        compression_start = perf_counter()
+        new_header, compressed_data = compression_function(*compression_arguments)
+
+        return new_header, compressed_data, perf_counter() - compression_start
+
+    def _send(self, header, compressed_chunk, compression_time, receive_time, frame_bytes):
+        forwarding_start = perf_counter()
+
+        self._zmq_forwarder.stream.send(json.dumps(header).encode(), send_more=True, block=True)
+        # Zero copy send - ZMQ keeps a reference to the chunk until it is sent.
+        self._zmq_forwarder.stream.socket.send(compressed_chunk, copy=False)
+
+        # Statistics are recorded only in one thread (receiving or sending), so they do not need a lock.
+        self._statistics.add_stage_time("compression", compression_time)
+        self._statistics.record_stage("forwarding", forwarding_start)
+        self._statistics.record_frame(receive_time, frame_bytes)
+
+    def _send_compressed_frames(self):
+        """
+        Sending thread. Forwards the compressed frames until the stop sentinel (None) is received.
+        All the sending is done in this thread, because ZMQ sockets are not thread safe.
+        """
+        while True:
+            queued_frame = self._send_queue.get()
+
+            if queued_frame is None:
+                break
+
+            compression_job, receive_time, frame_bytes = queued_frame
+
+            try:
+                self._send(*compression_job.result(), receive_time, frame_bytes)
+            except:
+                self._logger.exception("Could not compress and forward frame.")
+            finally:
+                self._pending_frames.release()
+
     def process_message(self, message):
+        receive_time = perf_counter()
         frame_header = message.get_header()
         frame_data = message.get_data()
 
         self._logger.debug("Received frame '%d'." % message.get_frame_index())
-        new_header, compressed_bytes = self._compress_lz4(frame_header, frame_data)
 
-        self._zmq_forwarder.stream.send(json.dumps(new_header).encode(), send_more=True, block=True)
-        self._zmq_forwarder.stream.send(compressed_bytes, block=True)
+        if self._codec_selector is None:
+            compression_function = self._compress_lz4
+            compression_arguments = (frame_header, frame_data)
+        else:
+            # The codec is selected in the receiving thread, so the candidates are sampled in frame order.
+            compression_function = self._compress_adaptive
+            compression_arguments = (frame_header, frame_data, self._codec_selector.get_candidate())
+
+        if self._executor is None:
+            self._send(*self._compress_frame(compression_function, compression_arguments),
+                       receive_time, frame_data.nbytes)
+            return
+
+        # Wait for a free slot, so the pending frames do not pile up in memory.
+        self._pending_frames.acquire()
+        compression_job = self._executor.submit(self._compress_frame, compression_function, compression_arguments)
+        queued_frame = (compression_job, receive_time, frame_data.nbytes)
+
+        if self.ordered_output:
+            self._send_queue.put(queued_frame)
+        else:
+            # The frame index is in the header, so the frames can be forwarded out of order.
+            compression_job.add_done_callback(lambda _: self._send_queue.put(queued_frame))
+
+    def stop(self):
+        if self._executor is not None:
+            # All the compression jobs are queued for sending once the executor is shut down.
+            self._executor.shutdown(wait=True)
+            self._send_queue.put(None)
+            self._sending_thread.join()
+
+            self._executor = None
+            self._sending_thread = None
+
+        super().stop()
+
+    def get_statistics(self):
+        """
+        Get the compression statistics: per stage timings, throughput and frame latency.
+        :return: Dictionary with the statistics.
+        """
+        return self._statistics.get_statistics()
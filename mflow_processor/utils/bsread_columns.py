@@ -0,0 +1,276 @@
+from bisect import bisect_right
+from logging import getLogger
+
+import h5py
+import numpy as np
+
+_logger = getLogger(__name__)
+
+# Number of pulses buffered in memory before they are written to the file.
+DEFAULT_WRITE_BATCH_SIZE = 100
+# Maximum size of a dataset chunk. Chunks hold at most write_batch_size pulses.
+MAX_CHUNK_BYTES = 1 << 20
+
+# Estimated memory used by the python objects of a message and of each of its channel values.
+MESSAGE_SIZE_OVERHEAD = 512
+CHANNEL_SIZE_OVERHEAD = 128
+
+PULSE_ID_DATASET_NAME = "pulse_id"
+GLOBAL_TIMESTAMP_DATASET_NAME = "global_timestamp"
+GLOBAL_TIMESTAMP_OFFSET_DATASET_NAME = "global_timestamp_offset"
+CHANNEL_DATASET_FORMAT = "data/{channel_name}/data"
+CHANNEL_IS_VALID_DATASET_FORMAT = "data/{channel_name}/is_valid"
+
+# bsread channel types -> numpy dtypes. Types not listed are used as numpy type names.
+BSREAD_STRING_TYPE = "string"
+BSREAD_DTYPES = {"bool": "bool",
+                 BSREAD_STRING_TYPE: object}
+
+
+def get_channel_dtype_and_shape(value, channel_metadata=None):
+    """
+    Get the numpy dtype and the shape of a channel. The type is taken from the channel metadata of the bsread data
+    header, if available, the shape from the value (the data header lists image shapes as [width, height]).
+    :param value: Value of the channel.
+    :param channel_metadata: Channel entry of the data header: {"name", "type", "shape"...}.
+    :return: (dtype, shape). Scalar channels have an empty shape.
+    """
+    value = np.asarray(value)
+
+    try:
+        channel_type = channel_metadata["type"]
+        dtype = np.dtype(BSREAD_DTYPES.get(channel_type, channel_type))
+    except (TypeError, KeyError):
+        dtype = np.dtype(object) if value.dtype.kind in "OUS" else value.dtype
+
+    shape = value.shape
+    # Scalar channels are stored as one value per pulse.
+    if shape == (1,):
+        shape = ()
+
+    return dtype, shape
+
+
+def get_message_size(message):
+    """
+    Estimate the memory used by a compact handler message.
+    :param message: Compact handler message.
+    :return: Size in bytes.
+    """
+    size = MESSAGE_SIZE_OVERHEAD
+
+    for channel_value in message.data.values():
+        value = getattr(channel_value, "value", channel_value)
+
+        if isinstance(value, np.ndarray):
+            value_size = value.nbytes
+        elif isinstance(value, (str, bytes)):
+            value_size = len(value)
+        else:
+            value_size = 8
+
+        size += CHANNEL_SIZE_OVERHEAD + value_size
+
+    return size
+
+
+class ChannelColumn(object):
+    """
+    In memory block of values (and validity) of a channel, written to its datasets in one go.
+    """
+
+    def __init__(self, file, channel_name, dtype, shape, n_written, batch_size):
+        """
+        Create the channel datasets, with n_written invalid rows for the pulses written before the channel appeared.
+        """
+        self.dtype = dtype
+        self.shape = shape
+
+        if dtype == object:
+            self.values = np.full((batch_size,) + shape, "", dtype=object)
+            h5_dtype = h5py.string_dtype()
+        else:
+            self.values = np.zeros((batch_size,) + shape, dtype=dtype)
+            h5_dtype = dtype
+        self.is_valid = np.zeros(batch_size, dtype=bool)
+
+        row_bytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        chunk_rows = max(1, min(batch_size, MAX_CHUNK_BYTES // row_bytes))
+
+        self.dataset = file.create_dataset(CHANNEL_DATASET_FORMAT.format(channel_name=channel_name),
+                                           shape=(n_written,) + shape,
+                                           maxshape=(None,) + shape,
+                                           chunks=(chunk_rows,) + shape,
+                                           dtype=h5_dtype)
+        self.is_valid_dataset = file.create_dataset(CHANNEL_IS_VALID_DATASET_FORMAT.format(channel_name=channel_name),
+                                                    shape=(n_written,),
+                                                    maxshape=(None,),
+                                                    chunks=(batch_size,),
+                                                    dtype=bool)
+
+    def set_value(self, row, value):
+        """
+        Store the value of the pulse. Values that cannot be converted to the channel type and shape are invalid.
+        """
+        try:
+            # Scalars can be received as 1 element arrays.
+            if not self.shape and np.ndim(value):
+                value = np.asarray(value).reshape(())
+
+            self.values[row] = value
+            self.is_valid[row] = True
+        except (ValueError, TypeError):
+            self.is_valid[row] = False
+
+    def write(self, n_written, n_rows):
+        """
+        Append the first n_rows of the block to the datasets and clear the block.
+        """
+        self.dataset.resize(n_written + n_rows, axis=0)
+        self.dataset[n_written:] = self.values[:n_rows]
+        self.is_valid_dataset.resize(n_written + n_rows, axis=0)
+        self.is_valid_dataset[n_written:] = self.is_valid[:n_rows]
+
+        self.clear_rows(0)
+
+    def clear_rows(self, first_row):
+        """
+        Clear the rows of the block from first_row on.
+        """
+        self.values[first_row:] = "" if self.dtype == object else 0
+        self.is_valid[first_row:] = False
+
+
+class BsreadColumnWriter(object):
+    """
+    Write bsread messages (compact handler format) to a HDF5 file: one typed, chunked dataset per channel with an
+    is_valid mask (channel missing from the message or with a wrong type/shape), plus the pulse_id and the global
+    timestamp of each pulse. Rows are pulses, in the order the messages are added.
+
+    The messages are stored in per channel numpy blocks and written every write_batch_size pulses, so each dataset is
+    resized and written once per batch instead of once per message.
+    """
+
+    def __init__(self, file, write_batch_size=DEFAULT_WRITE_BATCH_SIZE, channels=None):
+        """
+        Initialize the column writer.
+        :param file: H5 file to write to.
+        :param write_batch_size: Number of pulses to write at once.
+        :param channels: Names of the channels to write. None to write all the channels of the messages.
+        """
+        self._file = file
+        self._batch_size = write_batch_size
+        self._channels = set(channels) if channels else None
+
+        self._columns = {}
+        self._n_rows = 0
+        self.n_written = 0
+
+        self._pulse_ids = np.zeros(write_batch_size, dtype="int64")
+        self._global_timestamps = np.zeros(write_batch_size, dtype="int64")
+        self._global_timestamp_offsets = np.zeros(write_batch_size, dtype="int64")
+
+        self._pulse_id_dataset = self._create_pulse_dataset(PULSE_ID_DATASET_NAME)
+        self._global_timestamp_dataset = self._create_pulse_dataset(GLOBAL_TIMESTAMP_DATASET_NAME)
+        self._global_timestamp_offset_dataset = self._create_pulse_dataset(GLOBAL_TIMESTAMP_OFFSET_DATASET_NAME)
+
+    def _create_pulse_dataset(self, dataset_name):
+        return self._file.create_dataset(dataset_name, shape=(0,), maxshape=(None,), chunks=(self._batch_size,),
+                                         dtype="int64")
+
+    @property
+    def n_pulses(self):
+        """
+        Number of pulses added: written and buffered.
+        """
+        return self.n_written + self._n_rows
+
+    def add_message(self, message, channels_metadata=None):
+        """
+        Add a message to the current batch. The batch is written when full.
+        :param message: Compact handler message (pulse_id, global_timestamp, global_timestamp_offset, data).
+        :param channels_metadata: Dictionary of channel name -> channel entry of the data header.
+        """
+        row = self._n_rows
+
+        self._pulse_ids[row] = message.pulse_id
+        self._global_timestamps[row] = message.global_timestamp or 0
+        self._global_timestamp_offsets[row] = message.global_timestamp_offset or 0
+
+        for channel_name, channel_value in message.data.items():
+            if self._channels is not None and channel_name not in self._channels:
+                continue
+
+            # Compact handler values carry the channel timestamp as well.
+            value = getattr(channel_value, "value", channel_value)
+            if value is None:
+                continue
+
+            column = self._columns.get(channel_name)
+            if column is None:
+                dtype, shape = get_channel_dtype_and_shape(value, (channels_metadata or {}).get(channel_name))
+                column = ChannelColumn(self._file, channel_name, dtype, shape, self.n_written, self._batch_size)
+                self._columns[channel_name] = column
+
+            column.set_value(row, value)
+
+        self._n_rows += 1
+
+        if self._n_rows == self._batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered pulses to the file.
+        """
+        if not self._n_rows:
+            return
+
+        n_rows = self._n_rows
+
+        for dataset, values in ((self._pulse_id_dataset, self._pulse_ids),
+                                (self._global_timestamp_dataset, self._global_timestamps),
+                                (self._global_timestamp_offset_dataset, self._global_timestamp_offsets)):
+            dataset.resize(self.n_written + n_rows, axis=0)
+            dataset[self.n_written:] = values[:n_rows]
+
+        for column in self._columns.values():
+            column.write(self.n_written, n_rows)
+
+        self.n_written += n_rows
+        self._n_rows = 0
+
+    def truncate(self, n_pulses):
+        """
+        Remove the pulses after the first n_pulses from the file (the buffered pulses have to be flushed before).
+        :param n_pulses: Number of pulses to keep.
+        """
+        datasets = [self._pulse_id_dataset, self._global_timestamp_dataset, self._global_timestamp_offset_dataset]
+        for column in self._columns.values():
+            datasets += [column.dataset, column.is_valid_dataset]
+
+        for dataset in datasets:
+            dataset.resize(n_pulses, axis=0)
+
+        self.n_written = n_pulses
+
+    def truncate_after(self, end_pulse_id):
+        """
+        Remove the pulses after end_pulse_id, buffered or written. The pulse ids are expected in increasing order, so
+        the last pulse to keep is found with a binary search and each dataset is resized once.
+        :param end_pulse_id: Last pulse_id to keep.
+        :return: Number of pulses removed.
+        """
+        n_pulses = self.n_pulses
+
+        n_rows = bisect_right(self._pulse_ids[:self._n_rows], end_pulse_id)
+        if n_rows < self._n_rows:
+            for column in self._columns.values():
+                column.clear_rows(n_rows)
+            self._n_rows = n_rows
+
+        # Written pulses are removed only if no buffered pulse is kept. Each search step reads one pulse_id.
+        if not self._n_rows and self.n_written and self._pulse_id_dataset[self.n_written - 1] > end_pulse_id:
+            self.truncate(bisect_right(self._pulse_id_dataset, end_pulse_id, hi=self.n_written))
+
+        return n_pulses - self.n_pulses
@@ -0,0 +1,203 @@
+import os
+from logging import getLogger
+from threading import Thread
+from time import perf_counter
+
+import h5py
+
+from mflow_processor.utils.bsread_columns import BsreadColumnWriter, DEFAULT_WRITE_BATCH_SIZE
+from mflow_processor.utils.frame_dump import DEFAULT_FRAME_DUMP_SIZE
+from mflow_processor.utils.h5_utils import create_folder_if_does_not_exist
+from mflow_processor.utils.message_queue import BoundedMessageQueue
+from mflow_processor.utils.statistics import ProcessorStatistics
+
+_logger = getLogger(__name__)
+
+# Suffix of the default spill file name.
+SPILL_FILENAME_SUFFIX = ".spill"
+WRITE_JOB_PARAMETERS = ("output_file", "channels", "start_pulse_id", "end_pulse_id")
+
+
+def validate_write_job(job_parameters):
+    """
+    Check the parameters of a write job.
+    :param job_parameters: Dictionary with output_file, start_pulse_id, and optionally channels and end_pulse_id.
+    :return: ValueError if any parameter is missing or unknown.
+    """
+    error_message = ""
+
+    if not isinstance(job_parameters, dict):
+        raise ValueError("Write job must be a dictionary, got %s.\n" % (job_parameters,))
+
+    unknown_parameters = set(job_parameters) - set(WRITE_JOB_PARAMETERS)
+    if unknown_parameters:
+        error_message += "Unknown write job parameters %s.\n" % sorted(unknown_parameters)
+
+    if not job_parameters.get("output_file"):
+        error_message += "Write job parameter 'output_file' not set.\n"
+
+    if job_parameters.get("start_pulse_id") is None and job_parameters.get("end_pulse_id") is None:
+        error_message += "Write job needs a 'start_pulse_id' (new job) or an 'end_pulse_id' (running job).\n"
+
+    if error_message:
+        raise ValueError(error_message)
+
+
+class BsreadWriteJob(object):
+    """
+    Write the messages of a pulse_id window, and of a subset of the channels, to a HDF5 file.
+
+    Each job has its own writing thread and bounded queue (see BoundedMessageQueue for the overflow policies), so
+    several jobs can write the messages of one bsread stream at the same time.
+    """
+
+    def __init__(self, output_file, start_pulse_id, end_pulse_id=None, channels=None,
+                 write_batch_size=DEFAULT_WRITE_BATCH_SIZE, buffer_size=100, buffer_overflow_policy="drop_oldest",
+                 spill_file=None, spill_file_size=DEFAULT_FRAME_DUMP_SIZE, receive_timeout=1000):
+        """
+        Initialize the write job.
+        :param output_file: File to write to, overwritten if exists.
+        :param start_pulse_id: First pulse_id to write.
+        :param end_pulse_id: Last pulse_id to write. None to write until stopped (or until end_pulse_id is set).
+        :param channels: Names of the channels to write. None to write all the channels.
+        :param write_batch_size: Number of pulses to write to the file at once.
+        :param buffer_size: Number of messages to buffer between receiving and writing.
+        :param buffer_overflow_policy: One of QUEUE_OVERFLOW_POLICIES.
+        :param spill_file: File to spill the messages to. None for output_file with the '.spill' suffix.
+        :param spill_file_size: Size of the spill file in bytes.
+        :param receive_timeout: Milliseconds to wait for messages, before checking if the job is still running.
+        """
+        self.output_file = output_file
+        self.start_pulse_id = start_pulse_id
+        self.end_pulse_id = end_pulse_id
+        self.channels = channels
+        self.write_batch_size = write_batch_size
+        self.receive_timeout = receive_timeout
+
+        if buffer_overflow_policy == "spill":
+            spill_file = spill_file or os.path.splitext(output_file)[0] + SPILL_FILENAME_SUFFIX
+            create_folder_if_does_not_exist(spill_file)
+        else:
+            spill_file = None
+
+        self.buffer = BoundedMessageQueue(buffer_size, buffer_overflow_policy, spill_file, spill_file_size)
+        # The overflow policy applies from the start.
+        self.buffer.set_consumer_active(True)
+
+        # Channels metadata from the data header: channel name -> {"name", "type", "shape"...}.
+        self.channels_metadata = {}
+
+        self._statistics = ProcessorStatistics()
+        self._writing_thread = None
+        self._running = False
+
+    @property
+    def is_running(self):
+        return self._writing_thread is not None and self._writing_thread.is_alive()
+
+    def start(self, buffered_messages=None):
+        """
+        Start the writing thread.
+        :param buffered_messages: Messages received before the job started, in pulse_id order.
+        """
+        create_folder_if_does_not_exist(self.output_file)
+
+        self._running = True
+        self._writing_thread = Thread(target=self.write_messages, args=(buffered_messages,))
+        self._writing_thread.start()
+
+    def put(self, message):
+        """
+        Queue a received message for writing.
+        """
+        self.buffer.put(message)
+
+    def stop(self):
+        """
+        Stop the writing thread, writing the pulses still in memory, and remove the spill file.
+        """
+        self._running = False
+        # Wake up the writing thread waiting for messages.
+        self.buffer.close()
+
+        if self._writing_thread:
+            self._writing_thread.join()
+
+        if self.buffer.n_dropped:
+            _logger.warning("Dropped %d messages for '%s' because the buffer was full.", self.buffer.n_dropped,
+                            self.output_file)
+
+        self.buffer.close_spill()
+
+    def write_messages(self, buffered_messages=None):
+        _logger.info("Writing channels to output_file '%s'.", self.output_file)
+
+        try:
+            with h5py.File(self.output_file, 'w') as h5_file:
+                column_writer = BsreadColumnWriter(h5_file, self.write_batch_size, self.channels)
+
+                # Messages received before the writing started.
+                end_reached = not self._write_messages_batch(column_writer, buffered_messages or [])
+
+                while self._running and not end_reached:
+                    # Wakes up as soon as messages are buffered, the timeout is only to check if still running.
+                    messages = self.buffer.get_batch(self.write_batch_size, timeout=self.receive_timeout / 1000)
+                    end_reached = not self._write_messages_batch(column_writer, messages)
+
+                # Pulses of the last, incomplete batch.
+                column_writer.flush()
+
+        except:
+            _logger.exception("Error while writing bsread stream to '%s'.", self.output_file)
+
+        finally:
+            self.buffer.set_consumer_active(False)
+
+    def _write_messages_batch(self, column_writer, messages):
+        """
+        Write the messages from start_pulse_id up to end_pulse_id.
+        :return: False if end_pulse_id was reached.
+        """
+        for next_msg in messages:
+            msg_pulse_id = next_msg.data.pulse_id
+
+            end_pulse_id = self.end_pulse_id
+            if end_pulse_id and end_pulse_id < msg_pulse_id:
+                # end_pulse_id can be set after later pulses were written.
+                n_removed = column_writer.truncate_after(end_pulse_id)
+                if n_removed:
+                    _logger.debug('Removed %d pulses after end_pulse_id %d', n_removed, end_pulse_id)
+
+                return False
+
+            if msg_pulse_id < self.start_pulse_id:
+                _logger.debug('Discard %d', msg_pulse_id)
+                continue  # discard the message
+
+            _logger.debug('Write to hdf5 %d', msg_pulse_id)
+            write_start = perf_counter()
+            column_writer.add_message(next_msg.data, self.channels_metadata)
+
+            # Buffered messages do not carry the receive time, the latency covers only the write.
+            self._statistics.record_stage("hdf5_write", write_start)
+            self._statistics.record_frame(write_start, 0)
+
+            # Stop at the boundary, without waiting for the next pulse.
+            if end_pulse_id and msg_pulse_id == end_pulse_id:
+                return False
+
+        return True
+
+    def get_statistics(self):
+        """
+        Get the write statistics of the job: per stage timings, message rate, latency and buffer counters.
+        :return: Dictionary with the statistics.
+        """
+        statistics = self._statistics.get_statistics()
+        statistics["running"] = self.is_running
+        statistics["buffered_messages"] = len(self.buffer)
+        statistics["dropped_messages"] = self.buffer.n_dropped
+        statistics["spilled_messages"] = self.buffer.n_spilled
+        statistics["blocked_messages"] = self.buffer.n_blocked
+
+        return statistics
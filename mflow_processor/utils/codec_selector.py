@@ -0,0 +1,130 @@
+from logging import getLogger
+from threading import Lock
+
+# Codec that forwards the frames without compressing them.
+UNCOMPRESSED_CODEC = "none"
+# Header encoding of the frames forwarded without compression.
+UNCOMPRESSED_ENCODING_STRING = "none"
+BITSHUFFLE_ENCODING_STRING = "bs16-lz4<"
+BITSHUFFLE_ZSTD_ENCODING_STRING = "bs16-zstd<"
+
+BITSHUFFLE_FILTER = 32008
+# Compression option of the bitshuffle filter (bitshuffle.h5 H5_COMPRESS_LZ4, H5_COMPRESS_ZSTD) -> frame encoding.
+BITSHUFFLE_COMPRESSION_ENCODINGS = {2: BITSHUFFLE_ENCODING_STRING,
+                                    3: BITSHUFFLE_ZSTD_ENCODING_STRING}
+
+_logger = getLogger(__name__)
+
+
+def parse_codec_candidate(candidate):
+    """
+    Parse the codec candidate string.
+    :param candidate: Codec candidate in the format "<codec>:<block_size>" or "none".
+    :return: (codec, block_size) tuple.
+    """
+    if candidate == UNCOMPRESSED_CODEC:
+        return UNCOMPRESSED_CODEC, None
+
+    codec, block_size = candidate.split(":")
+    return codec, int(block_size)
+
+
+def get_dataset_encodings(compression, compression_opts=None):
+    """
+    Get the frame encodings that can be written as they are (direct chunk write) to a dataset.
+    :param compression: Compression filter of the dataset. None for no compression.
+    :param compression_opts: Options of the filter. Bitshuffle: (block_size, compression[, level]).
+    :return: Set of header encodings. Frames with any other encoding would be corrupted in the dataset.
+    """
+    encodings = {UNCOMPRESSED_ENCODING_STRING}
+
+    if compression == BITSHUFFLE_FILTER and compression_opts is not None and len(compression_opts) > 1:
+        encoding = BITSHUFFLE_COMPRESSION_ENCODINGS.get(compression_opts[1])
+        if encoding:
+            encodings.add(encoding)
+
+    return encodings
+
+
+class AdaptiveCodecSelector(object):
+    """
+    Select the best codec for a stream by sampling the candidates on the first frames of the stream.
+
+    Each candidate is used on sample_frames frames (round robin). The candidate with the lowest cost per frame
+    is then used until the next evaluation. The cost of a frame is the compression time plus the time needed
+    to transfer the compressed frame at output_bandwidth, so incompressible streams are not compressed.
+    """
+
+    def __init__(self, candidates, sample_frames, reevaluate_interval=None, output_bandwidth=1e9):
+        """
+        Initialize the codec selector.
+        :param candidates: List of candidate strings ("<codec>:<block_size>" or "none").
+        :param sample_frames: Number of frames to sample for each candidate.
+        :param reevaluate_interval: Number of frames after which the candidates are sampled again. None to never
+        re-evaluate.
+        :param output_bandwidth: Bandwidth (bytes/s) of the output, to weigh the compression ratio against the
+        compression time.
+        """
+        self._candidates = [parse_codec_candidate(candidate) for candidate in candidates]
+        self._sample_frames = sample_frames
+        self._reevaluate_interval = reevaluate_interval
+        self._output_bandwidth = output_bandwidth
+
+        self._lock = Lock()
+        self._start_sampling()
+
+    def _start_sampling(self):
+        # Candidate -> [number of frames, compression time, compressed bytes].
+        self._samples = {candidate: [0, 0.0, 0] for candidate in self._candidates}
+        self._n_sampled_frames = 0
+        self._selected_candidate = None
+        self._frames_since_selection = 0
+
+    def get_candidate(self):
+        """
+        Get the codec to use for the next frame.
+        :return: (codec, block_size) tuple.
+        """
+        with self._lock:
+            if self._selected_candidate is not None:
+                self._frames_since_selection += 1
+
+                if not self._reevaluate_interval or self._frames_since_selection < self._reevaluate_interval:
+                    return self._selected_candidate
+
+                _logger.debug("Re-evaluating codec candidates.")
+                self._start_sampling()
+
+            candidate = self._candidates[self._n_sampled_frames % len(self._candidates)]
+            self._n_sampled_frames += 1
+            return candidate
+
+    def record(self, candidate, compression_time, compressed_bytes):
+        """
+        Record the result of compressing a frame.
+        :param candidate: (codec, block_size) used on the frame.
+        :param compression_time: Time needed to compress the frame, in seconds.
+        :param compressed_bytes: Size of the compressed frame.
+        """
+        with self._lock:
+            # Frames compressed during the previous sampling period are ignored.
+            if self._selected_candidate is not None or candidate not in self._samples:
+                return
+
+            candidate_samples = self._samples[candidate]
+            candidate_samples[0] += 1
+            candidate_samples[1] += compression_time
+            candidate_samples[2] += compressed_bytes
+
+            if all(samples[0] >= self._sample_frames for samples in self._samples.values()):
+                self._select_candidate()
+
+    def _select_candidate(self):
+        def get_frame_cost(candidate):
+            n_frames, compression_time, compressed_bytes = self._samples[candidate]
+            return (compression_time + compressed_bytes / self._output_bandwidth) / n_frames
+
+        self._selected_candidate = min(self._candidates, key=get_frame_cost)
+        self._frames_since_selection = 0
+
+        _logger.info("Selected codec '%s' with block size %s.", *self._selected_candidate)
@@ -0,0 +1,217 @@
+from collections import OrderedDict
+from logging import getLogger
+from time import time
+
+import numpy as np
+
+# Number of chunks that can be staged at the same time (out of order frames tolerance).
+DEFAULT_MAX_OPEN_CHUNKS = 4
+
+_logger = getLogger(__name__)
+
+
+def get_frame_array(frame_data, frame_size, dtype):
+    """
+    Interpret the received frame data as a frame array, without copying it.
+    :param frame_data: Frame as bytes or numpy array.
+    :param frame_size: Size of the frame.
+    :param dtype: Frame data type.
+    :return: Numpy array with the frame shape.
+    """
+    if isinstance(frame_data, np.ndarray):
+        return frame_data.reshape(frame_size)
+
+    return np.frombuffer(frame_data, dtype=dtype).reshape(frame_size)
+
+
+class FrameChunkStager(object):
+    """
+    Stage frames in preallocated buffers until a whole multi frame chunk can be written to the dataset.
+
+    Frames can arrive out of order - up to max_open_chunks chunks are staged at the same time. When no free
+    buffer is left, the oldest chunk is written even if incomplete. If a frame for an already written chunk
+    arrives later, the chunk is read back, completed and written again.
+    """
+
+    def __init__(self, dataset, frames_per_chunk, frame_size, dtype, direct_write=True,
+                 max_open_chunks=DEFAULT_MAX_OPEN_CHUNKS, written_frames=0):
+        """
+        Initialize the chunk stager.
+        :param dataset: Dataset to write the chunks to. It has to be chunked with frames_per_chunk frames.
+        :param frames_per_chunk: Number of frames in each chunk.
+        :param frame_size: Size of a single frame.
+        :param dtype: Frame data type.
+        :param direct_write: Write the chunks with write_direct_chunk. Set to False for datasets with filters.
+        :param max_open_chunks: Max number of chunks to stage at the same time.
+        :param written_frames: Number of frames already in the dataset (reopened file). Their chunks are read back
+        before adding late frames to them.
+        """
+        self._dataset = dataset
+        self._frames_per_chunk = frames_per_chunk
+        self._frame_size = list(frame_size)
+        self._dtype = dtype
+        self._direct_write = direct_write
+        self._chunk_offset_suffix = (0,) * len(self._frame_size)
+
+        self._free_buffers = [(np.zeros([frames_per_chunk] + self._frame_size, dtype=dtype),
+                               np.zeros(frames_per_chunk, dtype=bool))
+                              for _ in range(max_open_chunks)]
+        self._open_chunks = OrderedDict()
+        # Received frames mask for chunks that were written incomplete.
+        self._partial_chunks = {}
+        self._written_chunks = set(range((written_frames + frames_per_chunk - 1) // frames_per_chunk))
+
+    def add_frame(self, frame_index, frame_data):
+        """
+        Stage a frame and write its chunk if all the frames in the chunk were received.
+        :param frame_index: Index of the frame in the dataset.
+        :param frame_data: Frame as bytes or numpy array.
+        """
+        chunk_index, chunk_position = divmod(frame_index, self._frames_per_chunk)
+
+        if chunk_index not in self._open_chunks:
+            self._open_chunk(chunk_index)
+
+        buffer, received = self._open_chunks[chunk_index]
+        buffer[chunk_position] = get_frame_array(frame_data, self._frame_size, self._dtype)
+        received[chunk_position] = True
+
+        if received.all():
+            self._write_chunk(chunk_index)
+
+    def _open_chunk(self, chunk_index):
+        if not self._free_buffers:
+            oldest_chunk_index = next(iter(self._open_chunks))
+            _logger.debug("No free staging buffer for chunk '%d'. Writing incomplete chunk '%d'.",
+                          chunk_index, oldest_chunk_index)
+            self._write_chunk(oldest_chunk_index)
+
+        buffer, received = self._free_buffers.pop()
+
+        if chunk_index in self._written_chunks:
+            # Late frame for an already written chunk - continue from what is in the dataset.
+            chunk_start = chunk_index * self._frames_per_chunk
+            n_frames = min(self._frames_per_chunk, self._dataset.shape[0] - chunk_start)
+            _logger.debug("Reloading chunk '%d' from the dataset.", chunk_index)
+
+            self._dataset.read_direct(buffer, source_sel=np.s_[chunk_start:chunk_start + n_frames],
+                                      dest_sel=np.s_[0:n_frames])
+            received[:] = self._partial_chunks.pop(chunk_index, True)
+        else:
+            buffer.fill(0)
+            received.fill(False)
+
+        self._open_chunks[chunk_index] = (buffer, received)
+
+    def _write_chunk(self, chunk_index):
+        buffer, received = self._open_chunks.pop(chunk_index)
+        chunk_start = chunk_index * self._frames_per_chunk
+
+        if self._direct_write:
+            self._dataset.id.write_direct_chunk((chunk_start,) + self._chunk_offset_suffix, buffer)
+        else:
+            # The chunk can exceed the dataset size at the end of the dataset.
+            n_frames = min(self._frames_per_chunk, self._dataset.shape[0] - chunk_start)
+            self._dataset.write_direct(buffer, source_sel=np.s_[0:n_frames],
+                                       dest_sel=np.s_[chunk_start:chunk_start + n_frames])
+
+        if not received.all():
+            self._partial_chunks[chunk_index] = received.copy()
+
+        self._written_chunks.add(chunk_index)
+        self._free_buffers.append((buffer, received))
+
+    def flush(self):
+        """
+        Write all the staged chunks, including incomplete ones.
+        """
+        while self._open_chunks:
+            self._write_chunk(next(iter(self._open_chunks)))
+
+
+class FrameBatchBuffer(object):
+    """
+    Collect frames in a preallocated, reusable buffer and write them in batches.
+
+    Each run of consecutive frame indexes in the batch is written with a single hyperslab write. The batch is
+    written when the max number of frames or bytes is reached, or when the oldest frame in the batch is older
+    than max_delay seconds.
+    """
+
+    def __init__(self, dataset, max_frames, frame_size, dtype, max_bytes=None, max_delay=None):
+        """
+        Initialize the batch buffer.
+        :param dataset: Dataset to write the frames to.
+        :param max_frames: Max number of frames in a batch.
+        :param frame_size: Size of a single frame.
+        :param dtype: Frame data type.
+        :param max_bytes: Max number of bytes in a batch. None for no limit.
+        :param max_delay: Max time in seconds a frame can wait in the buffer. None for no limit.
+        """
+        self._dataset = dataset
+        self._frame_size = list(frame_size)
+        self._dtype = dtype
+        self._max_delay = max_delay
+
+        self._frame_bytes = int(np.prod(self._frame_size)) * np.dtype(dtype).itemsize
+        self._max_frames = max_frames
+        if max_bytes:
+            self._max_frames = max(1, min(max_frames, max_bytes // self._frame_bytes))
+
+        self._buffer = np.empty([self._max_frames] + self._frame_size, dtype=dtype)
+        # Raw frames are copied into the buffer as bytes, without constructing an array for each of them.
+        self._buffer_bytes = memoryview(self._buffer.reshape(-1).view(np.uint8))
+        self._frame_indexes = np.empty(self._max_frames, dtype=np.int64)
+        self._n_frames = 0
+        self._first_frame_time = None
+
+    def add_frame(self, frame_index, frame_data):
+        """
+        Add a frame to the batch and write the batch if any of the thresholds is reached.
+        :param frame_index: Index of the frame in the dataset.
+        :param frame_data: Frame as bytes or numpy array.
+        """
+        if self._n_frames == 0 and self._max_delay is not None:
+            self._first_frame_time = time()
+
+        if isinstance(frame_data, np.ndarray):
+            self._buffer[self._n_frames] = frame_data.reshape(self._frame_size)
+        else:
+            buffer_offset = self._n_frames * self._frame_bytes
+            self._buffer_bytes[buffer_offset:buffer_offset + self._frame_bytes] = frame_data
+
+        self._frame_indexes[self._n_frames] = frame_index
+        self._n_frames += 1
+
+        if self._n_frames == self._max_frames:
+            self.flush()
+        elif self._max_delay is not None:
+            self.flush_if_expired()
+
+    def flush_if_expired(self):
+        """
+        Write the batch if the oldest frame in it waited longer than max_delay.
+        """
+        if self._n_frames and self._max_delay is not None and time() - self._first_frame_time >= self._max_delay:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the frames in the batch.
+        """
+        if not self._n_frames:
+            return
+
+        frame_indexes = self._frame_indexes[:self._n_frames]
+
+        # Split the batch into runs of consecutive frame indexes.
+        run_breaks = np.flatnonzero(np.diff(frame_indexes) != 1) + 1
+        run_starts = np.concatenate(([0], run_breaks))
+        run_ends = np.concatenate((run_breaks, [self._n_frames]))
+
+        for run_start, run_end in zip(run_starts, run_ends):
+            dataset_start = frame_indexes[run_start]
+            self._dataset.write_direct(self._buffer, source_sel=np.s_[run_start:run_end],
+                                       dest_sel=np.s_[dataset_start:dataset_start + run_end - run_start])
+
+        self._n_frames = 0
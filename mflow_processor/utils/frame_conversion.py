@@ -0,0 +1,336 @@
+import json
+import mmap
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from time import perf_counter
+
+import bitshuffle
+import h5py
+import numpy as np
+from bitshuffle.h5 import H5_COMPRESS_LZ4
+
+from mflow_processor.lz4_compressor import compress_bitshuffle_chunk, BITSHUFFLE_ENCODING_STRING, \
+    BITSHUFFLE_CHUNK_HEADER
+from mflow_processor.utils.codec_selector import UNCOMPRESSED_ENCODING_STRING
+from mflow_processor.utils.frame_dump import read_frame_dump_index, read_frame_record
+from mflow_processor.utils.h5_utils import create_dataset, create_virtual_dataset, create_folder_if_does_not_exist, \
+    populate_h5_file
+from mflow_processor.utils.nxmx_utils import MASTER_FILENAME_SUFFIX, DATA_FILENAME_TEMPLATE, DATA_DATASET_NAME
+from mflow_processor.utils.schemas.csax_nxsas import csax_nxsas_schema, csax_nxsas_values
+from mflow_processor.utils.stream_capture import CAPTURE_PART_SIZES_KEY
+
+_logger = getLogger(__name__)
+
+INPUT_FORMATS = ("dump", "raw")
+OUTPUT_FORMATS = ("plain", "nxmx", "nxsas")
+DEFAULT_FRAMES_PER_FILE = 1000
+DEFAULT_BLOCK_SIZE = 2048
+BITSHUFFLE_FILTER = 32008
+# Messages in stream captures without a frame: the detector header and the end of series.
+NON_FRAME_HTYPES = ("dheader-", "dseries_end-")
+# Encoding of uncompressed (little endian) frames in the Dectris image data header.
+DIMAGE_UNCOMPRESSED_ENCODING = "<"
+
+NXMX_GROUP_ATTRIBUTES = {"/entry:NX_class": "NXentry",
+                         "/entry/data:NX_class": "NXdata"}
+
+
+def get_data_filename_format(output_file):
+    """
+    Get the data files name format for the master file, the same as the NXMX writer uses.
+    :param output_file: Master file name, ideally <experiment_id>_master.h5.
+    :return: Data file name format, with the chunk_number field.
+    """
+    output_file = os.path.abspath(os.path.expanduser(output_file))
+
+    if output_file.endswith(MASTER_FILENAME_SUFFIX):
+        experiment_id = output_file[:-len(MASTER_FILENAME_SUFFIX)]
+    else:
+        experiment_id = os.path.splitext(output_file)[0]
+
+    return DATA_FILENAME_TEMPLATE.format(experiment_id=experiment_id)
+
+
+def get_output_attributes(output_format):
+    """
+    :param output_format: One of OUTPUT_FORMATS.
+    :return: (h5_group_attributes, h5_datasets, h5_dataset_attributes) for the master file.
+    """
+    if output_format == "nxmx":
+        return NXMX_GROUP_ATTRIBUTES, {}, {}
+
+    if output_format == "nxsas":
+        h5_datasets = csax_nxsas_values["h5_dataset_fixed_values"]
+        # Only the attributes of the datasets that are going to exist.
+        h5_dataset_attributes = {name: value for name, value in csax_nxsas_schema["h5_dataset_attributes"].items()
+                                 if name.split(":")[0] in h5_datasets}
+        return csax_nxsas_schema["h5_group_attributes"], h5_datasets, h5_dataset_attributes
+
+    return {}, {}, {}
+
+
+def get_frame_header(header, record_data):
+    """
+    Get the header of the frame in a frame dump or stream capture record.
+    Dectris dimage messages have the shape, type and encoding of the frame in the image data header part.
+    :param header: Record header.
+    :param record_data: Record data (memoryview).
+    :return: Header with the frame shape, type and encoding, or None if the record has no frame.
+    """
+    htype = header.get("htype", "")
+    part_sizes = header.get(CAPTURE_PART_SIZES_KEY)
+
+    if htype.startswith(NON_FRAME_HTYPES):
+        return None
+
+    if part_sizes is None:
+        return header
+
+    # Other messages with more than one data part do not have a single frame.
+    if not htype.startswith("dimage-") or len(part_sizes) < 2:
+        return None
+
+    image_header = json.loads(bytes(record_data[:part_sizes[0]]).decode())
+
+    encoding = image_header.get("encoding", DIMAGE_UNCOMPRESSED_ENCODING)
+    if encoding == DIMAGE_UNCOMPRESSED_ENCODING:
+        encoding = UNCOMPRESSED_ENCODING_STRING
+
+    return dict(header, shape=image_header["shape"], type=image_header["type"], encoding=encoding)
+
+
+def get_frame_data(header, record_data):
+    """
+    Get the frame data of a frame dump or stream capture record.
+    :param header: Record header.
+    :param record_data: Record data (memoryview).
+    :return: Frame data (memoryview). The image data part for dimage messages.
+    """
+    part_sizes = header.get(CAPTURE_PART_SIZES_KEY)
+    if part_sizes is None:
+        return record_data
+
+    # Image data header, image data and image config parts.
+    return record_data[part_sizes[0]:part_sizes[0] + part_sizes[1]]
+
+
+def index_input_files(input_files, input_format, frame_shape=None, dtype=None):
+    """
+    Find the frames in the input files.
+    :param input_files: List of frame dump files (FrameDump records, stream captures) or raw frame files.
+    :param input_format: "dump" or "raw". Raw files are consecutive frames of frame_shape and dtype, numbered across
+    all the files in the provided order.
+    :param frame_shape: Shape of the frames. Taken from the first record of the dump files if None.
+    :param dtype: Data type of the frames. Taken from the first record of the dump files if None.
+    :return: (frame_shape, dtype, dictionary of frame_index -> (filename, offset)).
+    """
+    frames = {}
+
+    if input_format == "raw":
+        if not frame_shape or not dtype:
+            raise ValueError("Raw frame files need the frame shape and dtype.")
+
+        frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+
+        for filename in input_files:
+            n_file_frames = os.path.getsize(filename) // frame_bytes
+            for file_frame in range(n_file_frames):
+                frames[len(frames)] = (filename, file_frame * frame_bytes)
+
+        return list(frame_shape), dtype, frames
+
+    n_duplicates = 0
+
+    for filename in input_files:
+        header, frame_records = read_frame_dump_index(filename, get_frame_header)
+
+        if header is not None:
+            frame_shape = frame_shape or header["shape"]
+            dtype = dtype or header["type"]
+
+        for frame_index, record_offset in frame_records:
+            if frame_index in frames:
+                n_duplicates += 1
+                continue
+
+            frames[frame_index] = (filename, record_offset)
+
+    if n_duplicates:
+        _logger.warning("Skipped %d duplicate frames.", n_duplicates)
+
+    return list(frame_shape or []), dtype, frames
+
+
+def get_frame_bytes(input_buffer, input_format, offset, frame_bytes, compress, frame_shape, dtype):
+    """
+    Read a frame from the input file and prepare it for write_direct_chunk.
+    :return: Bytes of the H5 chunk.
+    """
+    if input_format == "raw":
+        frame_data = input_buffer[offset:offset + frame_bytes]
+        encoding = UNCOMPRESSED_ENCODING_STRING
+    else:
+        header, record_data = read_frame_record(input_buffer, offset)[:2]
+        frame_data = get_frame_data(header, record_data)
+        encoding = get_frame_header(header, record_data).get("encoding", UNCOMPRESSED_ENCODING_STRING)
+
+    if encoding == BITSHUFFLE_ENCODING_STRING:
+        # Already a bitshuffle chunk, as produced by the compression node.
+        if compress:
+            return frame_data
+
+        n_bytes, block_bytes = BITSHUFFLE_CHUNK_HEADER.unpack_from(frame_data, 0)
+        compressed_data = np.frombuffer(frame_data, dtype=np.uint8, offset=BITSHUFFLE_CHUNK_HEADER.size)
+        return bitshuffle.decompress_lz4(compressed_data, tuple(frame_shape), np.dtype(dtype),
+                                         block_bytes // np.dtype(dtype).itemsize)
+
+    if encoding != UNCOMPRESSED_ENCODING_STRING:
+        raise ValueError("Frame encoding '%s' is not supported." % encoding)
+
+    if compress:
+        array = np.frombuffer(frame_data, dtype=dtype).reshape(frame_shape)
+        return compress_bitshuffle_chunk(array, DEFAULT_BLOCK_SIZE)
+
+    return frame_data
+
+
+def convert_frame_range(output_filename, dataset_name, first_frame_index, frames, frame_shape, dtype, input_format,
+                        compress=True, h5_group_attributes=None):
+    """
+    Write a range of frames to a data file, with the same layout as the chunked writer. Runs in a worker process.
+    :param output_filename: Data file to write.
+    :param dataset_name: Name of the frames dataset.
+    :param first_frame_index: Frame index of the first row in the dataset.
+    :param frames: List of (frame_index, input_filename, offset).
+    :param frame_shape: Shape of the frames.
+    :param dtype: Data type of the frames.
+    :param input_format: "dump" or "raw".
+    :param compress: Write bitshuffle/LZ4 compressed chunks.
+    :param h5_group_attributes: Group attributes to set in the data file.
+    :return: (output_filename, number of rows in the dataset).
+    """
+    frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+    n_rows = max(frame_index for frame_index, _, _ in frames) - first_frame_index + 1
+
+    input_files = {}
+    input_buffers = {}
+
+    create_folder_if_does_not_exist(output_filename)
+
+    try:
+        with h5py.File(output_filename, "w") as file:
+            compression_opts = (DEFAULT_BLOCK_SIZE, H5_COMPRESS_LZ4) if compress else None
+            dataset = create_dataset(file, dataset_name, frame_shape, dtype,
+                                     compression=BITSHUFFLE_FILTER if compress else None,
+                                     compression_opts=compression_opts,
+                                     initial_frame_count=n_rows)
+
+            frame_offset = (0,) * len(frame_shape)
+
+            for frame_index, input_filename, offset in frames:
+                input_buffer = input_buffers.get(input_filename)
+                if input_buffer is None:
+                    input_files[input_filename] = open(input_filename, "rb")
+                    input_buffer = mmap.mmap(input_files[input_filename].fileno(), 0, access=mmap.ACCESS_READ)
+                    input_buffers[input_filename] = input_buffer
+
+                chunk = get_frame_bytes(input_buffer, input_format, offset, frame_bytes, compress, frame_shape, dtype)
+                try:
+                    dataset.id.write_direct_chunk((frame_index - first_frame_index,) + frame_offset, chunk)
+                finally:
+                    # Views of the input file have to be released before it is closed.
+                    del chunk
+
+            # Do not display the index number, but the the frame number (starts with 1)
+            dataset.attrs["image_nr_low"] = first_frame_index + 1
+            dataset.attrs["image_nr_high"] = first_frame_index + n_rows
+
+            populate_h5_file(file, h5_group_attributes)
+    except BaseException as error:
+        # The traceback of a failed frame still holds views of the input files. Release them, to raise the actual error.
+        traceback.clear_frames(error.__traceback__)
+        raise
+    finally:
+        for input_buffer in input_buffers.values():
+            input_buffer.close()
+        for input_file in input_files.values():
+            input_file.close()
+
+    return output_filename, n_rows
+
+
+def convert_frames(input_files, output_file, input_format="dump", output_format="plain", frame_shape=None, dtype=None,
+                   dataset_name=DATA_DATASET_NAME, frames_per_file=DEFAULT_FRAMES_PER_FILE, n_workers=None,
+                   compress=True):
+    """
+    Convert frame dumps to HDF5 data files (one per frames_per_file frames, written in parallel) and a master file
+    with a virtual dataset spanning all of them.
+    :param input_files: List of input files.
+    :param output_file: Master file to write. Data files are named <experiment_id>_data_NNNNNN.h5 next to it.
+    :param input_format: "dump" (frame dump or capture files) or "raw" (consecutive frames).
+    :param output_format: "plain", "nxmx" or "nxsas".
+    :param frame_shape: Shape of the frames. Needed for raw files.
+    :param dtype: Data type of the frames. Needed for raw files.
+    :param dataset_name: Name of the frames dataset in the data and in the master file.
+    :param frames_per_file: Number of frames in each data file.
+    :param n_workers: Number of worker processes. Number of CPUs if None.
+    :param compress: Write bitshuffle/LZ4 compressed chunks.
+    :return: Number of converted frames.
+    """
+    if input_format not in INPUT_FORMATS:
+        raise ValueError("Input format must be one of %s." % (INPUT_FORMATS,))
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Output format must be one of %s." % (OUTPUT_FORMATS,))
+
+    if not frames_per_file or frames_per_file < 1:
+        raise ValueError("Frames per file must be a positive number.")
+
+    conversion_start = perf_counter()
+
+    frame_shape, dtype, frames = index_input_files(input_files, input_format, frame_shape, dtype)
+    if not frames:
+        _logger.warning("No frames found in %s.", input_files)
+        return 0
+
+    data_filename_format = get_data_filename_format(output_file)
+    h5_group_attributes, h5_datasets, h5_dataset_attributes = get_output_attributes(output_format)
+    data_group_attributes = NXMX_GROUP_ATTRIBUTES if output_format == "nxmx" else None
+
+    # Same file numbering as the chunked writer: file N holds the frames [(N-1) * frames_per_file, N * frames_per_file).
+    frame_ranges = {}
+    for frame_index in sorted(frames):
+        input_filename, offset = frames[frame_index]
+        frame_chunk = frame_index // frames_per_file + 1
+        frame_ranges.setdefault(frame_chunk, []).append((frame_index, input_filename, offset))
+
+    jobs_arguments = [(data_filename_format.format(chunk_number=frame_chunk), dataset_name,
+                       (frame_chunk - 1) * frames_per_file, range_frames, frame_shape, dtype, input_format, compress,
+                       data_group_attributes)
+                      for frame_chunk, range_frames in frame_ranges.items()]
+
+    _logger.info("Converting %d frames into %d files.", len(frames), len(jobs_arguments))
+
+    if n_workers == 1:
+        results = [convert_frame_range(*arguments) for arguments in jobs_arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(convert_frame_range, *zip(*jobs_arguments)))
+
+    sources = []
+    frame_count = 0
+    for arguments, (data_filename, n_rows) in zip(jobs_arguments, results):
+        first_frame_index = arguments[2]
+        sources.append((np.s_[first_frame_index:first_frame_index + n_rows], data_filename, dataset_name, n_rows,
+                        np.s_[0:n_rows]))
+        frame_count = max(frame_count, first_frame_index + n_rows)
+
+    with h5py.File(output_file, "w") as file:
+        create_virtual_dataset(file, dataset_name, frame_count, frame_shape, dtype, sources)
+        populate_h5_file(file, h5_group_attributes, h5_datasets, h5_dataset_attributes)
+
+    _logger.info("Converted %d frames in %.3f seconds.", len(frames), perf_counter() - conversion_start)
+
+    return len(frames)
@@ -0,0 +1,237 @@
+import json
+import mmap
+import os
+import struct
+from collections import deque
+from threading import Lock
+
+from mflow_processor.utils.frame_message import FrameMessage
+
+# Frame record header: magic, header length, data length, frame index, receive time.
+FRAME_RECORD_HEADER = struct.Struct("<4sIQqd")
+FRAME_RECORD_MAGIC = b"MFDR"
+# Default size of the preallocated frame dump file (1 GB).
+DEFAULT_FRAME_DUMP_SIZE = 1 << 30
+
+
+def encode_frame_data(frame_data):
+    """
+    Get the bytes of the frame data, without copying it.
+    :param frame_data: bytes, memoryview or numpy array.
+    :return: Byte memoryview.
+    """
+    return memoryview(frame_data).cast("B")
+
+
+class FrameDump(object):
+    """
+    Preallocated, memory mapped file of frame records, to store frames faster than they can be written to HDF5.
+
+    Each record is self-describing: FRAME_RECORD_HEADER, the JSON message header and the raw frame data. The records
+    are followed by an empty record header, so the file can be read (read_frame_dump) without an index, for example
+    after a crash. The offsets of the records not yet read are kept in memory. Once all the records are read, the
+    file is written from the start again.
+    """
+
+    def __init__(self, filename, file_size=DEFAULT_FRAME_DUMP_SIZE):
+        """
+        Create the frame dump file. An existing file is overwritten.
+        :param filename: Name of the frame dump file.
+        :param file_size: Size of the file in bytes. The file is sparse, so disk space is used only when written.
+        """
+        self.filename = filename
+
+        with open(filename, "wb") as dump_file:
+            dump_file.truncate(file_size)
+
+        self._file = open(filename, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), file_size)
+        self._file_size = file_size
+
+        self._lock = Lock()
+        self._pending_offsets = deque()
+        self._write_offset = 0
+
+    @property
+    def n_pending(self):
+        """
+        Number of records not read yet.
+        """
+        return len(self._pending_offsets)
+
+    def append(self, header, frame_data, frame_index, receive_time=0.0):
+        """
+        Append a frame record to the file.
+        :param header: Message header (JSON serializable).
+        :param frame_data: Frame data.
+        :param frame_index: Index of the frame.
+        :param receive_time: perf_counter value when the frame was received.
+        :return: False if there is not enough space in the file.
+        """
+        header_bytes = json.dumps(header).encode()
+        data_bytes = encode_frame_data(frame_data)
+
+        record_size = FRAME_RECORD_HEADER.size + len(header_bytes) + data_bytes.nbytes
+
+        with self._lock:
+            record_offset = self._write_offset
+            # Space for the end of records marker is needed as well.
+            if record_offset + record_size + FRAME_RECORD_HEADER.size > self._file_size:
+                return False
+
+            data_offset = record_offset + FRAME_RECORD_HEADER.size + len(header_bytes)
+            self._mmap[record_offset + FRAME_RECORD_HEADER.size:data_offset] = header_bytes
+            self._mmap[data_offset:data_offset + data_bytes.nbytes] = data_bytes
+            self._mmap[record_offset + record_size:record_offset + record_size + FRAME_RECORD_HEADER.size] = \
+                bytes(FRAME_RECORD_HEADER.size)
+
+            # The record header is written last, so readers never see incomplete records.
+            FRAME_RECORD_HEADER.pack_into(self._mmap, record_offset, FRAME_RECORD_MAGIC, len(header_bytes),
+                                          data_bytes.nbytes, frame_index, receive_time)
+
+            self._write_offset += record_size
+            self._pending_offsets.append(record_offset)
+
+        return True
+
+    def pop(self):
+        """
+        Read the oldest record not read yet. The frame data is copied out of the file.
+        :return: (FrameMessage, receive_time), or None if there are no records to read.
+        """
+        with self._lock:
+            if not self._pending_offsets:
+                return None
+
+            record_offset = self._pending_offsets.popleft()
+            header, frame_data, frame_index, receive_time = read_frame_record(self._mmap, record_offset)[:4]
+            frame_data = bytes(frame_data)
+
+            # All the records were read, the file can be reused from the start.
+            if not self._pending_offsets:
+                self._write_offset = 0
+                self._mmap[0:FRAME_RECORD_HEADER.size] = bytes(FRAME_RECORD_HEADER.size)
+
+        return FrameMessage(header, frame_data, frame_index=frame_index), receive_time
+
+    @property
+    def n_bytes(self):
+        """
+        Number of bytes used by the records, including the end of records marker.
+        """
+        return self._write_offset + FRAME_RECORD_HEADER.size
+
+    def close(self, remove=True, truncate=False):
+        """
+        Close the frame dump file.
+        :param remove: Remove the file. Records not read yet are lost.
+        :param truncate: Truncate the file to the written records, when it is kept.
+        """
+        self._mmap.close()
+
+        if truncate and not remove:
+            self._file.truncate(self.n_bytes)
+
+        self._file.close()
+
+        if remove:
+            os.remove(self.filename)
+
+
+def read_frame_record(buffer, record_offset):
+    """
+    Read the frame record at the provided offset.
+    :param buffer: Buffer with the frame records (mmap, bytes).
+    :param record_offset: Offset of the record in the buffer.
+    :return: (header, frame_data memoryview, frame_index, receive_time, next_record_offset), or None if there is no
+    record at the offset.
+    """
+    if record_offset + FRAME_RECORD_HEADER.size > len(buffer):
+        return None
+
+    magic, header_length, data_length, frame_index, receive_time = \
+        FRAME_RECORD_HEADER.unpack_from(buffer, record_offset)
+
+    if magic != FRAME_RECORD_MAGIC:
+        return None
+
+    header_offset = record_offset + FRAME_RECORD_HEADER.size
+    data_offset = header_offset + header_length
+    next_record_offset = data_offset + data_length
+
+    header = json.loads(bytes(buffer[header_offset:data_offset]).decode())
+    frame_data = memoryview(buffer)[data_offset:next_record_offset]
+
+    return header, frame_data, frame_index, receive_time, next_record_offset
+
+
+def read_frame_dump(filename):
+    """
+    Read all the frame records in a frame dump file.
+    :param filename: Name of the frame dump file.
+    :return: Generator of (header, frame_data memoryview, frame_index). The data is valid only until the next record.
+    """
+    with open(filename, "rb") as dump_file:
+        # Empty files cannot be memory mapped.
+        if os.fstat(dump_file.fileno()).st_size == 0:
+            return
+
+        dump_mmap = mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            record_offset = 0
+            while True:
+                frame_record = read_frame_record(dump_mmap, record_offset)
+                if frame_record is None:
+                    break
+
+                header, frame_data, frame_index, _, record_offset = frame_record
+                yield header, frame_data, frame_index
+                frame_data.release()
+        finally:
+            dump_mmap.close()
+
+
+def read_frame_dump_index(filename, get_record_header=None):
+    """
+    Find the frame records in a frame dump file, without keeping the frame data.
+    :param filename: Name of the frame dump file.
+    :param get_record_header: Function called with (header, frame_data) of each record, returning the header to index
+    the record with, or None to skip the record. All the records are indexed with their header if None.
+    :return: (first indexed header or None, list of (frame_index, record_offset)).
+    """
+    first_header = None
+    frame_records = []
+
+    with open(filename, "rb") as dump_file:
+        if os.fstat(dump_file.fileno()).st_size == 0:
+            return first_header, frame_records
+
+        dump_mmap = mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            record_offset = 0
+            while True:
+                frame_record = read_frame_record(dump_mmap, record_offset)
+                if frame_record is None:
+                    break
+
+                header, frame_data, frame_index, _, next_record_offset = frame_record
+
+                try:
+                    if get_record_header is not None:
+                        header = get_record_header(header, frame_data)
+                finally:
+                    frame_data.release()
+
+                if header is not None:
+                    if first_header is None:
+                        first_header = header
+
+                    frame_records.append((frame_index, record_offset))
+
+                record_offset = next_record_offset
+        finally:
+            dump_mmap.close()
+
+    return first_header, frame_records
@@ -0,0 +1,36 @@
+class FrameMessage(object):
+    """
+    Minimal stand-in for an mflow message, built from an already received header and frame data.
+
+    Used where frames are passed on without the original mflow message (other processes, spill files etc.).
+    """
+
+    def __init__(self, header, data, frame_index=None):
+        """
+        Initialize the frame message.
+        :param header: Message header. Needs the 'frame', 'shape' and 'type' fields.
+        :param data: Frame data (bytes or numpy array).
+        :param frame_index: Frame index to report instead of the one in the header.
+        """
+        self._header = header
+        self._data = data
+        self._frame_index = header["frame"] if frame_index is None else frame_index
+
+    @property
+    def htype(self):
+        return self._header.get("htype", "")
+
+    def get_header(self):
+        return self._header
+
+    def get_data(self):
+        return self._data
+
+    def get_frame_index(self):
+        return self._frame_index
+
+    def get_frame_size(self):
+        return list(self._header["shape"])
+
+    def get_frame_dtype(self):
+        return self._header["type"]
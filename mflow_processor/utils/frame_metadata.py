@@ -0,0 +1,189 @@
+from logging import getLogger
+
+import h5py
+import numpy as np
+
+# Initial number of frames in each metadata column.
+METADATA_INITIAL_FRAME_COUNT = 1000
+# Factor to grow the metadata columns by when a frame does not fit.
+METADATA_GROWTH_FACTOR = 2
+
+_logger = getLogger(__name__)
+
+
+class FrameMetadataStore(object):
+    """
+    Per frame metadata (header values, frame indexes...) stored in typed, preallocated numpy columns.
+
+    Each dataset is a column indexed by frame index. The column type and shape are inferred from the first value;
+    later values are converted to it. Rows of frames without a value are zero (or empty string).
+
+    The columns can be written all at once (write_datasets) or streamed to extendable datasets (flush), in which case
+    the flushed rows are removed from memory and values of already flushed frames are written directly to the file.
+    """
+
+    def __init__(self, initial_frame_count=METADATA_INITIAL_FRAME_COUNT):
+        """
+        Initialize the metadata store.
+        :param initial_frame_count: Initial number of frames in each column.
+        """
+        self._initial_frame_count = initial_frame_count
+        self.reset()
+
+    def reset(self, first_frame_index=0):
+        """
+        Remove all the stored metadata.
+        :param first_frame_index: Frame index stored in the first row of the columns.
+        """
+        # Dataset name -> column array.
+        self._columns = {}
+        self._first_frame_index = first_frame_index
+        self._n_frames = 0
+
+        # Streaming to extendable datasets.
+        self._file = None
+        self._file_datasets = {}
+        self._flushed_rows = 0
+
+    @property
+    def n_frames(self):
+        """
+        Number of rows with data: last stored frame index - first frame index + 1.
+        """
+        return self._n_frames
+
+    def _create_column(self, dataset_name, value, n_rows):
+        value = np.asarray(value)
+
+        if value.dtype.kind in "OUS":
+            column = np.full([n_rows] + list(value.shape), "", dtype=object)
+        else:
+            column = np.zeros([n_rows] + list(value.shape), dtype=value.dtype)
+
+        self._columns[dataset_name] = column
+        return column
+
+    def _grow_column(self, dataset_name, row):
+        column = self._columns[dataset_name]
+        new_size = max(len(column) * METADATA_GROWTH_FACTOR, row + 1)
+
+        new_column = np.zeros((new_size,) + column.shape[1:], dtype=column.dtype)
+        if column.dtype == object:
+            new_column.fill("")
+        new_column[:len(column)] = column
+
+        self._columns[dataset_name] = new_column
+        return new_column
+
+    def set_value(self, dataset_name, frame_index, value):
+        """
+        Store the value of a frame.
+        :param dataset_name: Dataset the value belongs to.
+        :param frame_index: Index of the frame.
+        :param value: Value to store.
+        """
+        row = frame_index - self._first_frame_index
+
+        if row < 0:
+            self._write_flushed_value(dataset_name, row, value)
+            return
+
+        column = self._columns.get(dataset_name)
+        if column is None:
+            column = self._create_column(dataset_name, value, max(self._initial_frame_count, row + 1))
+        elif row >= len(column):
+            column = self._grow_column(dataset_name, row)
+
+        column[row] = value
+
+        if row >= self._n_frames:
+            self._n_frames = row + 1
+
+    def get_datasets(self):
+        """
+        Get the stored metadata.
+        :return: Dictionary of dataset name -> array with n_frames rows.
+        """
+        datasets = {}
+
+        for dataset_name, column in list(self._columns.items()):
+            # Columns of values missing in the last frames can be shorter.
+            if len(column) < self._n_frames:
+                column = self._grow_column(dataset_name, self._n_frames - 1)
+
+            datasets[dataset_name] = column[:self._n_frames]
+
+        return datasets
+
+    def _get_file_dataset(self, dataset_name, column):
+        dataset = self._file_datasets.get(dataset_name)
+
+        if dataset is None:
+            dtype = h5py.string_dtype() if column.dtype == object else column.dtype
+            dataset = self._file.create_dataset(dataset_name,
+                                                shape=(0,) + column.shape[1:],
+                                                maxshape=(None,) + column.shape[1:],
+                                                chunks=True,
+                                                dtype=dtype)
+            self._file_datasets[dataset_name] = dataset
+
+        return dataset
+
+    def _write_flushed_value(self, dataset_name, row, value):
+        file_row = self._flushed_rows + row
+
+        if self._file is None or file_row < 0:
+            _logger.warning("Frame %d is before the first frame %d of the metadata. Discarding '%s' value.",
+                            self._first_frame_index + row, self._first_frame_index - self._flushed_rows, dataset_name)
+            return
+
+        # Columns of values appearing after the flush only exist in memory.
+        column = self._columns.get(dataset_name)
+        if column is None:
+            column = self._create_column(dataset_name, value, self._initial_frame_count)
+
+        dataset = self._get_file_dataset(dataset_name, column)
+        if dataset.shape[0] <= file_row:
+            dataset.resize(self._flushed_rows, axis=0)
+
+        dataset[file_row] = value
+
+    def flush(self, file):
+        """
+        Append the stored rows to extendable datasets on the provided file and remove them from memory.
+        :param file: File to write the datasets to. The datasets are appended to as long as the file is the same.
+        """
+        if file is not self._file:
+            self._file = file
+            self._file_datasets = {}
+            self._flushed_rows = 0
+
+        if not self._n_frames:
+            return
+
+        for dataset_name, data in self.get_datasets().items():
+            try:
+                dataset = self._get_file_dataset(dataset_name, data)
+                dataset.resize(self._flushed_rows + self._n_frames, axis=0)
+                dataset[self._flushed_rows:] = data
+            except:
+                _logger.exception("Could not write metadata dataset '%s'.", dataset_name)
+
+            # Reuse the column for the next rows.
+            data.fill("" if data.dtype == object else 0)
+
+        self._first_frame_index += self._n_frames
+        self._flushed_rows += self._n_frames
+        self._n_frames = 0
+
+    def write_datasets(self, file):
+        """
+        Create the metadata datasets on the provided file.
+        :param file: File to write the datasets to.
+        """
+        for dataset_name, data in self.get_datasets().items():
+            try:
+                dtype = h5py.string_dtype() if data.dtype == object else None
+                file.create_dataset(dataset_name, data=data, dtype=dtype)
+            except:
+                _logger.exception("Could not create metadata dataset '%s'.", dataset_name)
@@ -0,0 +1,75 @@
+import numpy as np
+
+# Initial number of frames tracked, grown geometrically.
+TRACKER_INITIAL_FRAME_COUNT = 8192
+
+
+class ReceivedFramesTracker(object):
+    """
+    Bitmap of the received frames (one bit per frame, bit packed in a numpy array), to find the missing and the
+    duplicate frames.
+    """
+
+    def __init__(self, initial_frame_count=TRACKER_INITIAL_FRAME_COUNT):
+        """
+        Initialize the tracker.
+        :param initial_frame_count: Initial number of frames in the bitmap.
+        """
+        self._initial_frame_count = initial_frame_count
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all the received frames.
+        """
+        self._bits = np.zeros((self._initial_frame_count + 7) // 8, dtype=np.uint8)
+        self.n_received = 0
+        self.n_frames = 0
+
+    def add_frame(self, frame_index):
+        """
+        Mark the frame as received.
+        :param frame_index: Index of the received frame.
+        :return: True if the frame was already received.
+        """
+        byte_index = frame_index >> 3
+        bit_mask = 1 << (frame_index & 7)
+
+        if byte_index >= len(self._bits):
+            new_bits = np.zeros(max(len(self._bits) * 2, byte_index + 1), dtype=np.uint8)
+            new_bits[:len(self._bits)] = self._bits
+            self._bits = new_bits
+
+        if self._bits[byte_index] & bit_mask:
+            return True
+
+        self._bits[byte_index] |= bit_mask
+        self.n_received += 1
+
+        if frame_index >= self.n_frames:
+            self.n_frames = frame_index + 1
+
+        return False
+
+    @property
+    def n_missing(self):
+        """
+        Number of frames not received, up to the highest received frame.
+        """
+        return self.n_frames - self.n_received
+
+    def get_received_mask(self):
+        """
+        :return: Boolean array with n_frames elements, True for the received frames.
+        """
+        return np.unpackbits(self._bits, count=self.n_frames, bitorder="little").astype(bool)
+
+    def get_missing_ranges(self):
+        """
+        :return: Array of [start, stop) frame index ranges of the missing frames, shape (n_ranges, 2).
+        """
+        # Edges between received and missing frames, with received frames added at both ends.
+        received_mask = np.concatenate(([True], self.get_received_mask(), [True]))
+        edges = np.flatnonzero(received_mask[1:] != received_mask[:-1])
+
+        return edges.reshape(-1, 2)
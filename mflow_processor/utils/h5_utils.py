@@ -1,11 +1,21 @@
 from logging import getLogger
 import os
+
+import h5py
 import numpy as np
 
 # Initial size of the dataset (number of frames).
 DATASET_INITIAL_FRAME_COUNT = 1000
 # Step for resizing the dataset.
 DATASET_FRAMES_INCREASE_STEP = 1000
+# Default block size (bytes) for the direct driver and the file space pages.
+DEFAULT_FILE_BLOCK_SIZE = 4096
+# Drivers that can be selected for the output files.
+FILE_DRIVERS = ("sec2", "stdio", "core", "direct")
+# Factor to grow the dataset by when a frame does not fit.
+DATASET_GROWTH_FACTOR = 2
+# Max number of frames added to the dataset in a single resize.
+DATASET_MAX_FRAMES_INCREASE = 100000
 
 _logger = getLogger(__name__)
 
@@ -21,6 +31,54 @@ def create_folder_if_does_not_exist(filename):
         _logger.info("Folder '%s' already exists.", filename_folder)
 
 
+def get_file_access_options(driver=None, alignment=None, alignment_threshold=None, meta_block_size=None,
+                            page_buffer_size=None):
+    """
+    Get the h5py.File arguments for the file driver, alignment and buffering options.
+    :param driver: HDF5 driver. "core" keeps the file in memory and writes it on close, "direct" bypasses the page
+    cache (if HDF5 was built with it). None for the default driver.
+    :param alignment: Align the file objects (chunks) to this many bytes, usually the filesystem block size.
+    :param alignment_threshold: Align only objects of at least this many bytes. Default is the alignment.
+    :param meta_block_size: Allocate the file metadata in blocks of this many bytes.
+    :param page_buffer_size: Size of the page buffer in bytes. Enables the paged file space strategy.
+    :return: Dictionary of keyword arguments for h5py.File.
+    :raises ValueError: If the driver is unknown, or the page buffer is smaller than a page.
+    """
+    if driver and driver not in FILE_DRIVERS:
+        raise ValueError("Unknown HDF5 driver '%s', must be one of %s." % (driver, FILE_DRIVERS))
+
+    # The file space pages have the alignment size.
+    page_size = alignment or DEFAULT_FILE_BLOCK_SIZE
+    if page_buffer_size and page_buffer_size < page_size:
+        raise ValueError("Page buffer size %d is smaller than the page size %d." % (page_buffer_size, page_size))
+
+    file_options = {}
+
+    if driver:
+        file_options["driver"] = driver
+
+        if driver == "core":
+            file_options["backing_store"] = True
+        elif driver == "direct":
+            file_options["alignment"] = alignment or DEFAULT_FILE_BLOCK_SIZE
+            file_options["block_size"] = alignment or DEFAULT_FILE_BLOCK_SIZE
+
+    if alignment:
+        file_options["alignment_interval"] = alignment
+        file_options["alignment_threshold"] = alignment_threshold or alignment
+
+    if meta_block_size:
+        file_options["meta_block_size"] = meta_block_size
+
+    if page_buffer_size:
+        # HDF5 enables the page buffer only with the paged file space strategy.
+        file_options["fs_strategy"] = "page"
+        file_options["fs_page_size"] = page_size
+        file_options["page_buf_size"] = page_buffer_size
+
+    return file_options
+
+
 def populate_h5_file(file, h5_group_attributes=None, h5_datasets=None,
                      h5_dataset_attributes=None, dataset_dtypes=None):
     """
@@ -38,7 +96,7 @@ def populate_h5_file(file, h5_group_attributes=None, h5_datasets=None,
 
 
 def create_dataset(file, dataset_name, frame_size, dtype, compression=None, compression_opts=None,
-                   initial_frame_count=DATASET_INITIAL_FRAME_COUNT):
+                   initial_frame_count=DATASET_INITIAL_FRAME_COUNT, frames_per_chunk=1):
     """
     Create a dataset on the provided file.
     :param file: File to create the dataset on.
@@ -48,6 +106,7 @@ def create_dataset(file, dataset_name, frame_size, dtype, compression=None, comp
     :param compression: Compression to use on the dataset.
     :param compression_opts: Compression options.
     :param initial_frame_count: Initial frame count for the dataset. Default is 100.
+    :param frames_per_chunk: Number of frames in each H5 chunk. Default is 1.
     :return: Dataset handle.
     """
     # Generate the dataset groups if needed.
@@ -61,13 +120,48 @@ def create_dataset(file, dataset_name, frame_size, dtype, compression=None, comp
     dataset = file.create_dataset(name=dataset_name,
                                   shape=[initial_frame_count] + frame_size,
                                   maxshape=[None] + frame_size,
-                                  chunks=tuple([1] + frame_size),
+                                  chunks=tuple([frames_per_chunk] + frame_size),
                                   dtype=dtype,
                                   compression=compression,
                                   compression_opts=compression_opts)
     return dataset
 
 
+def create_virtual_dataset(file, dataset_name, frame_count, frame_size, dtype, sources):
+    """
+    Create a virtual dataset (VDS) on the provided file, mapping frames from datasets in other files.
+    :param file: File to create the virtual dataset on.
+    :param dataset_name: Name of the virtual dataset.
+    :param frame_count: Number of frames in the virtual dataset.
+    :param frame_size: Size of each frame in the dataset.
+    :param dtype: Datatype of the dataset.
+    :param sources: List of (target_frames, filename, source_dataset_name, source_frame_count, source_frames), where
+    target_frames and source_frames are slices of frames in the virtual and in the source dataset.
+    :return: Dataset handle.
+    """
+    if h5py.version.hdf5_version_tuple < (1, 10):
+        raise ValueError("Virtual datasets need HDF5 >= 1.10, but HDF5 %s is installed." % h5py.version.hdf5_version)
+
+    dataset_name = dataset_name.rstrip("/")
+    dataset_group = "/".join(dataset_name.split("/")[:-1])
+
+    if dataset_group:
+        file.require_group(dataset_group)
+
+    # Source files are referenced relative to the virtual dataset file, so the files can be moved together.
+    file_folder = os.path.dirname(os.path.abspath(file.filename))
+
+    layout = h5py.VirtualLayout(shape=tuple([frame_count] + frame_size), dtype=dtype)
+
+    for target_frames, filename, source_dataset_name, source_frame_count, source_frames in sources:
+        source_filename = os.path.relpath(os.path.abspath(filename), file_folder)
+        source = h5py.VirtualSource(source_filename, source_dataset_name,
+                                    shape=tuple([source_frame_count] + frame_size))
+        layout[target_frames] = source[source_frames]
+
+    return file.create_virtual_dataset(dataset_name, layout, fillvalue=0)
+
+
 def create_datasets_from_data(file, datasets, dataset_dtypes=None):
     """
     Create dataset from value.
@@ -130,15 +224,74 @@ def set_dataset_attributes(file, dataset_attributes):
             _logger.exception("Cannot set '%s' to '%s'.", name, value)
 
 
-def expand_dataset(dataset, received_frame_index, increase_step=DATASET_FRAMES_INCREASE_STEP):
+class DatasetGrowthPolicy(object):
+    """
+    Initial size of a frame dataset and how to grow it when a frame does not fit.
+
+    The dataset grows geometrically, so n frames need O(log n) resizes, but by at most max_increase frames at once.
+    A frame further than max_increase beyond the end of the dataset is a sparse jump: the dataset is resized exactly
+    to the frame, because HDF5 does not allocate the chunks in between. With the expected number of frames known,
+    the dataset is created with this size and then grows normally.
+    """
+
+    def __init__(self, initial_frame_count=DATASET_INITIAL_FRAME_COUNT, growth_factor=DATASET_GROWTH_FACTOR,
+                 max_increase=DATASET_MAX_FRAMES_INCREASE, expected_frame_count=None, max_frame_count=None):
+        """
+        Initialize the growth policy.
+        :param initial_frame_count: Initial size, if the expected frame count is not known.
+        :param growth_factor: Factor to grow the dataset by.
+        :param max_increase: Max number of frames added in a single resize.
+        :param expected_frame_count: Expected number of frames in the dataset. None if not known.
+        :param max_frame_count: Max size of the dataset (for example frames per file). None for no limit.
+        """
+        self.initial_frame_count = initial_frame_count
+        self.growth_factor = growth_factor
+        self.max_increase = max_increase
+        self.expected_frame_count = expected_frame_count
+        self.max_frame_count = max_frame_count
+
+    def _limit_size(self, dataset_size):
+        if self.max_frame_count:
+            return min(dataset_size, self.max_frame_count)
+
+        return dataset_size
+
+    def get_initial_size(self):
+        """
+        :return: Size to create the dataset with.
+        """
+        return self._limit_size(self.expected_frame_count or self.initial_frame_count)
+
+    def get_new_size(self, dataset_size, frame_index):
+        """
+        Get the size to resize the dataset to, so the frame fits in it.
+        :param dataset_size: Current size of the dataset.
+        :param frame_index: Index of the frame that does not fit.
+        :return: New dataset size.
+        """
+        required_size = frame_index + 1
+
+        if required_size - dataset_size > self.max_increase:
+            return required_size
+
+        new_dataset_size = min(int(dataset_size * self.growth_factor), dataset_size + self.max_increase)
+
+        return max(self._limit_size(new_dataset_size), required_size)
+
+
+def expand_dataset(dataset, received_frame_index, increase_step=DATASET_FRAMES_INCREASE_STEP, growth_policy=None):
     """
     Expand an existing dataset.
     :param dataset: Dataset to expand.
     :param received_frame_index: Last received frame index.
     :param increase_step: Optional. Default is 100.
+    :param growth_policy: DatasetGrowthPolicy to get the new size from. The increase_step is then not used.
     :return new_dataset_size: Size of the new dataset.
     """
-    new_dataset_size = received_frame_index + increase_step
+    if growth_policy:
+        new_dataset_size = growth_policy.get_new_size(dataset.shape[0], received_frame_index)
+    else:
+        new_dataset_size = received_frame_index + increase_step
 
     _logger.debug("Current dataset is to small (size=%d) for frame index '%d'. Resizing it to %d."
                   % (dataset.shape[0], received_frame_index, new_dataset_size))
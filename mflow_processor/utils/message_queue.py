@@ -0,0 +1,169 @@
+import pickle
+from collections import deque
+from threading import Condition
+
+from mflow_processor.utils.frame_dump import FrameDump, DEFAULT_FRAME_DUMP_SIZE
+
+QUEUE_OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+
+
+class BoundedMessageQueue(object):
+    """
+    Bounded FIFO queue between a producer (receiving) and a consumer (writing) thread.
+
+    The consumer is woken up by a condition variable as soon as messages are available, and takes them in batches.
+    What happens when the queue is full depends on the overflow policy, and is counted:
+        block           The producer waits for the consumer.
+        drop_oldest     The oldest message is dropped.
+        spill           The message is pickled to a memory mapped spill file (FrameDump) and read back, in order,
+                        once the queue has space. If the spill file is full, the message is dropped.
+
+    The policy applies only while a consumer is active. Without a consumer, the queue keeps the latest max_size
+    messages, so they are available once the consumer starts.
+    """
+
+    def __init__(self, max_size, overflow_policy="drop_oldest", spill_file=None,
+                 spill_file_size=DEFAULT_FRAME_DUMP_SIZE):
+        """
+        Initialize the queue.
+        :param max_size: Maximum number of messages in memory.
+        :param overflow_policy: One of QUEUE_OVERFLOW_POLICIES.
+        :param spill_file: File to spill the messages to, for the "spill" policy.
+        :param spill_file_size: Size of the spill file in bytes.
+        """
+        if overflow_policy not in QUEUE_OVERFLOW_POLICIES:
+            raise ValueError("Overflow policy must be one of %s." % (QUEUE_OVERFLOW_POLICIES,))
+
+        if overflow_policy == "spill" and not spill_file:
+            raise ValueError("The spill overflow policy needs a spill file.")
+
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+
+        self._messages = deque()
+        self._condition = Condition()
+        self._closed = False
+        self._consumer_active = False
+
+        self._spill = FrameDump(spill_file, spill_file_size) if overflow_policy == "spill" else None
+
+        self.n_dropped = 0
+        self.n_spilled = 0
+        self.n_blocked = 0
+
+    def __len__(self):
+        """
+        Number of messages in the queue, spilled ones included.
+        """
+        return len(self._messages) + (self._spill.n_pending if self._spill is not None else 0)
+
+    @property
+    def consumer_active(self):
+        return self._consumer_active
+
+    def set_consumer_active(self, consumer_active):
+        """
+        Set if a consumer is taking the messages, so the overflow policy applies.
+        """
+        with self._condition:
+            self._consumer_active = consumer_active
+            # Blocked producers do not have to wait anymore without a consumer.
+            self._condition.notify_all()
+
+    def put(self, message):
+        """
+        Add a message to the queue, applying the overflow policy if the queue is full.
+        :param message: Message to add.
+        :return: False if the message (or the oldest message) was dropped.
+        """
+        dropped = False
+
+        with self._condition:
+            if self._spill is not None and self._spill.n_pending:
+                # Messages are spilled until the spill file is read, to keep them in order.
+                return self._spill_message(message)
+
+            if len(self._messages) >= self.max_size:
+                if self._consumer_active and self.overflow_policy == "spill":
+                    return self._spill_message(message)
+
+                if self._consumer_active and self.overflow_policy == "block":
+                    self.n_blocked += 1
+                    self._condition.wait_for(lambda: len(self._messages) < self.max_size or self._closed or
+                                             not self._consumer_active)
+
+                # Without a consumer the oldest messages are discarded, only drops while writing are counted.
+                if len(self._messages) >= self.max_size:
+                    self._messages.popleft()
+
+                    if self._consumer_active:
+                        self.n_dropped += 1
+                        dropped = True
+
+            self._messages.append(message)
+            self._condition.notify_all()
+
+        return not dropped
+
+    def _spill_message(self, message):
+        if not self._spill.append({}, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL), self.n_spilled):
+            self.n_dropped += 1
+            return False
+
+        self.n_spilled += 1
+        self._condition.notify_all()
+
+        return True
+
+    def get_batch(self, max_messages, timeout=None):
+        """
+        Take the oldest messages from the queue. Waits for messages if the queue is empty.
+        :param max_messages: Maximum number of messages to take.
+        :param timeout: Seconds to wait for messages. None to wait until a message arrives or the queue is closed.
+        :return: List of messages, empty if the timeout expired or the queue was closed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self) or self._closed, timeout)
+
+            n_messages = min(max_messages, len(self._messages))
+            batch = [self._messages.popleft() for _ in range(n_messages)]
+
+            # Spilled messages are newer than all the messages in memory.
+            while self._spill is not None and len(batch) < max_messages and not self._messages and \
+                    self._spill.n_pending:
+                spilled_message, _ = self._spill.pop()
+                batch.append(pickle.loads(spilled_message.get_data()))
+
+            if batch:
+                self._condition.notify_all()
+
+        return batch
+
+    def clear(self):
+        """
+        Remove all the messages from the queue.
+        """
+        with self._condition:
+            self._messages.clear()
+
+            while self._spill is not None and self._spill.n_pending:
+                self._spill.pop()
+
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Wake up all the waiting threads. Queued messages can still be taken.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def close_spill(self):
+        """
+        Remove the spill file. Spilled messages not taken yet are lost.
+        """
+        with self._condition:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
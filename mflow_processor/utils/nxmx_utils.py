@@ -4,11 +4,14 @@ from logging import getLogger
 import h5py
 import numpy as np
 
+from mflow_processor.utils.h5_utils import create_virtual_dataset
+
 _logger = getLogger(__name__)
 
 MASTER_FILENAME_SUFFIX = "_master.h5"
 DATA_FILENAME_TEMPLATE = "{experiment_id}_data_{{chunk_number:06d}}.h5"
 NUMBER_OF_FRAMES_FROM_HEADER = "/entry/instrument/detector/detectorSpecific/nimages"
+DATA_DATASET_NAME = "entry/data/data"
 
 
 def create_external_data_files_links(file, external_files):
@@ -21,7 +24,54 @@ def create_external_data_files_links(file, external_files):
         filename = os.path.basename(file_path)
         link_name = "/entry/data/" + filename[filename.index("_data_") + 1:filename.rindex(".h5")]
 
-        file[link_name] = h5py.ExternalLink(filename, "entry/data/data")
+        file[link_name] = h5py.ExternalLink(filename, DATA_DATASET_NAME)
+
+
+def create_virtual_data_files_dataset(file, external_files):
+    """
+    Create a virtual dataset spanning the datasets in all external files.
+    The position of each file in the virtual dataset is given by its image_nr_low and image_nr_high attributes.
+    :param file: File handle to create the virtual dataset on.
+    :param external_files: List of external files.
+    :return: Number of frames in the virtual dataset.
+    """
+    sources = []
+    frame_count = 0
+    frame_size = None
+    dtype = None
+
+    for file_path in external_files:
+        with h5py.File(file_path, "r") as data_file:
+            dataset = data_file[DATA_DATASET_NAME]
+            # Attributes hold the frame number (starting with 1), not the frame index.
+            image_nr_low = int(dataset.attrs["image_nr_low"])
+            image_nr_high = int(dataset.attrs["image_nr_high"])
+            file_frame_count = dataset.shape[0]
+            frame_size = list(dataset.shape[1:])
+            dtype = dataset.dtype
+
+        n_frames = min(file_frame_count, image_nr_high - image_nr_low + 1)
+        sources.append((np.s_[image_nr_low - 1:image_nr_low - 1 + n_frames], file_path, DATA_DATASET_NAME,
+                        file_frame_count, np.s_[0:n_frames]))
+        frame_count = max(frame_count, image_nr_low - 1 + n_frames)
+
+    if sources:
+        create_virtual_dataset(file, "/" + DATA_DATASET_NAME, frame_count, frame_size, dtype, sources)
+
+    return frame_count
+
+
+def get_expected_frame_count(header_data):
+    """
+    Get the number of frames the detector is going to send.
+    :param header_data: Data from the header.
+    :return: Expected number of frames, or None if not in the header.
+    """
+    nimages = header_data.get("nimages")
+    if not nimages:
+        return None
+
+    return nimages * (header_data.get("ntrigger") or 1)
 
 
 def convert_header_to_dataset_values(header_data, image_count):
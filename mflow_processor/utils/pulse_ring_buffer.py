@@ -0,0 +1,155 @@
+from logging import getLogger
+from threading import Lock
+
+_logger = getLogger(__name__)
+
+# Initial number of slots, grown by doubling up to the max number of slots.
+RING_INITIAL_SLOTS = 1024
+RING_MAX_SLOTS = 1 << 20
+# Default memory budget of the buffered messages (256 MB).
+DEFAULT_RING_MEMORY_SIZE = 1 << 28
+
+
+class PulseIdRingBuffer(object):
+    """
+    Ring buffer of the latest messages, indexed by pulse_id, for retroactive writing.
+
+    The message of a pulse_id is in the slot pulse_id % n_slots, so it is found in O(1), and the messages from a
+    pulse_id on are read without scanning the older ones. Pulses without a message leave their slot empty.
+    The oldest messages are evicted when the messages take more than memory_size bytes, or when the pulse_id span
+    does not fit in max_slots. A message older than the buffered ones is a pulse_id reset: the buffer is cleared.
+    """
+
+    def __init__(self, memory_size=DEFAULT_RING_MEMORY_SIZE, initial_slots=RING_INITIAL_SLOTS,
+                 max_slots=RING_MAX_SLOTS):
+        """
+        Initialize the ring buffer.
+        :param memory_size: Memory budget of the messages, in bytes.
+        :param initial_slots: Initial number of slots.
+        :param max_slots: Maximum number of slots, the maximum pulse_id span of the buffered messages.
+        """
+        self.memory_size = memory_size
+        self._initial_slots = initial_slots
+        self._max_slots = max_slots
+
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all the messages.
+        """
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        # Slot: (pulse_id, message, size) or None.
+        self._slots = [None] * self._initial_slots
+        self.first_pulse_id = None
+        self.last_pulse_id = None
+        self.n_messages = 0
+        self.n_bytes = 0
+
+    def __len__(self):
+        return self.n_messages
+
+    def _resize(self, n_slots):
+        slots = [None] * n_slots
+
+        for slot in self._slots:
+            if slot is not None:
+                slots[slot[0] % n_slots] = slot
+
+        self._slots = slots
+
+    def _evict_oldest(self):
+        slot_index = self.first_pulse_id % len(self._slots)
+        _, _, size = self._slots[slot_index]
+        self._slots[slot_index] = None
+        self.n_messages -= 1
+        self.n_bytes -= size
+
+        if not self.n_messages:
+            self.first_pulse_id = None
+            self.last_pulse_id = None
+            return
+
+        # Skip the pulses without a message. Each slot is skipped only once, so the eviction is amortized O(1).
+        pulse_id = self.first_pulse_id + 1
+        while self._slots[pulse_id % len(self._slots)] is None:
+            pulse_id += 1
+        self.first_pulse_id = pulse_id
+
+    def put(self, pulse_id, message, size):
+        """
+        Add the message of a pulse. The message of a pulse already in the buffer is replaced.
+        A message older than the buffered ones (pulse_id reset) clears the buffer first.
+        :param pulse_id: Pulse id of the message.
+        :param message: Message to store.
+        :param size: Size of the message in bytes, for the memory budget.
+        """
+        with self._lock:
+            if self.first_pulse_id is not None and pulse_id < self.first_pulse_id:
+                _logger.warning("Pulse_id %d is older than the buffered pulse_ids %d-%d. Clear the buffer.",
+                                pulse_id, self.first_pulse_id, self.last_pulse_id)
+                self._reset()
+
+            if self.first_pulse_id is None:
+                self.first_pulse_id = pulse_id
+                self.last_pulse_id = pulse_id
+
+            # Grow the ring to fit the pulse_id span, or evict the pulses out of the largest ring.
+            while pulse_id - self.first_pulse_id >= len(self._slots):
+                if len(self._slots) < self._max_slots:
+                    self._resize(len(self._slots) * 2)
+                else:
+                    self._evict_oldest()
+                    if self.first_pulse_id is None:
+                        self.first_pulse_id = pulse_id
+                        self.last_pulse_id = pulse_id
+
+            slot_index = pulse_id % len(self._slots)
+            if self._slots[slot_index] is not None:
+                self.n_messages -= 1
+                self.n_bytes -= self._slots[slot_index][2]
+
+            self._slots[slot_index] = (pulse_id, message, size)
+            self.n_messages += 1
+            self.n_bytes += size
+            self.last_pulse_id = max(self.last_pulse_id, pulse_id)
+
+            # Keep at least the newest message, even if it is larger than the budget.
+            while self.n_bytes > self.memory_size and self.n_messages > 1:
+                self._evict_oldest()
+
+    def get(self, pulse_id):
+        """
+        :return: Message of the pulse_id, None if not in the buffer.
+        """
+        with self._lock:
+            slot = self._slots[pulse_id % len(self._slots)]
+
+        if slot is None or slot[0] != pulse_id:
+            return None
+
+        return slot[1]
+
+    def get_messages_from(self, start_pulse_id):
+        """
+        Get the buffered messages from start_pulse_id on, in pulse_id order. The older messages are not read.
+        :param start_pulse_id: First pulse_id to get.
+        :return: List of messages.
+        """
+        with self._lock:
+            if self.first_pulse_id is None or start_pulse_id > self.last_pulse_id:
+                return []
+
+            n_slots = len(self._slots)
+            messages = []
+
+            for pulse_id in range(max(start_pulse_id, self.first_pulse_id), self.last_pulse_id + 1):
+                slot = self._slots[pulse_id % n_slots]
+                if slot is not None:
+                    messages.append(slot[1])
+
+        return messages
@@ -0,0 +1,102 @@
+from bisect import bisect_left
+from time import perf_counter
+
+# Upper bounds (in seconds) of the latency histogram buckets: 1us, 2us, 4us, ... ~16s. The last bucket is open.
+LATENCY_HISTOGRAM_BUCKETS = [1e-6 * 2 ** exponent for exponent in range(25)]
+
+
+class ProcessorStatistics(object):
+    """
+    Per stage timings, throughput and frame latency of a processor.
+
+    Stages are timed by chaining the returned timestamps, so each stage costs a single perf_counter call:
+
+        stage_start = perf_counter()
+        ...
+        stage_start = statistics.record_stage("first_stage", stage_start)
+        ...
+        statistics.record_stage("second_stage", stage_start)
+        statistics.record_frame(receive_time, n_bytes)
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all the collected statistics.
+        """
+        # Stage name -> [count, total time, max time].
+        self._stages = {}
+        self._latency_histogram = [0] * (len(LATENCY_HISTOGRAM_BUCKETS) + 1)
+        self._n_frames = 0
+        self._n_bytes = 0
+        self._first_frame_time = None
+        self._last_frame_time = None
+
+    def record_stage(self, stage_name, stage_start):
+        """
+        Record the duration of a stage.
+        :param stage_name: Name of the stage.
+        :param stage_start: perf_counter value at the start of the stage.
+        :return: perf_counter value at the end of the stage (start of the next stage).
+        """
+        stage_end = perf_counter()
+        self.add_stage_time(stage_name, stage_end - stage_start)
+
+        return stage_end
+
+    def add_stage_time(self, stage_name, stage_time):
+        """
+        Add a measured stage duration.
+        :param stage_name: Name of the stage.
+        :param stage_time: Duration of the stage in seconds.
+        """
+        stage = self._stages.get(stage_name)
+        if stage is None:
+            self._stages[stage_name] = [1, stage_time, stage_time]
+        else:
+            stage[0] += 1
+            stage[1] += stage_time
+            if stage_time > stage[2]:
+                stage[2] = stage_time
+
+    def record_frame(self, receive_time, n_bytes):
+        """
+        Record a completely processed frame.
+        :param receive_time: perf_counter value when the frame was received.
+        :param n_bytes: Size of the frame.
+        """
+        now = perf_counter()
+
+        if self._first_frame_time is None:
+            self._first_frame_time = receive_time
+        self._last_frame_time = now
+
+        self._n_frames += 1
+        self._n_bytes += n_bytes
+        self._latency_histogram[bisect_left(LATENCY_HISTOGRAM_BUCKETS, now - receive_time)] += 1
+
+    def get_statistics(self):
+        """
+        Get the collected statistics.
+        :return: Dictionary with the statistics.
+        """
+        elapsed_time = 0
+        if self._first_frame_time is not None:
+            elapsed_time = self._last_frame_time - self._first_frame_time
+
+        stages = {}
+        for stage_name, (count, total_time, max_time) in list(self._stages.items()):
+            stages[stage_name] = {"count": count,
+                                  "total_time": total_time,
+                                  "average_time": total_time / count,
+                                  "max_time": max_time}
+
+        return {"frames": self._n_frames,
+                "bytes": self._n_bytes,
+                "frames_per_second": self._n_frames / elapsed_time if elapsed_time else 0,
+                "bytes_per_second": self._n_bytes / elapsed_time if elapsed_time else 0,
+                "stages": stages,
+                "latency_histogram": {"bucket_upper_bounds": LATENCY_HISTOGRAM_BUCKETS,
+                                      "counts": list(self._latency_histogram)}}
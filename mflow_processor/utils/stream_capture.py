@@ -0,0 +1,387 @@
+import json
+import mmap
+import os
+from logging import getLogger
+from time import perf_counter, sleep, time
+
+import numpy as np
+import zmq
+
+from mflow_processor.utils.codec_selector import UNCOMPRESSED_ENCODING_STRING
+from mflow_processor.utils.frame_dump import FrameDump, DEFAULT_FRAME_DUMP_SIZE, FRAME_RECORD_HEADER, \
+    FRAME_RECORD_MAGIC, read_frame_record
+from mflow_processor.utils.frame_message import FrameMessage
+
+_logger = getLogger(__name__)
+
+# Header key with the sizes of the data parts, for messages that do not have exactly one data part.
+CAPTURE_PART_SIZES_KEY = "capture_part_sizes"
+CAPTURE_SOCKET_TYPES = {"pull": zmq.PULL, "sub": zmq.SUB}
+REPLAY_RATE_MODES = ("original", "fixed", "max")
+# Replay falling behind the target rate by more than this fraction is saturated.
+DEFAULT_SATURATION_TOLERANCE = 0.05
+
+
+def append_message(capture_file, header, data_parts, message_number, receive_time):
+    """
+    Append an mflow message to the capture file.
+    :param capture_file: FrameDump to append to.
+    :param header: Message header.
+    :param data_parts: List of data parts (bytes-like).
+    :param message_number: Number of the message in the capture, used when the header has no frame index.
+    :param receive_time: time() value when the message was received.
+    :return: False if there is not enough space in the file.
+    """
+    frame_index = header.get("frame")
+    if not isinstance(frame_index, int):
+        frame_index = message_number
+
+    # Array messages have one data part, so they are regular frame records (for m_convert_frames.py).
+    if len(data_parts) == 1:
+        return capture_file.append(header, data_parts[0], frame_index, receive_time)
+
+    data_parts = [memoryview(data_part).cast("B") for data_part in data_parts]
+
+    header = dict(header)
+    header[CAPTURE_PART_SIZES_KEY] = [data_part.nbytes for data_part in data_parts]
+
+    return capture_file.append(header, b"".join(data_parts), frame_index, receive_time)
+
+
+def capture_stream(connect_address, filename, file_size=DEFAULT_FRAME_DUMP_SIZE, n_messages=None, duration=None,
+                   socket_type="pull", receive_timeout=1000):
+    """
+    Record the mflow messages (header and raw data parts) of a stream into a capture file.
+    The capture stops after n_messages, after duration, when the file is full or on KeyboardInterrupt.
+    :param connect_address: Address of the stream. Example: tcp://127.0.0.1:40000
+    :param filename: Capture file to write.
+    :param file_size: Maximum size of the capture file in bytes. The file is truncated to the captured messages.
+    :param n_messages: Number of messages to capture. None for no limit.
+    :param duration: Number of seconds to capture for. None for no limit.
+    :param socket_type: "pull" or "sub".
+    :param receive_timeout: Receive timeout in milliseconds, to check the duration.
+    :return: Number of captured messages.
+    """
+    context = zmq.Context()
+    socket = context.socket(CAPTURE_SOCKET_TYPES[socket_type])
+    socket.setsockopt(zmq.RCVTIMEO, receive_timeout)
+    if socket_type == "sub":
+        socket.setsockopt(zmq.SUBSCRIBE, b"")
+    socket.connect(connect_address)
+
+    capture_file = FrameDump(filename, file_size)
+    n_captured = 0
+    capture_start = time()
+
+    _logger.info("Capturing stream '%s' to '%s'.", connect_address, filename)
+
+    try:
+        while n_messages is None or n_captured < n_messages:
+            if duration is not None and time() - capture_start > duration:
+                break
+
+            try:
+                message_parts = socket.recv_multipart(copy=False)
+            except zmq.Again:
+                continue
+
+            receive_time = time()
+            header = json.loads(message_parts[0].bytes.decode())
+            data_parts = [message_part.buffer for message_part in message_parts[1:]]
+
+            if not append_message(capture_file, header, data_parts, n_captured, receive_time):
+                _logger.warning("Capture file '%s' is full.", filename)
+                break
+
+            n_captured += 1
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        capture_file.close(remove=False, truncate=True)
+        socket.close()
+        context.term()
+
+    _logger.info("Captured %d messages.", n_captured)
+
+    return n_captured
+
+
+class StreamCapture(object):
+    """
+    Read only, memory mapped capture file, with an index of the message offsets and receive times.
+    """
+
+    def __init__(self, filename):
+        """
+        Open the capture file and index its messages. Only the record headers are read.
+        :param filename: Capture file written by capture_stream (or any frame dump file).
+        """
+        self.filename = filename
+
+        self._file = open(filename, "rb")
+        self._mmap = None
+        self.offsets = []
+        self.receive_times = []
+
+        # Empty files cannot be memory mapped.
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return
+
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        record_offset = 0
+        while record_offset + FRAME_RECORD_HEADER.size <= len(self._mmap):
+            magic, header_length, data_length, _, receive_time = \
+                FRAME_RECORD_HEADER.unpack_from(self._mmap, record_offset)
+
+            if magic != FRAME_RECORD_MAGIC:
+                break
+
+            self.offsets.append(record_offset)
+            self.receive_times.append(receive_time)
+            record_offset += FRAME_RECORD_HEADER.size + header_length + data_length
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get_message(self, message_number):
+        """
+        Read a message from the capture file, without copying the data.
+        :param message_number: Number of the message in the capture.
+        :return: (header, list of data part memoryviews, receive_time).
+        """
+        header, data, _, receive_time, _ = read_frame_record(self._mmap, self.offsets[message_number])
+
+        part_sizes = header.pop(CAPTURE_PART_SIZES_KEY, None)
+        if part_sizes is None:
+            return header, [data], receive_time
+
+        data_parts = []
+        part_offset = 0
+        for part_size in part_sizes:
+            data_parts.append(data[part_offset:part_offset + part_size])
+            part_offset += part_size
+
+        return header, data_parts, receive_time
+
+    def close(self):
+        """
+        Close the capture file. The messages read from it must not be used anymore.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class ZMQPushSender(object):
+    """
+    Send the replayed messages to a PUSH socket, as an mflow stream.
+    """
+
+    def __init__(self, binding_address, send_timeout=-1):
+        """
+        Bind the PUSH socket.
+        :param binding_address: Address to bind to. Example: tcp://127.0.0.1:40000
+        :param send_timeout: Send timeout in milliseconds. -1 (default) to wait for the receiver.
+        """
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.PUSH)
+        self._socket.setsockopt(zmq.SNDTIMEO, send_timeout)
+        self._socket.bind(binding_address)
+
+    def send(self, header, data_parts):
+        self._socket.send_multipart([json.dumps(header).encode()] + data_parts, copy=False)
+
+    def close(self):
+        # The data parts are not copied: wait until they are sent, before the capture file is closed.
+        self._socket.close(linger=-1)
+        self._context.term()
+
+
+def decode_message(header, data_parts, receive_raw=False):
+    """
+    Build the message a processor gets from the mflow receive handlers.
+    :param header: Message header.
+    :param data_parts: List of data parts (bytes-like).
+    :param receive_raw: Do not decode the data, as for the nodes receiving in raw mode.
+    :return: FrameMessage, with the raw_message for forwarding processors.
+    """
+    raw_message = {"header": header, "data": data_parts}
+    htype = header.get("htype", "")
+    data = data_parts[0] if len(data_parts) == 1 else data_parts
+
+    if not receive_raw:
+        if htype.startswith("array-") and header.get("encoding", UNCOMPRESSED_ENCODING_STRING) == \
+                UNCOMPRESSED_ENCODING_STRING:
+            data = np.frombuffer(data_parts[0], dtype=header["type"]).reshape(header["shape"])
+
+        elif htype.startswith("dimage-"):
+            # Image data header, image data and image config parts.
+            image_header = json.loads(bytes(data_parts[0]).decode())
+            header = dict(header, shape=image_header["shape"], type=image_header["type"])
+            data = data_parts[1]
+
+            if image_header.get("encoding", "<") == "<":
+                data = np.frombuffer(data, dtype=image_header["type"]).reshape(image_header["shape"])
+
+        elif htype.startswith("dheader-"):
+            # The detector config is the first data part. Only with header_detail "none" there is none.
+            data = json.loads(bytes(data_parts[0]).decode()) if data_parts else {}
+
+    message = FrameMessage(header, data, frame_index=header.get("frame", 0))
+    # Forwarding processors pass on the raw message.
+    message.raw_message = raw_message
+
+    return message
+
+
+class ProcessMessageSender(object):
+    """
+    Pass the replayed messages directly to the process_message of a processor, without the network.
+    """
+
+    def __init__(self, processor, receive_raw=False):
+        """
+        :param processor: Processor to pass the messages to.
+        :param receive_raw: Pass the data undecoded, as to the nodes receiving in raw mode (the writers).
+        """
+        self._processor = processor
+        self._receive_raw = receive_raw
+
+    def send(self, header, data_parts):
+        self._processor.process_message(decode_message(header, data_parts, self._receive_raw))
+
+    def close(self):
+        pass
+
+
+def replay_capture(capture, send_function, rate_mode="max", rate=None, n_messages=None,
+                   saturation_tolerance=DEFAULT_SATURATION_TOLERANCE):
+    """
+    Replay the captured messages.
+    :param capture: StreamCapture to replay.
+    :param send_function: Function called with (header, data_parts) for each message.
+    :param rate_mode: "original" (timing of the capture), "fixed" (rate messages/second) or "max" (as fast as possible).
+    :param rate: Messages per second for the "fixed" rate mode.
+    :param n_messages: Number of messages to replay, repeating the capture if needed. All the messages if None.
+    :param saturation_tolerance: Fraction of the target rate the replay can fall behind without being saturated.
+    :return: Dictionary with n_messages, n_bytes, duration, rate, bytes_rate, target_rate, max_lag and saturated.
+    """
+    if rate_mode not in REPLAY_RATE_MODES:
+        raise ValueError("Rate mode must be one of %s." % (REPLAY_RATE_MODES,))
+
+    if rate_mode == "fixed" and (not rate or rate <= 0):
+        raise ValueError("The fixed rate mode needs a positive rate.")
+
+    if not len(capture):
+        raise ValueError("Capture file '%s' has no messages." % capture.filename)
+
+    n_messages = len(capture) if n_messages is None else n_messages
+
+    # Original timing: time from the first message, continuing after the last one when the capture is repeated.
+    capture_duration = capture.receive_times[-1] - capture.receive_times[0]
+    capture_interval = capture_duration / (len(capture) - 1) if len(capture) > 1 else 0
+
+    n_bytes = 0
+    max_lag = 0
+    replay_start = perf_counter()
+
+    for message_number in range(n_messages):
+        capture_number = message_number % len(capture)
+
+        if rate_mode != "max":
+            if rate_mode == "fixed":
+                message_time = message_number / rate
+            else:
+                message_time = capture.receive_times[capture_number] - capture.receive_times[0] + \
+                               (message_number // len(capture)) * (capture_duration + capture_interval)
+
+            delay = replay_start + message_time - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+
+        header, data_parts, _ = capture.get_message(capture_number)
+        send_function(header, data_parts)
+
+        n_bytes += sum(data_part.nbytes for data_part in data_parts)
+
+    duration = perf_counter() - replay_start
+
+    if rate_mode == "fixed":
+        target_rate = rate
+    elif rate_mode == "original" and capture_interval:
+        target_rate = 1 / capture_interval
+    else:
+        target_rate = None
+
+    return get_replay_result(n_messages, n_bytes, duration, target_rate, max_lag, saturation_tolerance)
+
+
+def get_replay_result(n_messages, n_bytes, duration, target_rate, max_lag,
+                      saturation_tolerance=DEFAULT_SATURATION_TOLERANCE):
+    """
+    :return: Dictionary with n_messages, n_bytes, duration, rate, bytes_rate, target_rate, max_lag and saturated.
+    """
+    replay_rate = n_messages / duration if duration else float("inf")
+
+    return {"n_messages": n_messages,
+            "n_bytes": n_bytes,
+            "duration": duration,
+            "rate": replay_rate,
+            "bytes_rate": n_bytes / duration if duration else float("inf"),
+            "target_rate": target_rate,
+            "max_lag": max_lag,
+            "saturated": target_rate is not None and replay_rate < target_rate * (1 - saturation_tolerance)}
+
+
+def replay_to_processor(capture, processor, rate_mode="max", rate=None, n_messages=None,
+                        saturation_tolerance=DEFAULT_SATURATION_TOLERANCE, receive_raw=False):
+    """
+    Start the processor, replay the capture into its process_message and stop it.
+    The stop is part of the replay duration, so frames queued by the processor count as well.
+    :param receive_raw: Pass the data undecoded, as to the nodes receiving in raw mode (the writers).
+    :return: replay_capture result.
+    """
+    processor.start()
+
+    result = replay_capture(capture, ProcessMessageSender(processor, receive_raw).send, rate_mode, rate, n_messages,
+                            saturation_tolerance)
+
+    stop_start = perf_counter()
+    processor.stop()
+    duration = result["duration"] + perf_counter() - stop_start
+
+    return get_replay_result(result["n_messages"], result["n_bytes"], duration, result["target_rate"],
+                             result["max_lag"], saturation_tolerance)
+
+
+def find_saturation_rate(replay_function, start_rate, rate_factor=2, max_steps=10):
+    """
+    Replay at increasing fixed rates until the receiver cannot keep up.
+    :param replay_function: Function called with the rate, returning the replay_capture result.
+    :param start_rate: First rate to replay at (messages/second).
+    :param rate_factor: Factor to increase the rate by in each step.
+    :param max_steps: Maximum number of rates to try.
+    :return: (highest rate sustained - None if even the start rate saturates, list of replay results).
+    """
+    sustained_rate = None
+    results = []
+    rate = start_rate
+
+    for _ in range(max_steps):
+        result = replay_function(rate)
+        results.append(result)
+
+        _logger.info("Target rate %.1f messages/s, replayed %.1f messages/s.", rate, result["rate"])
+
+        if result["saturated"]:
+            break
+
+        sustained_rate = rate
+        rate *= rate_factor
+
+    return sustained_rate, results
@@ -5,8 +5,8 @@ def write_frame_index_to_dataset(target_dataset):
     :return: Function to pass to the writer as a plugin.
     """
     def plugin(writer, message):
-        # Append the frame index to the specified dataset.
-        writer.h5_datasets.setdefault(target_dataset, []).append(message.get_frame_index())
+        frame_index = message.get_frame_index()
+        writer.frame_metadata.set_value(target_dataset, frame_index, frame_index)
 
     return plugin
 
@@ -19,9 +19,8 @@ def write_header_parameter_to_dataset(header_parameter, target_dataset):
     :return: Function to pass to the writer as a plugin.
     """
     def plugin(writer, message):
-        # Append the frame index to the specified dataset.
         data = message.get_header()[header_parameter]
-        writer.h5_datasets.setdefault(target_dataset, []).append(data)
+        writer.frame_metadata.set_value(target_dataset, message.get_frame_index(), data)
 
     return plugin
 
@@ -34,10 +33,11 @@ def write_header_parameters_to_dataset(root_dataset):
     :return: Function to pass to the writer as a plugin.
     """
     def plugin(writer, message):
-        # Append the frame index to the specified dataset.
+        frame_index = message.get_frame_index()
+
         for header_parameter, data in message.get_header().items():
             if header_parameter in ["shape", "type", "htype"]:
                 continue
-            writer.h5_datasets.setdefault(root_dataset + "/" + header_parameter, []).append(data)
+            writer.frame_metadata.set_value(root_dataset + "/" + header_parameter, frame_index, data)
 
     return plugin
@@ -0,0 +1,33 @@
+from argparse import ArgumentParser
+
+from mflow_nodes.script_tools.helpers import setup_logging
+from mflow_processor.utils.frame_dump import DEFAULT_FRAME_DUMP_SIZE
+from mflow_processor.utils.stream_capture import capture_stream, CAPTURE_SOCKET_TYPES
+
+
+def run(input_args):
+    capture_stream(connect_address=input_args.connect_address,
+                   filename=input_args.capture_file,
+                   file_size=input_args.file_size,
+                   n_messages=input_args.n_messages,
+                   duration=input_args.duration,
+                   socket_type=input_args.socket_type)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("connect_address", type=str, help="Connect address for mflow. Example: tcp://127.0.0.1:40000")
+    parser.add_argument("capture_file", type=str, help="Capture file to write.")
+    parser.add_argument("--file_size", type=int, default=DEFAULT_FRAME_DUMP_SIZE,
+                        help="Maximum size of the capture file in bytes.")
+    parser.add_argument("--n_messages", type=int, default=None, help="Number of messages to capture.")
+    parser.add_argument("--duration", type=float, default=None, help="Number of seconds to capture for.")
+    parser.add_argument("--socket_type", default="pull", choices=sorted(CAPTURE_SOCKET_TYPES),
+                        help="ZMQ socket type to receive with.")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        help="Log level to use.")
+    arguments = parser.parse_args()
+
+    setup_logging(arguments.log_level)
+
+    run(arguments)
@@ -12,6 +12,7 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     add_default_arguments(parser, binding_argument=True)
     parser.add_argument("--block_size", type=int, default=2048, help="LZ4 block size.")
+    parser.add_argument("--n_workers", type=int, default=1, help="Number of compression threads.")
     arguments = parser.parse_args()
 
     setup_logging(arguments.log_level)
@@ -0,0 +1,42 @@
+from argparse import ArgumentParser
+
+from mflow_nodes.script_tools.helpers import setup_logging
+from mflow_processor.utils.frame_conversion import convert_frames, INPUT_FORMATS, OUTPUT_FORMATS, \
+    DEFAULT_FRAMES_PER_FILE
+from mflow_processor.utils.nxmx_utils import DATA_DATASET_NAME
+
+
+def run(input_args):
+    convert_frames(input_files=input_args.input_files,
+                   output_file=input_args.output_file,
+                   input_format=input_args.input_format,
+                   output_format=input_args.output_format,
+                   frame_shape=input_args.frame_shape,
+                   dtype=input_args.dtype,
+                   dataset_name=input_args.dataset_name,
+                   frames_per_file=input_args.frames_per_file,
+                   n_workers=input_args.n_workers,
+                   compress=not input_args.no_compression)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("output_file", type=str, help="Master file to write. Example: run_001_master.h5")
+    parser.add_argument("input_files", type=str, nargs="+", help="Frame dump, capture or raw frame files.")
+    parser.add_argument("--input_format", default="dump", choices=INPUT_FORMATS,
+                        help="'dump' for spill and capture files, 'raw' for files of consecutive frames.")
+    parser.add_argument("--output_format", default="plain", choices=OUTPUT_FORMATS, help="Format of the master file.")
+    parser.add_argument("--frame_shape", type=int, nargs="+", help="Frame shape. Needed for raw files.")
+    parser.add_argument("--dtype", type=str, help="Frame data type. Needed for raw files.")
+    parser.add_argument("--dataset_name", type=str, default=DATA_DATASET_NAME, help="Name of the frames dataset.")
+    parser.add_argument("--frames_per_file", type=int, default=DEFAULT_FRAMES_PER_FILE,
+                        help="Number of frames in each data file.")
+    parser.add_argument("--n_workers", type=int, default=None, help="Number of processes. Default is number of CPUs.")
+    parser.add_argument("--no_compression", action="store_true", help="Do not compress the frames.")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        help="Log level to use.")
+    arguments = parser.parse_args()
+
+    setup_logging(arguments.log_level)
+
+    run(arguments)
@@ -0,0 +1,91 @@
+import json
+from argparse import ArgumentParser
+from importlib import import_module
+
+from mflow_nodes.script_tools.helpers import setup_logging
+from mflow_processor.utils.stream_capture import StreamCapture, ZMQPushSender, REPLAY_RATE_MODES, replay_capture, \
+    replay_to_processor, find_saturation_rate
+
+
+def create_processor(processor_class_name, parameters, processor_arguments=None):
+    """
+    Create the processor and set its parameters.
+    :param processor_class_name: Full class name. Example: mflow_processor.h5_chunked_writer.HDF5ChunkedWriterProcessor
+    :param parameters: Dictionary of processor parameters.
+    :param processor_arguments: List of arguments of the processor constructor.
+    """
+    module_name, class_name = processor_class_name.rsplit(".", 1)
+    processor = getattr(import_module(module_name), class_name)(*(processor_arguments or []))
+
+    for name, value in parameters.items():
+        setattr(processor, name, value)
+
+    return processor
+
+
+def run(input_args):
+    capture = StreamCapture(input_args.capture_file)
+    processor = None
+
+    if input_args.processor:
+        processor = create_processor(input_args.processor, json.loads(input_args.parameters),
+                                     json.loads(input_args.processor_arguments))
+
+        def replay(rate_mode, rate):
+            return replay_to_processor(capture, processor, rate_mode, rate, input_args.n_messages,
+                                       receive_raw=input_args.receive_raw)
+    else:
+        sender = ZMQPushSender(input_args.binding_address)
+
+        def replay(rate_mode, rate):
+            return replay_capture(capture, sender.send, rate_mode, rate, input_args.n_messages)
+
+    try:
+        if input_args.find_saturation:
+            sustained_rate, results = find_saturation_rate(lambda rate: replay("fixed", rate), input_args.rate,
+                                                           input_args.rate_factor, input_args.max_steps)
+            output = {"saturation_rate": sustained_rate, "results": results}
+        else:
+            output = replay(input_args.rate_mode, input_args.rate)
+
+        if processor is not None and hasattr(processor, "get_statistics"):
+            output["statistics"] = processor.get_statistics()
+
+        print(json.dumps(output, indent=4))
+
+    finally:
+        if processor is None:
+            sender.close()
+        capture.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("capture_file", type=str, help="Capture file to replay.")
+    parser.add_argument("--binding_address", type=str, default="tcp://127.0.0.1:40000",
+                        help="Address to bind the PUSH socket to.")
+    parser.add_argument("--processor", type=str, default=None,
+                        help="Replay directly into this processor class instead of the PUSH socket. "
+                             "Example: mflow_processor.h5_chunked_writer.HDF5ChunkedWriterProcessor")
+    parser.add_argument("--parameters", type=str, default="{}", help="JSON parameters of the processor.")
+    parser.add_argument("--processor_arguments", type=str, default="[]",
+                        help="JSON list of arguments of the processor constructor.")
+    parser.add_argument("--receive_raw", action="store_true",
+                        help="Pass the data undecoded, as to the nodes receiving in raw mode (the writers).")
+    parser.add_argument("--rate_mode", default="max", choices=REPLAY_RATE_MODES,
+                        help="Original timing of the capture, fixed rate or as fast as possible.")
+    parser.add_argument("--rate", type=float, default=100, help="Messages per second for the fixed rate mode, "
+                                                                "first rate to try when finding the saturation.")
+    parser.add_argument("--n_messages", type=int, default=None,
+                        help="Number of messages to replay, repeating the capture if needed.")
+    parser.add_argument("--find_saturation", action="store_true",
+                        help="Replay at increasing fixed rates until the receiver cannot keep up.")
+    parser.add_argument("--rate_factor", type=float, default=2, help="Rate increase in each saturation step.")
+    parser.add_argument("--max_steps", type=int, default=10, help="Maximum number of saturation steps.")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        help="Log level to use.")
+    arguments = parser.parse_args()
+
+    setup_logging(arguments.log_level)
+
+    run(arguments)
@@ -10,6 +10,7 @@ setup(
     requires=["mflow_nodes", "h5py", "numpy", "bitshuffle"],
 
     scripts=['scripts/m_write_node.py',
+             'scripts/m_write_sharded_node.py',
              'scripts/m_write_jungfrau_node.py',
              'scripts/m_write_csax_nxsas_node.py',
              'scripts/m_write_px_node.py',
@@ -17,7 +18,10 @@ setup(
              "scripts/m_compression_node.py",
              "scripts/m_nxmx_node.py",
              "scripts/m_dummy_writer.py",
-             "scripts/m_bsread_writer.py"],
+             "scripts/m_bsread_writer.py",
+             "scripts/m_convert_frames.py",
+             "scripts/m_capture_stream.py",
+             "scripts/m_replay_stream.py"],
 
     package_dir={"mflow_processor.scripts": 'scripts'},
 
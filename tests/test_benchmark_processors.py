@@ -0,0 +1,45 @@
+import shutil
+import tempfile
+import unittest
+from argparse import Namespace
+
+import numpy as np
+
+from tests.test_tools.benchmark_processors import benchmark_nxmx, get_benchmarks, run_benchmark
+
+n_frames = 20
+frame_shape = [16, 16]
+
+
+class BenchmarkProcessorsTest(unittest.TestCase):
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder, ignore_errors=True)
+
+    def test_nxmx_benchmark(self):
+        """
+        Test if the NXMX benchmark forwards all the images, and counts their bytes.
+        """
+        _, statistics = benchmark_nxmx(self.output_folder, n_frames, frame_shape, "uint16", frames_per_file=10)
+
+        self.assertEqual(statistics["image_count"], n_frames)
+        self.assertEqual(statistics["bytes"], n_frames * int(np.prod(frame_shape)) * 2)
+
+    def test_benchmark_matrix(self):
+        """
+        Test if all the benchmarks of a small matrix run.
+        """
+        input_args = Namespace(frame_sizes=[16], dtypes=["uint16"], frames_per_file=10, n_workers=2, filter="")
+
+        benchmarks = get_benchmarks(input_args)
+        self.assertTrue(any(name.startswith("nxmx/") for name, _, _ in benchmarks))
+
+        for name, benchmark_function, kwargs in benchmarks:
+            result = run_benchmark(benchmark_function, kwargs, n_frames, repeat=1)
+            self.assertEqual(result["frames"], n_frames, "Benchmark '%s' failed." % name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import unittest
+from types import SimpleNamespace
+
+import h5py
+import numpy as np
+
+from mflow_processor.utils.bsread_columns import BsreadColumnWriter
+
+output_file = "ignore_test_output.h5"
+
+
+def get_message(pulse_id, channels):
+    data = {name: SimpleNamespace(value=value, timestamp=0, timestamp_offset=0) for name, value in channels.items()}
+    return SimpleNamespace(pulse_id=pulse_id, global_timestamp=1000 + pulse_id, global_timestamp_offset=0, data=data)
+
+
+class BsreadColumnWriterTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    def test_write_channels(self):
+        """
+        Test if each channel gets its typed dataset and the missing values are marked as invalid.
+        """
+        channels_metadata = {"scalar": {"name": "scalar", "type": "float32", "shape": [1]}}
+
+        with h5py.File(output_file, "w") as file:
+            column_writer = BsreadColumnWriter(file, write_batch_size=4)
+
+            for pulse_id in range(10):
+                channels = {"scalar": pulse_id,
+                            "waveform": np.arange(3) + pulse_id,
+                            "string": "value_%d" % pulse_id}
+                # Channel appearing later in the stream.
+                if pulse_id >= 5:
+                    channels["late"] = np.array([pulse_id], dtype="int32")
+                # Missing value.
+                if pulse_id == 3:
+                    channels["scalar"] = None
+
+                column_writer.add_message(get_message(pulse_id, channels), channels_metadata)
+
+            # Only complete batches are written.
+            self.assertEqual(file["pulse_id"].shape[0], 8)
+
+            column_writer.flush()
+
+        with h5py.File(output_file, "r") as file:
+            self.assertListEqual(list(file["pulse_id"][:]), list(range(10)))
+            self.assertEqual(file["global_timestamp"][9], 1009)
+
+            self.assertEqual(file["data/scalar/data"].dtype, np.float32)
+            self.assertEqual(file["data/scalar/data"].shape, (10,))
+            self.assertListEqual(list(file["data/scalar/is_valid"][:]), [pulse_id != 3 for pulse_id in range(10)])
+
+            self.assertEqual(file["data/waveform/data"].shape, (10, 3))
+            self.assertListEqual(list(file["data/waveform/data"][9]), [9, 10, 11])
+
+            self.assertEqual(file["data/string/data"][2], b"value_2")
+
+            self.assertListEqual(list(file["data/late/data"][:]), [0] * 5 + list(range(5, 10)))
+            self.assertListEqual(list(file["data/late/is_valid"][:]), [False] * 5 + [True] * 5)
+
+    def test_truncate(self):
+        """
+        Test if all the datasets are truncated to the same number of pulses.
+        """
+        with h5py.File(output_file, "w") as file:
+            column_writer = BsreadColumnWriter(file, write_batch_size=4)
+
+            for pulse_id in range(6):
+                column_writer.add_message(get_message(pulse_id, {"scalar": pulse_id}))
+
+            column_writer.flush()
+            column_writer.truncate(5)
+
+            self.assertEqual(file["pulse_id"].shape[0], 5)
+            self.assertEqual(file["data/scalar/data"].shape[0], 5)
+            self.assertEqual(file["data/scalar/is_valid"].shape[0], 5)
+
+    def test_truncate_after(self):
+        """
+        Test if the pulses after end_pulse_id are removed, from the written and from the buffered pulses.
+        """
+        with h5py.File(output_file, "w") as file:
+            column_writer = BsreadColumnWriter(file, write_batch_size=4)
+
+            # Pulse ids with gaps: 0, 2, 4... 18.
+            for pulse_id in range(0, 20, 2):
+                column_writer.add_message(get_message(pulse_id, {"scalar": pulse_id}))
+
+            # Buffered pulses only.
+            self.assertEqual(column_writer.truncate_after(17), 1)
+            self.assertEqual(column_writer.n_pulses, 9)
+            self.assertEqual(file["pulse_id"].shape[0], 8)
+
+            # Buffered and written pulses.
+            self.assertEqual(column_writer.truncate_after(7), 5)
+            self.assertEqual(column_writer.truncate_after(7), 0)
+            self.assertEqual(column_writer.n_pulses, 4)
+
+            column_writer.add_message(get_message(8, {}))
+            column_writer.flush()
+
+        with h5py.File(output_file, "r") as file:
+            self.assertListEqual(list(file["pulse_id"][:]), [0, 2, 4, 6, 8])
+            self.assertListEqual(list(file["data/scalar/data"][:]), [0, 2, 4, 6, 0])
+            self.assertListEqual(list(file["data/scalar/is_valid"][:]), [True] * 4 + [False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import unittest
+from time import sleep
+from types import SimpleNamespace
+
+import h5py
+
+from mflow_processor.bsread_writer import BsreadWriter
+from mflow_processor.utils.bsread_write_job import BsreadWriteJob, validate_write_job
+
+output_files = ["ignore_test_output_1.h5", "ignore_test_output_2.h5"]
+# File in place of a folder, so the jobs writing into it cannot be started.
+blocking_file = "ignore_test_output_folder"
+
+
+def get_message(pulse_id):
+    data = {"scalar": SimpleNamespace(value=pulse_id, timestamp=0, timestamp_offset=0),
+            "other": SimpleNamespace(value=-pulse_id, timestamp=0, timestamp_offset=0)}
+    # Received messages are compact handler messages in the data attribute.
+    return SimpleNamespace(data=SimpleNamespace(pulse_id=pulse_id, global_timestamp=0, global_timestamp_offset=0,
+                                                data=data))
+
+
+class BsreadWriteJobTest(unittest.TestCase):
+    def tearDown(self):
+        for output_file in output_files:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    def test_validate_write_job(self):
+        """
+        Test if invalid write jobs are rejected.
+        """
+        validate_write_job({"output_file": output_files[0], "start_pulse_id": 10})
+        validate_write_job({"output_file": output_files[0], "end_pulse_id": 10})
+
+        self.assertRaises(ValueError, validate_write_job, {"output_file": output_files[0]})
+        self.assertRaises(ValueError, validate_write_job, {"start_pulse_id": 10})
+        self.assertRaises(ValueError, validate_write_job, {"output_file": output_files[0], "start_pulse_id": 10,
+                                                           "unknown": 1})
+        self.assertRaises(ValueError, validate_write_job, [output_files[0], 10])
+
+    def test_concurrent_jobs(self):
+        """
+        Test if jobs sharing the same messages write their own pulse_id window and channels.
+        """
+        messages = [get_message(pulse_id) for pulse_id in range(100)]
+
+        first_job = BsreadWriteJob(output_files[0], start_pulse_id=10, end_pulse_id=30, channels=["scalar"],
+                                   write_batch_size=8)
+        second_job = BsreadWriteJob(output_files[1], start_pulse_id=20, write_batch_size=8)
+
+        # Messages received before the start of the jobs.
+        first_job.start(messages[10:25])
+        second_job.start(messages[20:25])
+
+        # The end_pulse_id can be set while writing.
+        second_job.end_pulse_id = 60
+
+        for message in messages[25:]:
+            first_job.put(message)
+            second_job.put(message)
+
+        # The jobs stop at their end_pulse_id.
+        for _ in range(100):
+            if not first_job.is_running and not second_job.is_running:
+                break
+            sleep(0.01)
+
+        self.assertFalse(first_job.is_running)
+        self.assertFalse(second_job.is_running)
+
+        first_job.stop()
+        second_job.stop()
+
+        with h5py.File(output_files[0], "r") as file:
+            self.assertListEqual(list(file["pulse_id"][:]), list(range(10, 31)))
+            self.assertListEqual(list(file["data"]), ["scalar"])
+
+        with h5py.File(output_files[1], "r") as file:
+            self.assertListEqual(list(file["pulse_id"][:]), list(range(20, 61)))
+            self.assertListEqual(list(file["data/other/data"][:]), [-pulse_id for pulse_id in range(20, 61)])
+
+
+class BsreadWriterJobsTest(unittest.TestCase):
+    def setUp(self):
+        open(blocking_file, "w").close()
+
+    def tearDown(self):
+        for output_file in output_files + [blocking_file]:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    def test_output_file_validation(self):
+        """
+        Test if the output_file is required for the start_pulse_id, also when only write_jobs are used.
+        """
+        writer = BsreadWriter()
+        writer.channels = ["scalar"]
+        writer.write_jobs = [{"output_file": output_files[0], "start_pulse_id": 10}]
+        writer._validate_parameters()
+
+        writer.start_pulse_id = 10
+        self.assertRaises(ValueError, writer._validate_parameters)
+
+    def test_failed_job(self):
+        """
+        Test if write jobs that cannot be started do not stop the other jobs.
+        """
+        writer = BsreadWriter()
+        writer.channels = ["scalar", "other"]
+        writer.buffer_overflow_policy = "spill"
+
+        for pulse_id in range(10):
+            writer._ring_buffer.put(pulse_id, get_message(pulse_id), 10)
+
+        # Default job without output_file, and a job whose spill file cannot be created.
+        writer.start_pulse_id = 2
+        writer.write_jobs = [{"output_file": os.path.join(blocking_file, "output.h5"), "start_pulse_id": 0},
+                             {"output_file": output_files[0], "start_pulse_id": 5, "end_pulse_id": 8}]
+
+        writer._update_write_jobs()
+
+        self.assertListEqual([job.output_file for job in writer._jobs], [output_files[0]])
+        self.assertIsNone(writer.start_pulse_id)
+
+        writer._jobs[0].stop()
+
+        with h5py.File(output_files[0], "r") as file:
+            self.assertListEqual(list(file["pulse_id"][:]), [5, 6, 7, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+
+import bitshuffle
+import numpy as np
+from bitshuffle.h5 import H5_COMPRESS_LZ4
+
+from mflow_processor.lz4_compressor import LZ4CompressionProcessor, BITSHUFFLE_CHUNK_HEADER
+from mflow_processor.utils.codec_selector import AdaptiveCodecSelector, get_dataset_encodings, BITSHUFFLE_FILTER, \
+    UNCOMPRESSED_ENCODING_STRING, BITSHUFFLE_ENCODING_STRING, BITSHUFFLE_ZSTD_ENCODING_STRING
+
+LZ4_CANDIDATE = ("lz4", 2048)
+UNCOMPRESSED_CANDIDATE = ("none", None)
+
+
+def sample_candidates(codec_selector, costs, n_frames):
+    """
+    Sample the candidates with fixed results.
+    :param costs: Candidate -> (compression time, compressed bytes).
+    """
+    for _ in range(n_frames):
+        candidate = codec_selector.get_candidate()
+        codec_selector.record(candidate, *costs[candidate])
+
+
+class AdaptiveCodecSelectorTest(unittest.TestCase):
+    def test_selection(self):
+        """
+        Test if the candidates are sampled round robin, and the one with the lowest cost is then used.
+        """
+        codec_selector = AdaptiveCodecSelector(["lz4:2048", "none"], sample_frames=2, output_bandwidth=1e9)
+
+        self.assertListEqual([codec_selector.get_candidate() for _ in range(4)],
+                             [LZ4_CANDIDATE, UNCOMPRESSED_CANDIDATE] * 2)
+
+        # 1 ms to compress to 100 bytes, against 10 ms to transfer 10 MB uncompressed.
+        for candidate in (LZ4_CANDIDATE, UNCOMPRESSED_CANDIDATE) * 2:
+            codec_selector.record(candidate, *{LZ4_CANDIDATE: (0.001, 100),
+                                               UNCOMPRESSED_CANDIDATE: (0, 10 ** 7)}[candidate])
+
+        self.assertListEqual([codec_selector.get_candidate() for _ in range(10)], [LZ4_CANDIDATE] * 10)
+
+    def test_incompressible_stream(self):
+        """
+        Test if streams that do not compress well are forwarded uncompressed.
+        """
+        codec_selector = AdaptiveCodecSelector(["lz4:2048", "none"], sample_frames=3, output_bandwidth=1e9)
+
+        sample_candidates(codec_selector, {LZ4_CANDIDATE: (0.001, 10 ** 6), UNCOMPRESSED_CANDIDATE: (0, 10 ** 6)}, 6)
+
+        self.assertEqual(codec_selector.get_candidate(), UNCOMPRESSED_CANDIDATE)
+
+    def test_reevaluation(self):
+        """
+        Test if the candidates are sampled again after reevaluate_interval frames.
+        """
+        codec_selector = AdaptiveCodecSelector(["lz4:2048", "none"], sample_frames=1, reevaluate_interval=3)
+
+        sample_candidates(codec_selector, {LZ4_CANDIDATE: (0.001, 100), UNCOMPRESSED_CANDIDATE: (0, 10 ** 7)}, 2)
+        self.assertListEqual([codec_selector.get_candidate() for _ in range(2)], [LZ4_CANDIDATE] * 2)
+
+        # The third frame starts the sampling again.
+        self.assertEqual(codec_selector.get_candidate(), LZ4_CANDIDATE)
+        self.assertEqual(codec_selector.get_candidate(), UNCOMPRESSED_CANDIDATE)
+
+        # Results of frames compressed before the new sampling started are ignored.
+        codec_selector.record(LZ4_CANDIDATE, 0.001, 100)
+        codec_selector.record(LZ4_CANDIDATE, 0.001, 100)
+        codec_selector.record(UNCOMPRESSED_CANDIDATE, 0, 100)
+
+        self.assertEqual(codec_selector.get_candidate(), UNCOMPRESSED_CANDIDATE)
+
+    def test_dataset_encodings(self):
+        """
+        Test if the accepted frame encodings follow the dataset filter.
+        """
+        self.assertSetEqual(get_dataset_encodings(None), {UNCOMPRESSED_ENCODING_STRING})
+        self.assertSetEqual(get_dataset_encodings(BITSHUFFLE_FILTER, (2048, H5_COMPRESS_LZ4)),
+                            {UNCOMPRESSED_ENCODING_STRING, BITSHUFFLE_ENCODING_STRING})
+        self.assertSetEqual(get_dataset_encodings(BITSHUFFLE_FILTER, (0, 3)),
+                            {UNCOMPRESSED_ENCODING_STRING, BITSHUFFLE_ZSTD_ENCODING_STRING})
+        # Bitshuffle without compression.
+        self.assertSetEqual(get_dataset_encodings(BITSHUFFLE_FILTER, (0, 0)), {UNCOMPRESSED_ENCODING_STRING})
+        self.assertSetEqual(get_dataset_encodings("gzip", 4), {UNCOMPRESSED_ENCODING_STRING})
+
+    def test_frame_encoding(self):
+        """
+        Test if the compressor sets the encoding of the selected codec in the header of each frame.
+        """
+        compressor = LZ4CompressionProcessor()
+        compressor._codec_selector = AdaptiveCodecSelector(["lz4:2048", "none"], sample_frames=1)
+
+        frame = np.arange(64, dtype="uint16").reshape((8, 8))
+        header = {"htype": "array-1.0", "frame": 0, "shape": [8, 8], "type": "uint16"}
+
+        new_header, compressed_data = compressor._compress_adaptive(header, frame, LZ4_CANDIDATE)
+        self.assertEqual(new_header["encoding"], BITSHUFFLE_ENCODING_STRING)
+        self.assertNotIn("encoding", header)
+
+        _, block_size = BITSHUFFLE_CHUNK_HEADER.unpack_from(compressed_data)
+        decompressed_frame = bitshuffle.decompress_lz4(compressed_data[BITSHUFFLE_CHUNK_HEADER.size:], (8, 8),
+                                                       frame.dtype, block_size // frame.dtype.itemsize)
+        self.assertTrue((decompressed_frame == frame).all())
+
+        new_header, compressed_data = compressor._compress_adaptive(header, frame, UNCOMPRESSED_CANDIDATE)
+        self.assertEqual(new_header["encoding"], UNCOMPRESSED_ENCODING_STRING)
+        self.assertIs(compressed_data, frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
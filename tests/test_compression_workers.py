@@ -0,0 +1,102 @@
+import json
+import unittest
+from threading import Thread
+from time import sleep
+
+import bitshuffle
+import numpy as np
+import zmq
+
+from mflow_processor.lz4_compressor import LZ4CompressionProcessor, BITSHUFFLE_CHUNK_HEADER
+from mflow_processor.utils.frame_message import FrameMessage
+
+FORWARDING_ADDRESS = "tcp://127.0.0.1:40002"
+frame_shape = [16, 16]
+n_frames = 40
+n_workers = 4
+
+
+def receive_frames(received_frames):
+    """
+    Receive the compressed frames and decompress them.
+    :param received_frames: List to append the (header, frame) tuples to.
+    """
+    context = zmq.Context()
+    socket = context.socket(zmq.PULL)
+    socket.setsockopt(zmq.RCVTIMEO, 5000)
+    socket.connect(FORWARDING_ADDRESS)
+
+    try:
+        for _ in range(n_frames):
+            header, chunk = socket.recv_multipart()
+            header = json.loads(header.decode())
+
+            _, block_size = BITSHUFFLE_CHUNK_HEADER.unpack_from(chunk)
+            frame = bitshuffle.decompress_lz4(np.frombuffer(chunk[BITSHUFFLE_CHUNK_HEADER.size:], dtype=np.uint8),
+                                              tuple(header["shape"]), np.dtype(header["type"]), block_size // 2)
+            received_frames.append((header, frame))
+    except zmq.Again:
+        pass
+    finally:
+        socket.close()
+        context.term()
+
+
+class CompressionWorkersTest(unittest.TestCase):
+    def compress_stream(self, ordered_output):
+        """
+        Compress the frames with n_workers threads, the first frames of every few being the slowest to compress.
+        :return: Received (header, frame) tuples, in the order they were forwarded.
+        """
+        compressor = LZ4CompressionProcessor()
+        compressor.binding_address = FORWARDING_ADDRESS
+        compressor.n_workers = n_workers
+        compressor.ordered_output = ordered_output
+
+        compress_lz4 = compressor._compress_lz4
+
+        def slow_compress_lz4(header, data):
+            sleep(0.001 * (n_workers - header["frame"] % n_workers))
+            return compress_lz4(header, data)
+
+        compressor._compress_lz4 = slow_compress_lz4
+
+        received_frames = []
+        receiving_thread = Thread(target=receive_frames, args=(received_frames,))
+        receiving_thread.start()
+
+        compressor.start()
+
+        for frame_index in range(n_frames):
+            header = {"htype": "array-1.0", "frame": frame_index, "shape": frame_shape, "type": "uint16"}
+            compressor.process_message(FrameMessage(header, np.full(frame_shape, frame_index, dtype="uint16")))
+
+        compressor.stop()
+        receiving_thread.join()
+
+        for header, frame in received_frames:
+            self.assertTrue((frame == header["frame"]).all(), "Frame %d data does not match." % header["frame"])
+
+        self.assertEqual(compressor.get_statistics()["frames"], n_frames)
+
+        return received_frames
+
+    def test_ordered_output(self):
+        """
+        Test if the frames are forwarded in the received order, whichever worker finishes first.
+        """
+        received_frames = self.compress_stream(ordered_output=True)
+
+        self.assertListEqual([header["frame"] for header, _ in received_frames], list(range(n_frames)))
+
+    def test_unordered_output(self):
+        """
+        Test if every frame is forwarded exactly once when the frames are forwarded as soon as compressed.
+        """
+        received_frames = self.compress_stream(ordered_output=False)
+
+        self.assertListEqual(sorted(header["frame"] for header, _ in received_frames), list(range(n_frames)))
+
+
+if __name__ == '__main__':
+    unittest.main()
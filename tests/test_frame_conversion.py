@@ -0,0 +1,141 @@
+import json
+import os
+import unittest
+
+import h5py
+import numpy as np
+
+from mflow_processor.lz4_compressor import compress_bitshuffle_chunk, BITSHUFFLE_ENCODING_STRING
+from mflow_processor.utils.frame_conversion import convert_frames
+from mflow_processor.utils.frame_dump import FrameDump
+from mflow_processor.utils.stream_capture import append_message
+
+dump_filename = "ignore_test_output.spill"
+raw_filename = "ignore_test_output.raw"
+master_filename = "ignore_test_output_master.h5"
+data_filename_format = "ignore_test_output_data_%06d.h5"
+dataset_name = "entry/data/data"
+frame_shape = [16, 32]
+
+
+def get_frame(frame_index):
+    return np.arange(np.prod(frame_shape), dtype="uint16").reshape(frame_shape) + frame_index
+
+
+class FrameConversionTest(unittest.TestCase):
+    def tearDown(self):
+        for filename in [dump_filename, raw_filename, master_filename] + \
+                        [data_filename_format % frame_chunk for frame_chunk in range(1, 10)]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_convert_frame_dump(self):
+        """
+        Test if compressed and uncompressed frames are converted, and the missing frames are empty.
+        """
+        n_frames = 25
+        missing_frame = 13
+
+        frame_dump = FrameDump(dump_filename, file_size=1 << 20)
+        for frame_index in range(n_frames):
+            if frame_index == missing_frame:
+                continue
+
+            header = {"htype": "array-1.0", "frame": frame_index, "shape": frame_shape, "type": "uint16"}
+            frame_data = get_frame(frame_index)
+
+            if frame_index % 2:
+                header["encoding"] = BITSHUFFLE_ENCODING_STRING
+                frame_data = compress_bitshuffle_chunk(frame_data, 2048)
+
+            frame_dump.append(header, frame_data, frame_index)
+        frame_dump.close(remove=False)
+
+        n_converted = convert_frames([dump_filename], master_filename, output_format="nxmx", frames_per_file=10,
+                                     n_workers=2)
+        self.assertEqual(n_converted, n_frames - 1)
+
+        with h5py.File(master_filename, "r") as file:
+            self.assertEqual(file["/entry"].attrs["NX_class"], b"NXentry")
+
+            dataset = file[dataset_name]
+            self.assertEqual(dataset.shape[0], n_frames)
+
+            for frame_index in range(n_frames):
+                expected_frame = np.zeros(frame_shape) if frame_index == missing_frame else get_frame(frame_index)
+                self.assertTrue(np.array_equal(dataset[frame_index], expected_frame))
+
+        with h5py.File(data_filename_format % 3, "r") as file:
+            dataset = file[dataset_name]
+            self.assertEqual(dataset.shape[0], 5)
+            self.assertEqual(dataset.attrs["image_nr_low"], 21)
+            self.assertEqual(dataset.attrs["image_nr_high"], 25)
+
+    def test_convert_dimage_capture(self):
+        """
+        Test if the frames of a captured Dectris stream are converted, without the dheader and dseries_end messages.
+        """
+        n_frames = 6
+        config = json.dumps({"htype": "dconfig-1.0"}).encode()
+
+        capture_file = FrameDump(dump_filename, file_size=1 << 20)
+        append_message(capture_file, {"htype": "dheader-1.0", "series": 1, "header_detail": "basic"}, [config], 0, 0)
+
+        for frame_index in range(n_frames):
+            image_header = {"htype": "dimage_d-1.0", "shape": frame_shape, "type": "uint16", "encoding": "<"}
+            frame_data = get_frame(frame_index)
+
+            if frame_index % 2:
+                image_header["encoding"] = BITSHUFFLE_ENCODING_STRING
+                frame_data = compress_bitshuffle_chunk(frame_data, 2048)
+
+            append_message(capture_file, {"htype": "dimage-1.0", "series": 1, "frame": frame_index},
+                           [json.dumps(image_header).encode(), frame_data.tobytes(), config], frame_index + 1, 0)
+
+        append_message(capture_file, {"htype": "dseries_end-1.0", "series": 1}, [], n_frames + 1, 0)
+        capture_file.close(remove=False)
+
+        n_converted = convert_frames([dump_filename], master_filename, frames_per_file=4, n_workers=1)
+        self.assertEqual(n_converted, n_frames)
+
+        with h5py.File(master_filename, "r") as file:
+            dataset = file[dataset_name]
+            self.assertEqual(dataset.shape, tuple([n_frames] + frame_shape))
+
+            for frame_index in range(n_frames):
+                self.assertTrue(np.array_equal(dataset[frame_index], get_frame(frame_index)))
+
+    def test_unsupported_encoding(self):
+        """
+        Test if the error of a frame that cannot be converted is raised.
+        """
+        frame_dump = FrameDump(dump_filename, file_size=1 << 20)
+        for frame_index, encoding in enumerate((BITSHUFFLE_ENCODING_STRING, "lz4<")):
+            header = {"htype": "array-1.0", "frame": frame_index, "shape": frame_shape, "type": "uint16",
+                      "encoding": encoding}
+            frame_dump.append(header, compress_bitshuffle_chunk(get_frame(frame_index), 2048), frame_index)
+        frame_dump.close(remove=False)
+
+        for compress in (True, False):
+            with self.assertRaisesRegex(ValueError, "lz4<"):
+                convert_frames([dump_filename], master_filename, n_workers=1, compress=compress)
+
+    def test_convert_raw_frames(self):
+        """
+        Test if raw frames are numbered in the file order.
+        """
+        frames = np.stack([get_frame(frame_index) for frame_index in range(12)])
+        frames.tofile(raw_filename)
+
+        convert_frames([raw_filename], master_filename, input_format="raw", frame_shape=frame_shape, dtype="uint16",
+                       frames_per_file=5, n_workers=1, compress=False)
+
+        with h5py.File(master_filename, "r") as file:
+            self.assertTrue(np.array_equal(file[dataset_name][:], frames))
+
+        self.assertTrue(os.path.exists(data_filename_format % 3))
+        self.assertFalse(os.path.exists(data_filename_format % 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import unittest
+
+import numpy as np
+
+from mflow_processor.utils.frame_dump import FrameDump, read_frame_dump
+
+dump_filename = "ignore_test_output.spill"
+frame_shape = [4, 4]
+
+
+def get_frame(frame_index):
+    header = {"htype": "array-1.0", "frame": frame_index, "shape": frame_shape, "type": "uint16"}
+    return header, np.full(frame_shape, frame_index, dtype="uint16")
+
+
+class FrameDumpTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(dump_filename):
+            os.remove(dump_filename)
+
+    def test_append_and_pop(self):
+        """
+        Test if the frames are read back in order, and the file is reused once all the frames are read.
+        """
+        frame_dump = FrameDump(dump_filename, file_size=1024)
+
+        # Each record takes ~150 bytes, so not all the frames fit in the file.
+        appended = [frame_dump.append(*get_frame(frame_index), frame_index=frame_index) for frame_index in range(10)]
+        n_appended = appended.count(True)
+        self.assertEqual(appended, [True] * n_appended + [False] * (10 - n_appended))
+        self.assertEqual(frame_dump.n_pending, n_appended)
+
+        for frame_index in range(n_appended):
+            message, _ = frame_dump.pop()
+            self.assertEqual(message.get_frame_index(), frame_index)
+            self.assertEqual(message.get_header(), get_frame(frame_index)[0])
+            self.assertEqual(message.get_data(), get_frame(frame_index)[1].tobytes())
+
+        self.assertIsNone(frame_dump.pop())
+        self.assertTrue(frame_dump.append(*get_frame(10), frame_index=10), "Empty file was not reused.")
+
+        frame_dump.close()
+        self.assertFalse(os.path.exists(dump_filename))
+
+    def test_read_frame_dump(self):
+        """
+        Test if the frame records can be read without the in memory index.
+        """
+        frame_dump = FrameDump(dump_filename, file_size=4096)
+        for frame_index in range(5):
+            frame_dump.append(*get_frame(frame_index), frame_index=frame_index)
+        frame_dump.close(remove=False)
+
+        frame_indexes = []
+        for header, frame_data, frame_index in read_frame_dump(dump_filename):
+            self.assertEqual(bytes(frame_data), get_frame(frame_index)[1].tobytes())
+            frame_indexes.append(frame_index)
+
+        self.assertEqual(frame_indexes, list(range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import numpy as np
+
+from mflow_processor.utils.frame_tracker import ReceivedFramesTracker
+
+
+class ReceivedFramesTrackerTest(unittest.TestCase):
+    def test_missing_and_duplicate_frames(self):
+        """
+        Test if the missing frame ranges and the duplicate frames are detected.
+        """
+        tracker = ReceivedFramesTracker(initial_frame_count=8)
+
+        duplicates = [tracker.add_frame(frame_index) for frame_index in [0, 1, 4, 5, 1, 20, 22]]
+
+        self.assertEqual(duplicates, [False, False, False, False, True, False, False])
+        self.assertEqual(tracker.n_frames, 23)
+        self.assertEqual(tracker.n_received, 6)
+        self.assertEqual(tracker.n_missing, 17)
+        self.assertEqual(tracker.get_missing_ranges().tolist(), [[2, 4], [6, 20], [21, 22]])
+
+        expected_mask = np.zeros(23, dtype=bool)
+        expected_mask[[0, 1, 4, 5, 20, 22]] = True
+        self.assertTrue((tracker.get_received_mask() == expected_mask).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import unittest
+
+import h5py
+
+from mflow_processor.utils.h5_utils import DatasetGrowthPolicy, get_file_access_options, DEFAULT_FILE_BLOCK_SIZE
+
+output_file = "ignore_test_output.h5"
+
+
+class DatasetGrowthPolicyTest(unittest.TestCase):
+    def test_geometric_growth(self):
+        """
+        Test if the dataset needs a logarithmic number of resizes.
+        """
+        growth_policy = DatasetGrowthPolicy(initial_frame_count=1000, growth_factor=2, max_increase=10 ** 9)
+
+        dataset_size = growth_policy.get_initial_size()
+        n_resizes = 0
+        while dataset_size < 1000000:
+            dataset_size = growth_policy.get_new_size(dataset_size, dataset_size)
+            n_resizes += 1
+
+        self.assertEqual(n_resizes, 10)
+
+    def test_sparse_jump(self):
+        """
+        Test if a frame far beyond the end of the dataset resizes it exactly to the frame.
+        """
+        growth_policy = DatasetGrowthPolicy(max_increase=1000)
+
+        self.assertEqual(growth_policy.get_new_size(1000, 5000000), 5000001)
+        self.assertEqual(growth_policy.get_new_size(1000, 1000), 2000)
+
+    def test_expected_and_max_frame_count(self):
+        """
+        Test if the expected frame count is used as initial size, and the max frame count limits the size.
+        """
+        self.assertEqual(DatasetGrowthPolicy(expected_frame_count=300).get_initial_size(), 300)
+        self.assertEqual(DatasetGrowthPolicy(expected_frame_count=300, max_frame_count=100).get_initial_size(), 100)
+        self.assertEqual(DatasetGrowthPolicy(max_frame_count=100).get_new_size(60, 60), 100)
+
+
+class FileAccessOptionsTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    def test_option_mapping(self):
+        """
+        Test if the writer options are mapped to the h5py.File arguments.
+        """
+        self.assertDictEqual(get_file_access_options(), {})
+        self.assertDictEqual(get_file_access_options("sec2"), {"driver": "sec2"})
+        self.assertDictEqual(get_file_access_options("core"), {"driver": "core", "backing_store": True})
+        self.assertDictEqual(get_file_access_options("direct"), {"driver": "direct",
+                                                                 "alignment": DEFAULT_FILE_BLOCK_SIZE,
+                                                                 "block_size": DEFAULT_FILE_BLOCK_SIZE})
+
+        self.assertDictEqual(get_file_access_options(alignment=1 << 20, meta_block_size=1 << 16),
+                             {"alignment_interval": 1 << 20, "alignment_threshold": 1 << 20,
+                              "meta_block_size": 1 << 16})
+        self.assertEqual(get_file_access_options(alignment=8192, alignment_threshold=1024)["alignment_threshold"],
+                         1024)
+
+        # The page buffer needs the paged file space strategy, with pages of the alignment size.
+        self.assertDictEqual(get_file_access_options(page_buffer_size=1 << 20),
+                             {"fs_strategy": "page", "fs_page_size": DEFAULT_FILE_BLOCK_SIZE,
+                              "page_buf_size": 1 << 20})
+        self.assertEqual(get_file_access_options(alignment=8192, page_buffer_size=1 << 20)["fs_page_size"], 8192)
+
+    def test_validation(self):
+        """
+        Test if unknown drivers and page buffers smaller than a page are rejected.
+        """
+        self.assertRaises(ValueError, get_file_access_options, "unknown")
+        self.assertRaises(ValueError, get_file_access_options, page_buffer_size=DEFAULT_FILE_BLOCK_SIZE - 1)
+        self.assertRaises(ValueError, get_file_access_options, alignment=8192, page_buffer_size=4096)
+
+        # HDF5 refuses a page buffer without the paged file space strategy.
+        self.assertRaises(OSError, h5py.File, output_file, "w", page_buf_size=1 << 20)
+
+    def test_open_file(self):
+        """
+        Test if a file can be written with the mapped options.
+        """
+        file_options = get_file_access_options("sec2", alignment=8192, meta_block_size=1 << 16,
+                                               page_buffer_size=1 << 16)
+
+        with h5py.File(output_file, "w", **file_options) as file:
+            file.create_dataset("data", data=list(range(100)))
+            # Paged file space strategy.
+            self.assertEqual(file.id.get_create_plist().get_file_space_strategy()[0], h5py.h5f.FSPACE_STRATEGY_PAGE)
+
+        with h5py.File(output_file, "r") as file:
+            self.assertEqual(file["data"][99], 99)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import unittest
+
+import bitshuffle
+import bitshuffle.h5
+import h5py
+import numpy as np
+
+from mflow_processor.lz4_compressor import compress_bitshuffle_chunk, BITSHUFFLE_CHUNK_HEADER
+from mflow_processor.utils.codec_selector import BITSHUFFLE_FILTER
+
+output_file = "ignore_test_output.h5"
+frame_shape = (32, 48)
+
+
+def get_frame(dtype):
+    return (np.arange(np.prod(frame_shape)) % 1000).astype(dtype).reshape(frame_shape)
+
+
+class BitshuffleChunkTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    def test_round_trip(self):
+        """
+        Test if the chunk header holds the frame size and block size in bytes, and the chunk decompresses to the frame.
+        """
+        for dtype in ("uint8", "uint16", "int32", "float64"):
+            for block_size in (256, 2048):
+                frame = get_frame(dtype)
+                chunk = compress_bitshuffle_chunk(frame, block_size)
+
+                self.assertEqual(chunk.dtype, np.uint8)
+
+                n_bytes, block_bytes = BITSHUFFLE_CHUNK_HEADER.unpack_from(chunk)
+                self.assertEqual(n_bytes, frame.nbytes)
+                self.assertEqual(block_bytes, block_size * frame.dtype.itemsize)
+
+                decompressed_frame = bitshuffle.decompress_lz4(chunk[BITSHUFFLE_CHUNK_HEADER.size:], frame_shape,
+                                                               frame.dtype, block_bytes // frame.dtype.itemsize)
+                self.assertTrue((decompressed_frame == frame).all(), "Frame %s, block size %d does not match." %
+                                (dtype, block_size))
+
+    @unittest.skipUnless(hasattr(bitshuffle, "compress_zstd"), "bitshuffle built without zstd.")
+    def test_zstd_round_trip(self):
+        """
+        Test if the zstd chunk decompresses to the frame.
+        """
+        frame = get_frame("uint16")
+        chunk = compress_bitshuffle_chunk(frame, 2048, codec="zstd")
+
+        n_bytes, block_bytes = BITSHUFFLE_CHUNK_HEADER.unpack_from(chunk)
+        self.assertEqual(n_bytes, frame.nbytes)
+
+        decompressed_frame = bitshuffle.decompress_zstd(chunk[BITSHUFFLE_CHUNK_HEADER.size:], frame_shape,
+                                                        frame.dtype, block_bytes // frame.dtype.itemsize)
+        self.assertTrue((decompressed_frame == frame).all())
+
+    def test_h5_filter(self):
+        """
+        Test if the chunk written with write_direct_chunk is read back by the bitshuffle H5 filter.
+        """
+        frame = get_frame("uint16")
+
+        with h5py.File(output_file, "w") as file:
+            dataset = file.create_dataset("data", shape=(2,) + frame_shape, chunks=(1,) + frame_shape, dtype="uint16",
+                                          compression=BITSHUFFLE_FILTER,
+                                          compression_opts=(2048, bitshuffle.h5.H5_COMPRESS_LZ4))
+            dataset.id.write_direct_chunk((1, 0, 0), compress_bitshuffle_chunk(frame, 2048).tobytes())
+
+        with h5py.File(output_file, "r") as file:
+            self.assertTrue((file["data"][1] == frame).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import unittest
+from threading import Thread
+from time import sleep
+
+from mflow_processor.utils.message_queue import BoundedMessageQueue
+
+spill_filename = "ignore_test_output.spill"
+
+
+class BoundedMessageQueueTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(spill_filename):
+            os.remove(spill_filename)
+
+    def test_without_consumer(self):
+        """
+        Test if the queue keeps the latest messages, without counting drops, when no consumer is active.
+        """
+        message_queue = BoundedMessageQueue(5, overflow_policy="block")
+
+        for message in range(10):
+            message_queue.put(message)
+
+        self.assertEqual(message_queue.get_batch(100), [5, 6, 7, 8, 9])
+        self.assertEqual(message_queue.n_dropped, 0)
+
+    def test_drop_oldest(self):
+        """
+        Test if the oldest messages are dropped and counted.
+        """
+        message_queue = BoundedMessageQueue(5, overflow_policy="drop_oldest")
+        message_queue.set_consumer_active(True)
+
+        for message in range(8):
+            message_queue.put(message)
+
+        self.assertEqual(message_queue.get_batch(3), [3, 4, 5])
+        self.assertEqual(message_queue.get_batch(3), [6, 7])
+        self.assertEqual(message_queue.n_dropped, 3)
+
+    def test_block(self):
+        """
+        Test if the producer waits for the consumer, and the consumer is woken up by new messages.
+        """
+        message_queue = BoundedMessageQueue(2, overflow_policy="block")
+        message_queue.set_consumer_active(True)
+        received_messages = []
+
+        def consume():
+            while len(received_messages) < 10:
+                batch = message_queue.get_batch(3)
+                sleep(0.01)
+                received_messages.extend(batch)
+
+        consumer = Thread(target=consume)
+        consumer.start()
+
+        for message in range(10):
+            message_queue.put(message)
+
+        consumer.join(timeout=5)
+
+        self.assertEqual(received_messages, list(range(10)))
+        self.assertEqual(message_queue.n_dropped, 0)
+        self.assertGreater(message_queue.n_blocked, 0)
+
+    def test_spill(self):
+        """
+        Test if the messages are spilled when the queue is full, and read back in order.
+        """
+        message_queue = BoundedMessageQueue(3, overflow_policy="spill", spill_file=spill_filename,
+                                            spill_file_size=1 << 16)
+        message_queue.set_consumer_active(True)
+
+        for message in range(10):
+            message_queue.put({"pulse_id": message})
+
+        self.assertEqual(len(message_queue), 10)
+        self.assertEqual(message_queue.n_spilled, 7)
+
+        received_messages = []
+        while len(message_queue):
+            received_messages.extend(message_queue.get_batch(4))
+
+        self.assertEqual(received_messages, [{"pulse_id": message} for message in range(10)])
+        self.assertEqual(message_queue.n_dropped, 0)
+
+        message_queue.close_spill()
+        self.assertFalse(os.path.exists(spill_filename))
+
+    def test_close(self):
+        """
+        Test if closing the queue wakes up the waiting consumer.
+        """
+        message_queue = BoundedMessageQueue(3)
+        received_batches = []
+
+        consumer = Thread(target=lambda: received_batches.append(message_queue.get_batch(3)))
+        consumer.start()
+
+        message_queue.close()
+        consumer.join(timeout=5)
+
+        self.assertEqual(received_batches, [[]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from mflow_processor.utils.nxmx_utils import create_virtual_data_files_dataset, DATA_DATASET_NAME
+
+output_folder = "ignore_test_output"
+master_filename = os.path.join(output_folder, "experiment_master.h5")
+data_filename = os.path.join(output_folder, "experiment_data_{chunk_number:06d}.h5")
+frame_shape = [4, 4]
+frames_per_file = 3
+
+
+def write_data_file(chunk_number, n_frames):
+    """
+    Write a data file as the H5 writer does, with the frame numbers in the image_nr_low/high attributes.
+    """
+    first_frame = (chunk_number - 1) * frames_per_file
+
+    with h5py.File(data_filename.format(chunk_number=chunk_number), "w") as file:
+        frames = np.arange(first_frame, first_frame + n_frames, dtype="uint16").reshape((n_frames, 1, 1))
+        dataset = file.create_dataset(DATA_DATASET_NAME, data=np.broadcast_to(frames, [n_frames] + frame_shape))
+        dataset.attrs["image_nr_low"] = first_frame + 1
+        dataset.attrs["image_nr_high"] = first_frame + frames_per_file
+
+
+class VirtualDataFilesTest(unittest.TestCase):
+    def setUp(self):
+        os.makedirs(output_folder, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    def test_virtual_data_files_dataset(self):
+        """
+        Test if the frames of all data files can be read from the master file, also from another working directory.
+        """
+        # The last file is incomplete, the second file is missing a frame.
+        for chunk_number, n_frames in ((1, 3), (2, 2), (3, 3), (4, 1)):
+            write_data_file(chunk_number, n_frames)
+
+        data_files = [data_filename.format(chunk_number=chunk_number) for chunk_number in (2, 1, 4, 3)]
+
+        with h5py.File(master_filename, "w") as master_file:
+            self.assertEqual(create_virtual_data_files_dataset(master_file, data_files), 10)
+
+        expected_frames = [0, 1, 2, 3, 4, 0, 6, 7, 8, 9]
+
+        with h5py.File(master_filename, "r") as master_file:
+            dataset = master_file[DATA_DATASET_NAME]
+            self.assertTrue(dataset.is_virtual)
+            self.assertEqual(dataset.shape, tuple([10] + frame_shape))
+            self.assertListEqual(list(dataset[:, 0, 0]), expected_frames)
+
+        # The source files are relative to the master file.
+        master_path = os.path.abspath(master_filename)
+        working_directory = os.getcwd()
+        other_directory = tempfile.mkdtemp()
+
+        try:
+            os.chdir(other_directory)
+
+            with h5py.File(master_path, "r") as master_file:
+                dataset = master_file[DATA_DATASET_NAME]
+                self.assertListEqual(list(dataset[:, 0, 0]), expected_frames)
+                self.assertTrue((dataset[9] == 9).all())
+
+        finally:
+            os.chdir(working_directory)
+            shutil.rmtree(other_directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
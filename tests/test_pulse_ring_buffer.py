@@ -0,0 +1,97 @@
+import unittest
+
+from mflow_processor.utils.pulse_ring_buffer import PulseIdRingBuffer
+
+
+class PulseIdRingBufferTest(unittest.TestCase):
+    def test_get(self):
+        """
+        Test if the messages are found by pulse_id, and missing pulses are not.
+        """
+        ring_buffer = PulseIdRingBuffer(memory_size=1000, initial_slots=8)
+
+        for pulse_id in (100, 101, 103):
+            ring_buffer.put(pulse_id, "message_%d" % pulse_id, 10)
+
+        self.assertEqual(ring_buffer.get(101), "message_101")
+        self.assertEqual(ring_buffer.get(103), "message_103")
+        self.assertIsNone(ring_buffer.get(102))
+        self.assertIsNone(ring_buffer.get(109))
+        self.assertEqual(len(ring_buffer), 3)
+        self.assertEqual(ring_buffer.n_bytes, 30)
+
+    def test_get_messages_from(self):
+        """
+        Test if the messages from a pulse_id on are returned in order, skipping the gaps.
+        """
+        ring_buffer = PulseIdRingBuffer(memory_size=1000, initial_slots=4)
+
+        for pulse_id in (10, 11, 13, 16, 17):
+            ring_buffer.put(pulse_id, pulse_id, 1)
+
+        self.assertEqual(ring_buffer.get_messages_from(12), [13, 16, 17])
+        self.assertEqual(ring_buffer.get_messages_from(0), [10, 11, 13, 16, 17])
+        self.assertEqual(ring_buffer.get_messages_from(18), [])
+
+    def test_memory_size(self):
+        """
+        Test if the oldest messages are evicted when the memory budget is exceeded.
+        """
+        ring_buffer = PulseIdRingBuffer(memory_size=50, initial_slots=4)
+
+        for pulse_id in range(20):
+            ring_buffer.put(pulse_id, pulse_id, 10)
+
+        self.assertEqual(ring_buffer.n_bytes, 50)
+        self.assertEqual(ring_buffer.first_pulse_id, 15)
+        self.assertEqual(ring_buffer.get_messages_from(0), [15, 16, 17, 18, 19])
+
+        # The newest message is kept even if larger than the budget.
+        ring_buffer.put(20, 20, 100)
+        self.assertEqual(ring_buffer.get_messages_from(0), [20])
+
+    def test_pulse_id_reset(self):
+        """
+        Test if a message older than the buffered ones clears the buffer, and is kept.
+        """
+        ring_buffer = PulseIdRingBuffer(memory_size=1000, initial_slots=4)
+
+        for pulse_id in range(100, 110):
+            ring_buffer.put(pulse_id, pulse_id, 10)
+
+        for pulse_id in range(3, 8):
+            ring_buffer.put(pulse_id, pulse_id, 10)
+
+        self.assertEqual(ring_buffer.first_pulse_id, 3)
+        self.assertEqual(ring_buffer.last_pulse_id, 7)
+        self.assertEqual(ring_buffer.n_bytes, 50)
+        self.assertIsNone(ring_buffer.get(100))
+
+        # A job after the reset gets only the messages since the reset.
+        self.assertEqual(ring_buffer.get_messages_from(5), [5, 6, 7])
+
+    def test_max_slots(self):
+        """
+        Test if the ring grows up to max_slots, and then evicts the pulses out of the pulse_id span.
+        """
+        ring_buffer = PulseIdRingBuffer(memory_size=1000, initial_slots=2, max_slots=8)
+
+        ring_buffer.put(0, 0, 1)
+        ring_buffer.put(5, 5, 1)
+        self.assertEqual(ring_buffer.get_messages_from(0), [0, 5])
+
+        ring_buffer.put(10, 10, 1)
+        self.assertEqual(ring_buffer.get_messages_from(0), [5, 10])
+
+        # A jump larger than the ring evicts all the previous messages.
+        ring_buffer.put(100, 100, 1)
+        self.assertEqual(ring_buffer.get_messages_from(0), [100])
+        self.assertEqual(ring_buffer.first_pulse_id, 100)
+
+        ring_buffer.clear()
+        self.assertEqual(len(ring_buffer), 0)
+        self.assertEqual(ring_buffer.get_messages_from(0), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import json
+import os
+import unittest
+from threading import Thread
+
+import bitshuffle
+import numpy as np
+import zmq
+
+from mflow_processor.h5_nxmx_writer import HDF5nxmxWriter
+from mflow_processor.lz4_compressor import LZ4CompressionProcessor, BITSHUFFLE_CHUNK_HEADER, \
+    BITSHUFFLE_ENCODING_STRING
+from mflow_processor.utils.frame_dump import FrameDump
+from mflow_processor.utils.stream_capture import StreamCapture, append_message, replay_to_processor
+
+FORWARDING_ADDRESS = "tcp://127.0.0.1:40001"
+capture_filename = "ignore_test_output.capture"
+master_filename = "ignore_test_output_master.h5"
+frame_shape = [4, 4]
+n_frames = 5
+
+
+class H5WriterClient(object):
+    """
+    Records the commands sent to the H5 writer node.
+    """
+
+    def __init__(self):
+        self.parameters = {}
+
+    def set_parameters(self, parameters):
+        self.parameters.update(parameters)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def receive_messages(n_messages, received_messages):
+    context = zmq.Context()
+    socket = context.socket(zmq.PULL)
+    socket.setsockopt(zmq.RCVTIMEO, 5000)
+    socket.connect(FORWARDING_ADDRESS)
+
+    try:
+        for _ in range(n_messages):
+            received_messages.append(socket.recv_multipart())
+    except zmq.Again:
+        pass
+    finally:
+        socket.close()
+        context.term()
+
+
+class ReplayNodesTest(unittest.TestCase):
+    def tearDown(self):
+        for filename in (capture_filename, master_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def replay_and_receive(self, processor, n_messages):
+        received_messages = []
+        receiving_thread = Thread(target=receive_messages, args=(n_messages, received_messages))
+        receiving_thread.start()
+
+        capture = StreamCapture(capture_filename)
+        replay_to_processor(capture, processor)
+        receiving_thread.join()
+        capture.close()
+
+        return received_messages
+
+    def test_replay_to_compressor(self):
+        """
+        Test if the replayed array messages are decoded, so the compressor can compress them.
+        """
+        capture_file = FrameDump(capture_filename, file_size=1 << 20)
+        for frame_index in range(n_frames):
+            header = {"htype": "array-1.0", "frame": frame_index, "shape": frame_shape, "type": "uint16"}
+            append_message(capture_file, header, [np.full(frame_shape, frame_index, dtype="uint16")], frame_index, 0)
+        capture_file.close(remove=False, truncate=True)
+
+        compressor = LZ4CompressionProcessor()
+        compressor.binding_address = FORWARDING_ADDRESS
+
+        received_messages = self.replay_and_receive(compressor, n_frames)
+        self.assertEqual(len(received_messages), n_frames)
+
+        for frame_index, (header, chunk) in enumerate(received_messages):
+            header = json.loads(header.decode())
+            self.assertEqual(header["encoding"], BITSHUFFLE_ENCODING_STRING)
+
+            _, block_size = BITSHUFFLE_CHUNK_HEADER.unpack_from(chunk)
+            frame = bitshuffle.decompress_lz4(np.frombuffer(chunk[BITSHUFFLE_CHUNK_HEADER.size:], dtype=np.uint8),
+                                              tuple(frame_shape), np.dtype("uint16"), block_size // 2)
+            self.assertTrue((frame == frame_index).all())
+
+    def test_replay_to_nxmx_writer(self):
+        """
+        Test if the replayed dheader is decoded for the NXMX writer, and the images are forwarded raw.
+        """
+        capture_file = FrameDump(capture_filename, file_size=1 << 20)
+        append_message(capture_file, {"htype": "dheader-1.0", "header_detail": "basic"},
+                       [json.dumps({"nimages": n_frames, "ntrigger": 2}).encode()], 0, 0)
+
+        image_header = json.dumps({"htype": "dimage_d-1.0", "shape": frame_shape, "type": "uint16",
+                                   "encoding": "<"}).encode()
+        for frame_index in range(n_frames):
+            frame = np.full(frame_shape, frame_index, dtype="uint16").tobytes()
+            append_message(capture_file, {"htype": "dimage-1.0", "frame": frame_index},
+                           [image_header, frame, b'{"htype": "dconfig-1.0"}'], frame_index + 1, 0)
+        capture_file.close(remove=False, truncate=True)
+
+        nxmx_writer = HDF5nxmxWriter("http://127.0.0.1:41000", "writer")
+        h5_writer_client = H5WriterClient()
+        nxmx_writer._h5_writer_client = h5_writer_client
+        nxmx_writer.filename = master_filename
+        nxmx_writer.binding_address = FORWARDING_ADDRESS
+
+        received_messages = self.replay_and_receive(nxmx_writer, n_frames)
+
+        self.assertEqual(h5_writer_client.parameters["expected_frame_count"], n_frames * 2)
+        self.assertEqual(nxmx_writer.get_statistics()["image_count"], n_frames)
+        # The bytes of all the forwarded parts.
+        self.assertEqual(nxmx_writer.get_statistics()["bytes"],
+                         n_frames * (len(image_header) + 2 * np.prod(frame_shape) + len(b'{"htype": "dconfig-1.0"}')))
+
+        # The images are forwarded with all their parts.
+        self.assertEqual(len(received_messages), n_frames)
+        self.assertEqual(json.loads(received_messages[0][0].decode())["htype"], "dimage-1.0")
+        self.assertEqual(received_messages[2][2], np.full(frame_shape, 2, dtype="uint16").tobytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from time import perf_counter, sleep
+
+from mflow_processor.utils.statistics import ProcessorStatistics, LATENCY_HISTOGRAM_BUCKETS
+
+
+class ProcessorStatisticsTest(unittest.TestCase):
+    def test_stage_timing(self):
+        """
+        Test if the chained stages are timed, and the count, total, average and max time reported.
+        """
+        statistics = ProcessorStatistics()
+
+        for stage_time in (0.002, 0.001, 0.003):
+            stage_start = perf_counter()
+            sleep(stage_time)
+            stage_start = statistics.record_stage("first_stage", stage_start)
+            self.assertLessEqual(stage_start, perf_counter())
+            statistics.record_stage("second_stage", stage_start)
+
+        statistics.add_stage_time("measured_stage", 0.5)
+        statistics.add_stage_time("measured_stage", 1.5)
+
+        stages = statistics.get_statistics()["stages"]
+        self.assertSetEqual(set(stages), {"first_stage", "second_stage", "measured_stage"})
+
+        self.assertEqual(stages["first_stage"]["count"], 3)
+        self.assertGreaterEqual(stages["first_stage"]["total_time"], 0.006)
+        self.assertGreaterEqual(stages["first_stage"]["max_time"], 0.003)
+        self.assertAlmostEqual(stages["first_stage"]["average_time"], stages["first_stage"]["total_time"] / 3)
+        self.assertLess(stages["second_stage"]["max_time"], stages["first_stage"]["max_time"])
+
+        self.assertDictEqual(stages["measured_stage"], {"count": 2, "total_time": 2.0, "average_time": 1.0,
+                                                        "max_time": 1.5})
+
+    def test_frame_counters(self):
+        """
+        Test if the frames, bytes, rates and latency histogram are counted, and cleared by reset.
+        """
+        statistics = ProcessorStatistics()
+
+        empty_statistics = statistics.get_statistics()
+        self.assertEqual(empty_statistics["frames"], 0)
+        self.assertEqual(empty_statistics["frames_per_second"], 0)
+        self.assertEqual(empty_statistics["stages"], {})
+
+        receive_time = perf_counter()
+        statistics.record_frame(receive_time, 100)
+        sleep(0.01)
+        statistics.record_frame(perf_counter(), 300)
+        # Latency of ~1 second.
+        statistics.record_frame(perf_counter() - 1, 600)
+
+        frame_statistics = statistics.get_statistics()
+        self.assertEqual(frame_statistics["frames"], 3)
+        self.assertEqual(frame_statistics["bytes"], 1000)
+
+        # The elapsed time is from the first receive time to the last processed frame.
+        self.assertGreater(frame_statistics["frames_per_second"], 0)
+        self.assertLess(frame_statistics["frames_per_second"], 3 / 0.01)
+        self.assertAlmostEqual(frame_statistics["bytes_per_second"] / frame_statistics["frames_per_second"], 1000 / 3)
+
+        histogram = frame_statistics["latency_histogram"]
+        self.assertListEqual(histogram["bucket_upper_bounds"], LATENCY_HISTOGRAM_BUCKETS)
+        self.assertEqual(len(histogram["counts"]), len(LATENCY_HISTOGRAM_BUCKETS) + 1)
+        self.assertEqual(sum(histogram["counts"]), 3)
+        # The 1 second latency is in the (0.5, 1.05] second bucket.
+        self.assertEqual(histogram["counts"][LATENCY_HISTOGRAM_BUCKETS.index(1e-6 * 2 ** 20)], 1)
+
+        statistics.reset()
+        self.assertEqual(statistics.get_statistics()["frames"], 0)
+        self.assertEqual(statistics.get_statistics()["bytes"], 0)
+        self.assertEqual(sum(statistics.get_statistics()["latency_histogram"]["counts"]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
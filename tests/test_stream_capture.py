@@ -0,0 +1,113 @@
+import json
+import os
+import unittest
+from time import sleep
+
+import numpy as np
+
+from mflow_processor.utils.frame_dump import FrameDump
+from mflow_processor.utils.stream_capture import StreamCapture, append_message, replay_capture, find_saturation_rate, \
+    decode_message
+
+capture_filename = "ignore_test_output.capture"
+frame_shape = [4, 4]
+
+
+def write_capture(n_messages, message_interval):
+    capture_file = FrameDump(capture_filename, file_size=1 << 20)
+
+    for message_number in range(n_messages):
+        header = {"htype": "array-1.0", "frame": message_number, "shape": frame_shape, "type": "uint16"}
+        append_message(capture_file, header, [np.full(frame_shape, message_number, dtype="uint16")], message_number,
+                       message_number * message_interval)
+
+    # Message with more than one data part.
+    append_message(capture_file, {"htype": "bsr_m-1.0", "pulse_id": 10}, [b"main", b"", b"values"], n_messages,
+                   n_messages * message_interval)
+
+    capture_file.close(remove=False, truncate=True)
+
+
+class StreamCaptureTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(capture_filename):
+            os.remove(capture_filename)
+
+    def test_read_capture(self):
+        """
+        Test if the messages are read back with their data parts.
+        """
+        write_capture(10, 0.01)
+        capture = StreamCapture(capture_filename)
+
+        self.assertEqual(len(capture), 11)
+        self.assertEqual(capture.receive_times[3], 0.03)
+
+        header, data_parts, _ = capture.get_message(3)
+        self.assertEqual(header["frame"], 3)
+        self.assertTrue(np.array_equal(np.frombuffer(data_parts[0], dtype="uint16"), np.full(16, 3)))
+
+        header, data_parts, _ = capture.get_message(10)
+        self.assertEqual(header, {"htype": "bsr_m-1.0", "pulse_id": 10})
+        self.assertEqual([bytes(data_part) for data_part in data_parts], [b"main", b"", b"values"])
+
+        del data_parts
+        capture.close()
+
+    def test_replay_rates(self):
+        """
+        Test the original timing of the replay and if a slow receiver is detected as saturated.
+        """
+        write_capture(10, 0.01)
+        capture = StreamCapture(capture_filename)
+        replayed_messages = []
+
+        result = replay_capture(capture, lambda header, data_parts: replayed_messages.append(header),
+                                rate_mode="original", n_messages=22)
+        self.assertEqual(len(replayed_messages), 22)
+        self.assertFalse(result["saturated"])
+        # The capture is repeated with the same interval between messages.
+        self.assertGreaterEqual(result["duration"], 0.21)
+
+        def slow_receiver(header, data_parts):
+            sleep(0.008)
+
+        saturation_rate, results = find_saturation_rate(
+            lambda rate: replay_capture(capture, slow_receiver, rate_mode="fixed", rate=rate), start_rate=50)
+        self.assertEqual(saturation_rate, 100)
+        self.assertTrue(results[-1]["saturated"])
+
+        capture.close()
+
+    def test_decode_message(self):
+        """
+        Test if the messages are decoded as by the mflow receive handlers, and passed undecoded in raw mode.
+        """
+        frame = np.arange(16, dtype="uint16").reshape(frame_shape)
+        header = {"htype": "array-1.0", "frame": 3, "shape": frame_shape, "type": "uint16"}
+
+        message = decode_message(header, [memoryview(frame.tobytes())])
+        self.assertTrue(np.array_equal(message.get_data(), frame))
+        self.assertEqual(message.get_frame_index(), 3)
+
+        message = decode_message(header, [memoryview(frame.tobytes())], receive_raw=True)
+        self.assertEqual(bytes(message.get_data()), frame.tobytes())
+
+        # Compressed frames are not decoded.
+        compressed_header = dict(header, encoding="bs16-lz4<")
+        self.assertEqual(bytes(decode_message(compressed_header, [b"compressed"]).get_data()), b"compressed")
+
+        image_header = {"htype": "dimage_d-1.0", "shape": frame_shape, "type": "uint16", "encoding": "<"}
+        data_parts = [json.dumps(image_header).encode(), frame.tobytes(), b"{}"]
+        message = decode_message({"htype": "dimage-1.0", "frame": 5}, data_parts)
+        self.assertTrue(np.array_equal(message.get_data(), frame))
+        self.assertEqual(message.get_frame_size(), frame_shape)
+        self.assertEqual(message.raw_message["data"], data_parts)
+
+        message = decode_message({"htype": "dheader-1.0", "header_detail": "basic"}, [b'{"nimages": 10}'])
+        self.assertEqual(message.get_data(), {"nimages": 10})
+        self.assertEqual(message.htype, "dheader-1.0")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,311 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from argparse import ArgumentParser
+from itertools import product
+from time import perf_counter
+
+import numpy as np
+from bitshuffle.h5 import H5_COMPRESS_LZ4
+
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.h5_nxmx_writer import HDF5nxmxWriter
+from mflow_processor.lz4_compressor import LZ4CompressionProcessor, compress_bitshuffle_chunk
+from mflow_processor.utils import writer_plugins
+from mflow_processor.utils.frame_message import FrameMessage
+
+DATASET_NAME = "entry/data/data"
+BITSHUFFLE_LZ4_COMPRESSION = {"compression": 32008,
+                              "compression_opts": (2048, H5_COMPRESS_LZ4)}
+# Number of different frames in the synthetic stream.
+N_DISTINCT_FRAMES = 4
+# Writer file access options to compare.
+WRITER_FILE_OPTIONS = {"default": {},
+                       "aligned": {"h5_alignment": 4096},
+                       "aligned_meta_block": {"h5_alignment": 4096, "h5_meta_block_size": 1 << 20},
+                       "page_buffer": {"h5_alignment": 4096, "h5_page_buffer_size": 16 << 20},
+                       "core": {"h5_driver": "core"}}
+# Address the forwarding processors bind to, before their forwarder is replaced by an in-process one.
+INPROC_BINDING_ADDRESS = "inproc://benchmark"
+
+
+class InProcessForwarder(object):
+    """
+    Replacement for the MFlowForwarder, passing the forwarded messages to a function instead of the network.
+    """
+
+    def __init__(self, receive_function=None):
+        self._receive_function = receive_function
+        self.stream = self
+        self.socket = self
+        self.bytes_forwarded = 0
+
+    def send(self, data, send_more=False, block=True, copy=True):
+        self.bytes_forwarded += len(data) if isinstance(data, bytes) else data.nbytes
+
+    def forward(self, message):
+        if self._receive_function:
+            self._receive_function(message)
+
+    def stop(self):
+        pass
+
+
+class LocalWriterClient(object):
+    """
+    Replacement for the writer NodeClient, controlling a writer in the same process.
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def set_parameters(self, parameters):
+        for name, value in parameters.items():
+            setattr(self._writer, name, value)
+
+    def start(self):
+        self._writer.start()
+
+    def stop(self):
+        self._writer.stop()
+
+
+def generate_messages(n_frames, frame_shape, dtype, compressed=False, htype="array-1.0"):
+    """
+    Generate a synthetic stream of messages. The frame data is shared between messages.
+    :return: List of messages.
+    """
+    random_generator = np.random.RandomState(0)
+    frames = [random_generator.randint(0, 1000, size=frame_shape).astype(dtype) for _ in range(N_DISTINCT_FRAMES)]
+
+    if compressed:
+        frames_data = [compress_bitshuffle_chunk(frame, 2048).tobytes() for frame in frames]
+    else:
+        frames_data = [frame.tobytes() for frame in frames]
+
+    messages = []
+    for frame_index in range(n_frames):
+        header = {"htype": htype, "frame": frame_index, "shape": list(frame_shape), "type": dtype,
+                  "pulse_id": frame_index, "is_good_frame": 1}
+        frame_data = frames_data[frame_index % N_DISTINCT_FRAMES]
+        message = FrameMessage(header, frame_data)
+        # Forwarding processors pass on the raw message, as received by the mflow raw handler.
+        message.raw_message = {"header": header, "data": [frame_data]}
+        messages.append(message)
+
+    return messages, frames
+
+
+def run_messages(processor, messages):
+    """
+    Pass the messages to the processor and stop it.
+    :return: Elapsed time in seconds.
+    """
+    start_time = perf_counter()
+
+    for message in messages:
+        processor.process_message(message)
+    processor.stop()
+
+    return perf_counter() - start_time
+
+
+def benchmark_writer(output_folder, n_frames, frame_shape, dtype, compression, frames_per_file, plugins,
+                     writer_parameters=None):
+    messages, _ = generate_messages(n_frames, frame_shape, dtype, compressed=compression)
+
+    writer_plugin_list = []
+    if plugins:
+        writer_plugin_list = [writer_plugins.write_frame_index_to_dataset("entry/data/frame_index"),
+                              writer_plugins.write_header_parameters_to_dataset("entry/metadata")]
+
+    writer = HDF5ChunkedWriterProcessor(plugins=writer_plugin_list)
+    writer.dataset_name = DATASET_NAME
+    writer.output_file = os.path.join(output_folder, "writer_{chunk_number:06d}.h5")
+    writer.frames_per_file = frames_per_file
+
+    if compression:
+        writer.compression = BITSHUFFLE_LZ4_COMPRESSION["compression"]
+        writer.compression_opts = BITSHUFFLE_LZ4_COMPRESSION["compression_opts"]
+
+    for name, value in (writer_parameters or {}).items():
+        setattr(writer, name, value)
+
+    writer.start()
+    elapsed_time = run_messages(writer, messages)
+
+    return elapsed_time, writer.get_statistics()
+
+
+def benchmark_compressor(n_frames, frame_shape, dtype, n_workers):
+    messages, frames = generate_messages(n_frames, frame_shape, dtype)
+    # The compressor receives the frames as arrays.
+    for message, frame in zip(messages, frames * (n_frames // N_DISTINCT_FRAMES + 1)):
+        message._data = frame
+
+    compressor = LZ4CompressionProcessor()
+    compressor.binding_address = INPROC_BINDING_ADDRESS
+    compressor.n_workers = n_workers
+
+    compressor.start()
+    compressor._zmq_forwarder.stop()
+    compressor._zmq_forwarder = InProcessForwarder()
+
+    elapsed_time = run_messages(compressor, messages)
+
+    return elapsed_time, compressor.get_statistics()
+
+
+def benchmark_nxmx(output_folder, n_frames, frame_shape, dtype, frames_per_file):
+    messages, _ = generate_messages(n_frames, frame_shape, dtype, htype="dimage-1.0")
+    header_message = FrameMessage({"htype": "dheader-1.0", "frame": 0, "shape": [], "type": dtype},
+                                  {"nimages": n_frames, "beam_center_x": 1.0, "beam_center_y": 1.0})
+
+    data_writer = HDF5ChunkedWriterProcessor()
+    nxmx_writer = HDF5nxmxWriter(h5_writer_control_address=None, h5_writer_instance_name=None)
+    nxmx_writer._h5_writer_client = LocalWriterClient(data_writer)
+    nxmx_writer.filename = os.path.join(output_folder, "nxmx_master.h5")
+    nxmx_writer.binding_address = INPROC_BINDING_ADDRESS
+    nxmx_writer.frames_per_file = frames_per_file
+
+    def receive_forwarded_message(raw_message):
+        data_writer.process_message(FrameMessage(raw_message["header"], raw_message["data"][0]))
+
+    nxmx_writer.start()
+    nxmx_writer._zmq_forwarder.stop()
+    nxmx_writer._zmq_forwarder = InProcessForwarder(receive_forwarded_message)
+
+    nxmx_writer.process_message(header_message)
+    elapsed_time = run_messages(nxmx_writer, messages)
+
+    return elapsed_time, nxmx_writer.get_statistics()
+
+
+def get_benchmarks(input_args):
+    """
+    Get the benchmark matrix.
+    :return: List of (name, function, kwargs).
+    """
+    benchmarks = []
+
+    for frame_size, dtype in product(input_args.frame_sizes, input_args.dtypes):
+        frame_shape = [frame_size, frame_size]
+        frame_name = "%dx%d/%s" % (frame_size, frame_size, dtype)
+
+        for compression, frames_per_file, plugins in product([False, True], [None, input_args.frames_per_file],
+                                                             [False, True]):
+            name = "writer/%s/%s/fpf=%s/%s" % (frame_name, "lz4" if compression else "raw", frames_per_file,
+                                               "plugins" if plugins else "no_plugins")
+            benchmarks.append((name, benchmark_writer, {"frame_shape": frame_shape, "dtype": dtype,
+                                                        "compression": compression,
+                                                        "frames_per_file": frames_per_file,
+                                                        "plugins": plugins}))
+
+        for options_name, writer_parameters in sorted(WRITER_FILE_OPTIONS.items()):
+            benchmarks.append(("writer_file_options/%s/%s" % (frame_name, options_name), benchmark_writer,
+                               {"frame_shape": frame_shape, "dtype": dtype, "compression": False,
+                                "frames_per_file": input_args.frames_per_file, "plugins": False,
+                                "writer_parameters": writer_parameters}))
+
+        for n_workers in sorted({1, input_args.n_workers}):
+            benchmarks.append(("compressor/%s/workers=%d" % (frame_name, n_workers), benchmark_compressor,
+                               {"frame_shape": frame_shape, "dtype": dtype, "n_workers": n_workers}))
+
+        benchmarks.append(("nxmx/%s/fpf=%d" % (frame_name, input_args.frames_per_file), benchmark_nxmx,
+                           {"frame_shape": frame_shape, "dtype": dtype,
+                            "frames_per_file": input_args.frames_per_file}))
+
+    return [benchmark for benchmark in benchmarks if input_args.filter in benchmark[0]]
+
+
+def run_benchmark(benchmark_function, kwargs, n_frames, repeat):
+    """
+    Run the benchmark multiple times and return the result of the fastest run.
+    """
+    best_result = None
+
+    for _ in range(repeat):
+        output_folder = tempfile.mkdtemp(prefix="mflow_benchmark_")
+
+        try:
+            # Only the compressor does not write files.
+            benchmark_kwargs = kwargs
+            if benchmark_function is not benchmark_compressor:
+                benchmark_kwargs = dict(kwargs, output_folder=output_folder)
+
+            elapsed_time, statistics = benchmark_function(n_frames=n_frames, **benchmark_kwargs)
+        finally:
+            shutil.rmtree(output_folder, ignore_errors=True)
+
+        if best_result is None or elapsed_time < best_result[0]:
+            best_result = (elapsed_time, statistics)
+
+    elapsed_time, statistics = best_result
+    frame_bytes = int(np.prod(kwargs["frame_shape"])) * np.dtype(kwargs["dtype"]).itemsize
+
+    return {"frames": n_frames,
+            "seconds": elapsed_time,
+            "frames_per_second": n_frames / elapsed_time,
+            "megabytes_per_second": n_frames * frame_bytes / elapsed_time / 1e6,
+            "stages": statistics.get("stages", {})}
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compare the results with the baseline results.
+    :return: List of (name, baseline_frames_per_second, frames_per_second) for the regressed benchmarks.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        baseline_frames_per_second = baseline[name]["frames_per_second"]
+        if result["frames_per_second"] < baseline_frames_per_second * (1 - tolerance):
+            regressions.append((name, baseline_frames_per_second, result["frames_per_second"]))
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the writer, compressor and NXMX processors.")
+    parser.add_argument("--output", type=str, help="File to write the JSON results to.")
+    parser.add_argument("--baseline", type=str, help="JSON results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown against the baseline.")
+    parser.add_argument("--n_frames", type=int, default=500, help="Number of frames in each benchmark.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each benchmark (best is used).")
+    parser.add_argument("--frame_sizes", type=int, nargs="+", default=[256, 1024],
+                        help="Number of pixels in each frame dimension.")
+    parser.add_argument("--dtypes", type=str, nargs="+", default=["uint16", "int32"], help="Frame data types.")
+    parser.add_argument("--frames_per_file", type=int, default=100, help="Frames per file for roll over benchmarks.")
+    parser.add_argument("--n_workers", type=int, default=4, help="Compressor workers for parallel benchmarks.")
+    parser.add_argument("--filter", type=str, default="", help="Run only benchmarks containing this string.")
+    input_args = parser.parse_args()
+
+    results = {}
+    for name, benchmark_function, kwargs in get_benchmarks(input_args):
+        results[name] = run_benchmark(benchmark_function, kwargs, input_args.n_frames, input_args.repeat)
+        print("%-60s %10.1f frames/s %10.1f MB/s" % (name, results[name]["frames_per_second"],
+                                                   results[name]["megabytes_per_second"]))
+
+    if input_args.output:
+        with open(input_args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if input_args.baseline:
+        with open(input_args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = compare_with_baseline(results, baseline, input_args.tolerance)
+        for name, baseline_frames_per_second, frames_per_second in regressions:
+            print("REGRESSION %s: %.1f -> %.1f frames/s" % (name, baseline_frames_per_second, frames_per_second))
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,11 @@ import unittest
 from time import sleep
 
 import h5py
+import numpy as np
 
 from mflow_nodes.test_tools.m_generate_test_stream import generate_test_array_stream
 from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.utils.frame_message import FrameMessage
 from tests.helpers import setup_writer, default_output_file, default_dataset_name, \
     default_number_of_frames, default_frame_shape
 
@@ -44,5 +46,32 @@ class TransferTest(unittest.TestCase):
         dataset = file[default_dataset_name]
 
 
+class ExpectedFrameCountTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(default_output_file):
+            os.remove(default_output_file)
+
+    def test_reset_on_stop(self):
+        """
+        Test if the expected frame count of an acquisition does not size the dataset of the next one.
+        """
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = default_dataset_name
+        writer.output_file = default_output_file
+
+        for expected_frame_count in (5, None):
+            writer.expected_frame_count = expected_frame_count
+            writer.start()
+
+            header = {"frame": 0, "shape": list(default_frame_shape), "type": "int32"}
+            writer.process_message(FrameMessage(header, np.zeros(default_frame_shape, dtype="int32")))
+
+            # The dataset is compacted only on stop.
+            self.assertEqual(writer._dataset.shape[0], expected_frame_count or 1000)
+
+            writer.stop()
+            self.assertIsNone(writer.expected_frame_count)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,124 @@
+import os
+import unittest
+from threading import Event
+from time import sleep
+
+import h5py
+import numpy as np
+
+from mflow_nodes.test_tools.m_generate_test_stream import generate_test_array_stream, generate_frame_data
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.utils.frame_message import FrameMessage
+from tests.helpers import setup_writer, cleanup_writer, default_frame_shape, \
+    default_number_of_frames, default_output_file, default_dataset_name
+
+
+class AsyncTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(),
+                                          parameters={"async_write": True,
+                                                      "async_queue_size": 4})
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node)
+
+    def test_async_write(self):
+        """
+        Test if the async writer drains the queue before closing the file.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        file = h5py.File(default_output_file, 'r')
+        dataset = file[default_dataset_name]
+
+        self.assertEqual(dataset.shape, (default_number_of_frames,) + default_frame_shape, "Dataset of incorrect size.")
+
+        for frame_number in range(default_number_of_frames):
+            self.assertTrue((dataset[frame_number] ==
+                             generate_frame_data(default_frame_shape, frame_number)).all(),
+                            "Dataset data does not match original data for frame %d." % frame_number)
+
+
+class SpillTest(unittest.TestCase):
+    def setUp(self):
+        self.output_file = "ignore_test_output_{chunk_number:02d}.h5"
+        self.spill_file = "ignore_test_output.spill"
+        self.output_files = [self.output_file.format(chunk_number=chunk_number) for chunk_number in range(1, 31)]
+
+    def tearDown(self):
+        for filename in self.output_files + [self.spill_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_spill_order(self):
+        """
+        Test if the spilled frames are written in the received order, so the files are not reopened and are the
+        same as without spilling.
+        """
+        n_frames = 300
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = default_dataset_name
+        writer.output_file = self.output_file
+        writer.frames_per_file = 10
+        writer.frames_per_chunk = 2
+        writer.async_write = True
+        writer.async_queue_size = 4
+        writer.async_overflow_policy = "spill"
+        writer.spill_file = self.spill_file
+        writer.spill_file_size = 1 << 20
+
+        # The writing is stalled at the start, and then slower than the stream.
+        writing_allowed = Event()
+        write_message = writer._write_message
+
+        def slow_write_message(message, receive_time):
+            writing_allowed.wait()
+            sleep(0.0002)
+            write_message(message, receive_time)
+
+        writer._write_message = slow_write_message
+
+        opened_files = []
+        open_file = writer._open_file
+
+        def count_open_file(frame_size, dtype, frame_chunk, reopen=False):
+            opened_files.append(frame_chunk)
+            return open_file(frame_size, dtype, frame_chunk, reopen)
+
+        writer._open_file = count_open_file
+
+        writer.start()
+
+        for frame_index in range(n_frames):
+            header = {"frame": frame_index, "shape": list(default_frame_shape), "type": "int32"}
+            writer.process_message(FrameMessage(header, np.full(default_frame_shape, frame_index, dtype="int32")))
+
+            if frame_index == 20:
+                writing_allowed.set()
+            sleep(0.0001)
+
+        writer.stop()
+
+        statistics = writer.get_statistics()
+        self.assertGreater(statistics["spilled_frames"], 0)
+        self.assertEqual(statistics["dropped_frames"], 0)
+
+        # Each file is opened once.
+        self.assertListEqual(opened_files, list(range(1, 31)))
+
+        for file_index, filename in enumerate(self.output_files):
+            with h5py.File(filename, "r") as file:
+                first_frame = file_index * 10
+                self.assertListEqual(list(file[default_dataset_name][:, 0, 0]),
+                                     list(range(first_frame, first_frame + 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
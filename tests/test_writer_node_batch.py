@@ -0,0 +1,47 @@
+import unittest
+from time import sleep
+
+import h5py
+
+from mflow_nodes.test_tools.m_generate_test_stream import generate_test_array_stream, generate_frame_data
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from tests.helpers import setup_writer, cleanup_writer, default_frame_shape, \
+    default_number_of_frames, default_output_file, default_dataset_name
+
+batch_frames = 5
+
+
+class BatchWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(),
+                                          parameters={"batch_frames": batch_frames})
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node)
+
+    def test_batch_write(self):
+        """
+        Test if the frames are written in batches, including the incomplete last batch.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        file = h5py.File(default_output_file, 'r')
+        dataset = file[default_dataset_name]
+
+        self.assertEqual(dataset.shape, (default_number_of_frames,) + default_frame_shape, "Dataset of incorrect size.")
+
+        for frame_number in range(default_number_of_frames):
+            self.assertTrue((dataset[frame_number] ==
+                             generate_frame_data(default_frame_shape, frame_number)).all(),
+                            "Dataset data does not match original data for frame %d." % frame_number)
+
+
+if __name__ == '__main__':
+    unittest.main()
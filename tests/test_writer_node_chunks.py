@@ -0,0 +1,87 @@
+import os
+import unittest
+from time import sleep
+
+import h5py
+import numpy as np
+
+from mflow_nodes.test_tools.m_generate_test_stream import generate_test_array_stream, generate_frame_data
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.utils.frame_message import FrameMessage
+from tests.helpers import setup_writer, cleanup_writer, default_frame_shape, \
+    default_number_of_frames, default_output_file, default_dataset_name
+
+frames_per_chunk = 5
+
+
+class MultiFrameChunkTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(),
+                                          parameters={"frames_per_chunk": frames_per_chunk})
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node)
+
+    def test_multi_frame_chunks(self):
+        """
+        Test if multiple frames are stored in each chunk, including the incomplete last chunk.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        file = h5py.File(default_output_file, 'r')
+        dataset = file[default_dataset_name]
+
+        self.assertEqual(dataset.chunks, (frames_per_chunk,) + default_frame_shape, "Incorrect chunk layout.")
+        self.assertEqual(dataset.shape, (default_number_of_frames,) + default_frame_shape, "Dataset of incorrect size.")
+
+        for frame_number in range(default_number_of_frames):
+            self.assertTrue((dataset[frame_number] ==
+                             generate_frame_data(default_frame_shape, frame_number)).all(),
+                            "Dataset data does not match original data for frame %d." % frame_number)
+
+
+class LateFrameChunkTest(unittest.TestCase):
+    def setUp(self):
+        self.output_file = "ignore_test_output_{chunk_number:02d}.h5"
+        self.output_files = [self.output_file.format(chunk_number=chunk_number) for chunk_number in (1, 2)]
+
+    def tearDown(self):
+        for filename in self.output_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_late_frames(self):
+        """
+        Test if late frames added to a reopened file do not replace the frames already in their chunk.
+        """
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = default_dataset_name
+        writer.output_file = self.output_file
+        writer.frames_per_file = 10
+        writer.frames_per_chunk = 4
+
+        writer.start()
+
+        # Frame 3 arrives after file 1 was closed, frame 19 after the end of the stream.
+        for frame_index in [0, 1, 2] + list(range(4, 19)) + [3, 19]:
+            header = {"frame": frame_index, "shape": list(default_frame_shape), "type": "int32"}
+            writer.process_message(FrameMessage(header, np.full(default_frame_shape, frame_index, dtype="int32")))
+
+        writer.stop()
+
+        for file_index, filename in enumerate(self.output_files):
+            with h5py.File(filename, "r") as file:
+                first_frame = file_index * 10
+                self.assertListEqual(list(file[default_dataset_name][:, 0, 0]),
+                                     list(range(first_frame, first_frame + 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import unittest
+
+import h5py
+import numpy as np
+from bitshuffle.h5 import H5_COMPRESS_LZ4
+
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.lz4_compressor import compress_bitshuffle_chunk
+from mflow_processor.utils.codec_selector import BITSHUFFLE_FILTER, UNCOMPRESSED_ENCODING_STRING
+from mflow_processor.utils.frame_message import FrameMessage
+
+output_file = "ignore_test_output.h5"
+dataset_name = "entry/dataset/data"
+frame_shape = (8, 8)
+
+
+def get_message(frame_index, codec):
+    frame = np.full(frame_shape, frame_index, dtype="uint16")
+    header = {"frame": frame_index, "shape": list(frame_shape), "type": "uint16"}
+
+    if codec == "none":
+        header["encoding"] = UNCOMPRESSED_ENCODING_STRING
+        return FrameMessage(header, frame)
+
+    header["encoding"] = "bs16-%s<" % codec
+    return FrameMessage(header, compress_bitshuffle_chunk(frame, 2048, codec))
+
+
+class FrameEncodingTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+    def test_mismatched_encoding(self):
+        """
+        Test if frames with a codec other than the dataset filter are dropped, and the others written.
+        """
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = dataset_name
+        writer.output_file = output_file
+        writer.compression = BITSHUFFLE_FILTER
+        writer.compression_opts = (2048, H5_COMPRESS_LZ4)
+
+        writer.start()
+
+        codecs = ["lz4", "none", "zstd", "lz4"]
+        for frame_index, codec in enumerate(codecs):
+            writer.process_message(get_message(frame_index, codec))
+
+        self.assertEqual(writer.get_statistics()["rejected_frames"], 1)
+
+        writer.stop()
+
+        with h5py.File(output_file, "r") as file:
+            self.assertListEqual(list(file[dataset_name][:, 0, 0]), [0, 1, 0, 3])
+
+    def test_uncompressed_dataset(self):
+        """
+        Test if compressed frames are not written to a dataset without compression filter.
+        """
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = dataset_name
+        writer.output_file = output_file
+
+        writer.start()
+
+        writer.process_message(get_message(0, "none"))
+        writer.process_message(get_message(1, "lz4"))
+
+        self.assertEqual(writer.get_statistics()["rejected_frames"], 1)
+
+        writer.stop()
+
+        with h5py.File(output_file, "r") as file:
+            self.assertEqual(file[dataset_name].shape[0], 1)
+            self.assertEqual(file[dataset_name][0, 0, 0], 0)
+
+    def test_multi_frame_chunks(self):
+        """
+        Test if compressed frames are not staged into multi frame chunks, which are compressed by HDF5.
+        """
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = dataset_name
+        writer.output_file = output_file
+        writer.compression = BITSHUFFLE_FILTER
+        writer.compression_opts = (2048, H5_COMPRESS_LZ4)
+        writer.frames_per_chunk = 2
+
+        writer.start()
+
+        codecs = ["none", "lz4", "none", "none"]
+        for frame_index, codec in enumerate(codecs):
+            writer.process_message(get_message(frame_index, codec))
+
+        self.assertEqual(writer.get_statistics()["rejected_frames"], 1)
+
+        writer.stop()
+
+        with h5py.File(output_file, "r") as file:
+            self.assertEqual(file[dataset_name].chunks, (2,) + frame_shape)
+            self.assertListEqual(list(file[dataset_name][:, 0, 0]), [0, 0, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
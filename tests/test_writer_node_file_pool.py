@@ -0,0 +1,111 @@
+import os
+import unittest
+from time import sleep
+
+import h5py
+import numpy as np
+
+from mflow_nodes.test_tools.m_generate_test_stream import generate_test_array_stream, generate_frame_data
+from mflow_processor.h5_chunked_writer import HDF5ChunkedWriterProcessor
+from mflow_processor.utils.frame_message import FrameMessage
+from tests.helpers import setup_writer, cleanup_writer, default_frame_shape, \
+    default_number_of_frames, default_dataset_name
+
+frames_per_file = 5
+file_pool_size = 2
+output_file = "ignore_test_output_{chunk_number:02d}.h5"
+
+
+class FilePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(),
+                                          parameters={"output_file": output_file,
+                                                      "frames_per_file": frames_per_file,
+                                                      "file_pool_size": file_pool_size})
+
+        n_files = (default_number_of_frames + frames_per_file - 1) // frames_per_file
+        self.output_files = [output_file.format(chunk_number=chunk_number) for chunk_number in range(1, n_files + 1)]
+        self.unused_files = [output_file.format(chunk_number=chunk_number) for chunk_number in
+                             range(n_files + 1, n_files + 1 + file_pool_size)]
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node, self.output_files + self.unused_files)
+
+    def test_file_pool(self):
+        """
+        Test if the files created ahead and closed in the background are complete, and the unused ones removed.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        for file_index, filename in enumerate(self.output_files):
+            file = h5py.File(filename, 'r')
+            dataset = file[default_dataset_name]
+
+            first_frame = file_index * frames_per_file
+            self.assertEqual(dataset.attrs["image_nr_low"], first_frame + 1)
+
+            for frame_number in range(first_frame, min(first_frame + frames_per_file, default_number_of_frames)):
+                self.assertTrue((dataset[frame_number - first_frame] ==
+                                 generate_frame_data(default_frame_shape, frame_number)).all(),
+                                "Dataset data does not match original data for frame %d." % frame_number)
+            file.close()
+
+        for filename in self.unused_files:
+            self.assertFalse(os.path.exists(filename), "File '%s' created ahead was not removed." % filename)
+
+
+class OutOfOrderFilePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.output_files = [output_file.format(chunk_number=chunk_number) for chunk_number in range(1, 10)]
+
+    def tearDown(self):
+        for filename in self.output_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_out_of_order_frames(self):
+        """
+        Test if frames out of order across the file boundaries do not truncate the files already written.
+        """
+        n_frames = 25
+        writer = HDF5ChunkedWriterProcessor()
+        writer.dataset_name = default_dataset_name
+        writer.output_file = output_file
+        writer.frames_per_file = frames_per_file
+        writer.file_pool_size = file_pool_size
+        writer.write_received_mask = True
+
+        writer.start()
+
+        # Files 1, 3, 2 (files created ahead already written), then late frames of files 1 and 3 and a random order.
+        frame_indexes = list(range(0, 4)) + list(range(10, 14)) + list(range(5, 10)) + [4, 14] + \
+            list(np.random.RandomState(0).permutation(range(15, n_frames)))
+
+        for frame_index in frame_indexes:
+            header = {"frame": int(frame_index), "shape": list(default_frame_shape), "type": "int32"}
+            writer.process_message(FrameMessage(header, np.full(default_frame_shape, frame_index, dtype="int32")))
+
+        writer.stop()
+
+        for file_index, filename in enumerate(self.output_files[:n_frames // frames_per_file]):
+            with h5py.File(filename, "r") as file:
+                first_frame = file_index * frames_per_file
+
+                self.assertListEqual(list(file[default_dataset_name][:, 0, 0]),
+                                     list(range(first_frame, first_frame + frames_per_file)))
+                self.assertTrue(file["entry/dataset/received_mask"][:].all())
+
+        # Only the files created ahead and not used are removed.
+        for filename in self.output_files[n_frames // frames_per_file:]:
+            self.assertFalse(os.path.exists(filename), "File '%s' created ahead was not removed." % filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,9 @@ from tests.helpers import setup_writer, cleanup_writer, default_frame_shape, \
     default_number_of_frames, default_output_file
 
 frame_index_dataset_name = "group1/group2/dataset"
+metadata_group_name = "group1/metadata"
+roll_over_output_file = "ignore_test_output_{chunk_number:02d}.h5"
+roll_over_frames_per_file = 5
 
 
 class PluginTransferTest(unittest.TestCase):
@@ -43,5 +46,103 @@ class PluginTransferTest(unittest.TestCase):
                         "Plugin did not populate frame number correctly.")
 
 
+class HeaderParametersPluginTest(unittest.TestCase):
+    def setUp(self):
+        plugins = [writer_plugins.write_header_parameters_to_dataset(metadata_group_name)]
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(plugins=plugins))
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node)
+
+    def test_header_parameters_plugin(self):
+        """
+        Test if the header parameters are stored in typed datasets, one row per frame.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        file = h5py.File(default_output_file, 'r')
+        frame_dataset = file[metadata_group_name + "/frame"]
+
+        self.assertEqual(frame_dataset.shape, (default_number_of_frames,))
+        self.assertEqual(frame_dataset.dtype.kind, "i")
+        self.assertTrue((frame_dataset[:] == np.arange(0, default_number_of_frames)).all(),
+                        "Plugin did not populate the header parameter correctly.")
+        self.assertNotIn(metadata_group_name + "/shape", file, "Array header parameters should not be stored.")
+
+
+class StreamingMetadataPluginTest(unittest.TestCase):
+    def setUp(self):
+        plugins = [writer_plugins.write_frame_index_to_dataset(frame_index_dataset_name)]
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(plugins=plugins),
+                                          parameters={"metadata_flush_frames": 5})
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node)
+
+    def test_streaming_metadata(self):
+        """
+        Test if the metadata flushed during the acquisition is complete.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        file = h5py.File(default_output_file, 'r')
+        frame_index_dataset = file[frame_index_dataset_name]
+
+        # The streamed dataset is extendable.
+        self.assertEqual(frame_index_dataset.maxshape, (None,))
+        self.assertTrue((frame_index_dataset[:] == np.arange(0, default_number_of_frames)).all(),
+                        "Streamed metadata does not contain all frame numbers.")
+
+
+class RollOverMetadataPluginTest(unittest.TestCase):
+    def setUp(self):
+        plugins = [writer_plugins.write_frame_index_to_dataset(frame_index_dataset_name)]
+        self.receiver_node = setup_writer(processor=HDF5ChunkedWriterProcessor(plugins=plugins),
+                                          parameters={"output_file": roll_over_output_file,
+                                                      "frames_per_file": roll_over_frames_per_file})
+
+        self.output_files = [roll_over_output_file.format(chunk_number=chunk_number) for chunk_number in
+                             range(1, default_number_of_frames // roll_over_frames_per_file + 2)]
+
+    def tearDown(self):
+        cleanup_writer(self.receiver_node, self.output_files)
+
+    def test_roll_over_metadata(self):
+        """
+        Test if each file gets only the metadata of its own frames.
+        """
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the file to be written.
+        sleep(0.5)
+
+        for file_index, output_file in enumerate(self.output_files):
+            first_frame = file_index * roll_over_frames_per_file
+            last_frame = min(first_frame + roll_over_frames_per_file, default_number_of_frames)
+
+            file = h5py.File(output_file, 'r')
+            self.assertTrue((file[frame_index_dataset_name][:] == np.arange(first_frame, last_frame)).all(),
+                            "File '%s' does not contain only its own frame numbers." % output_file)
+            file.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+import os
+import unittest
+from time import sleep
+
+import h5py
+import numpy as np
+
+from mflow_nodes.test_tools.m_generate_test_stream import generate_test_array_stream, generate_frame_data
+from mflow_processor.h5_sharded_writer import HDF5ShardedWriterProcessor
+from mflow_processor.utils.frame_message import FrameMessage
+from tests.helpers import setup_writer, cleanup_writer, default_frame_shape, \
+    default_number_of_frames, default_output_file, default_dataset_name
+
+n_shards = 3
+shard_files = ["ignore_test_output_shard_%02d.h5" % shard_number for shard_number in range(n_shards)]
+
+
+class ShardedTransferTest(unittest.TestCase):
+    def tearDown(self):
+        cleanup_writer(self.receiver_node, list(shard_files))
+
+    def _test_sharded_write(self, shard_mode):
+        self.receiver_node = setup_writer(processor=HDF5ShardedWriterProcessor(),
+                                          parameters={"n_shards": n_shards,
+                                                      "shard_mode": shard_mode,
+                                                      "frames_per_block": 5})
+
+        generate_test_array_stream(frame_shape=default_frame_shape, number_of_frames=default_number_of_frames)
+
+        # Wait for the stream to complete transfer.
+        sleep(0.5)
+
+        self.receiver_node.stop()
+        # Wait for the files to be written.
+        sleep(0.5)
+
+        for shard_file in shard_files:
+            self.assertTrue(os.path.exists(shard_file), "Shard file '%s' does not exist." % shard_file)
+
+        file = h5py.File(default_output_file, 'r')
+        dataset = file[default_dataset_name]
+
+        self.assertTrue(dataset.is_virtual, "Master dataset is not a virtual dataset.")
+        self.assertEqual(dataset.shape, (default_number_of_frames,) + default_frame_shape, "Dataset of incorrect size.")
+
+        for frame_number in range(default_number_of_frames):
+            self.assertTrue((dataset[frame_number] == generate_frame_data(default_frame_shape, frame_number)).all(),
+                            "Dataset data does not match original data for frame %d." % frame_number)
+
+    def test_modulo_shards(self):
+        self._test_sharded_write("modulo")
+
+    def test_block_shards(self):
+        self._test_sharded_write("block")
+
+
+class FailedShardTest(unittest.TestCase):
+    def setUp(self):
+        # The shard 1 folder is a file, so the shard 1 writer fails on its first frame.
+        self.shard_output_file = "ignore_test_output_{shard_number}/shard.h5"
+        self.failing_folder = "ignore_test_output_1"
+        open(self.failing_folder, "w").close()
+
+    def tearDown(self):
+        for filename in (self.shard_output_file.format(shard_number=0), self.failing_folder, default_output_file):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+        if os.path.exists("ignore_test_output_0"):
+            os.rmdir("ignore_test_output_0")
+
+    def test_failed_shard(self):
+        """
+        Test if a failed shard writer does not block the other shards, and its error is raised on stop.
+        """
+        writer = HDF5ShardedWriterProcessor()
+        writer.dataset_name = default_dataset_name
+        writer.output_file = default_output_file
+        writer.shard_output_file = self.shard_output_file
+        writer.shard_queue_size = 2
+
+        writer.start()
+
+        n_frames = 20
+        for frame_index in range(n_frames):
+            header = {"frame": frame_index, "shape": list(default_frame_shape), "type": "int32"}
+            writer.process_message(FrameMessage(header, np.full(default_frame_shape, frame_index, dtype="int32")))
+
+        self.assertRaisesRegex(ValueError, "Shard writer 1 exited", writer.stop)
+
+        # The master file has the frames of the working shard.
+        with h5py.File(default_output_file, "r") as file:
+            dataset = file[default_dataset_name]
+            self.assertListEqual(list(dataset[::2, 0, 0]), list(range(0, n_frames, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()